@@ -1,14 +1,130 @@
-import mysql.connector
-from mysql.connector import Error
-import tkinter as tk
-from tkinter import messagebox, scrolledtext, Entry, Button, Label, LabelFrame, Frame
-from datetime import datetime, timedelta
-from decimal import Decimal
+from datetime import date, timedelta
+from decimal import Decimal, ROUND_HALF_UP
+from functools import lru_cache
+from collections import OrderedDict, deque, namedtuple
+from contextlib import closing, contextmanager
+from itertools import islice
+import argparse
 import hashlib
-
+import json
+import os
+import queue
+import re
+import sqlite3
+import sys
+import threading
+import time
+import uuid
+import weakref
+
+# Number of database connections the application keeps open at most
+POOL_SIZE = 5
+
+# Prepared statements kept open per pooled connection
+STATEMENT_CACHE_SIZE = 64
+
+# Database file used by the embedded SQLite engine unless another one is chosen
+SQLITE_PATH = "HatHive.db"
+
+# Rows shown per page in the table views
+PAGE_SIZE = 100
+
+# Rows returned by a sales report at most
+REPORT_LIMIT = 100
+
+# Search: rows returned by a search, suggestions shown while typing and the pause
+# in typing (milliseconds) before the suggestions are looked up
+SEARCH_LIMIT = 50
+TYPEAHEAD_LIMIT = 8
+TYPEAHEAD_DELAY_MS = 250
+
+# Exports: rows fetched from the database per round trip, gzip level (low levels keep
+# up with the disk) and where the last exported IDs are remembered
+EXPORT_CHUNK_SIZE = 5000
+EXPORT_GZIP_LEVEL = 5
+EXPORT_STATE_FILE = "HatHive-exports.json"
+
+TAX_RATE = Decimal('0.07')  # Example tax rate of 7%
+DELIVERY_DAYS = 5  # Estimated days between ordering and arrival, unless a delivery rule says otherwise
+PAYMENT_METHOD = "Credit Card"  # Example payment method
+
+# Payment queue: gateway calls in flight at once, attempts per bill before it is left
+# Pending for the next start, how many results (or seconds) to collect before
+# writing them back in one batch, and how long a station's claim on a bill lasts
+# before another station may charge it
+PAYMENT_WORKERS = 4
+PAYMENT_ATTEMPTS = 3
+PAYMENT_BATCH_SIZE = 100
+PAYMENT_FLUSH_SECONDS = 0.5
+PAYMENT_CLAIM_SECONDS = 300
+
+# Order journal: the local file orders are written to before the database has them,
+# entries sent to the database per transaction, and the pause (seconds) before the
+# replayer tries again when the database cannot be reached. The status bar's count of
+# waiting orders is updated every JOURNAL_STATUS_MS milliseconds.
+JOURNAL_PATH = "HatHive-journal.jsonl"
+JOURNAL_BATCH_SIZE = 50
+JOURNAL_RETRY_SECONDS = 5
+JOURNAL_STATUS_MS = 1000
+
+# Delivery scheduling: weekdays (Monday is 0) that are not business days, seconds the
+# lead-time rules and holidays are trusted before they are read again, the most
+# deliveries a dispatch list shows and the most days one reschedule can cover
+DELIVERY_WEEKEND = (5, 6)
+DELIVERY_RULES_TTL = 60
+DELIVERY_QUEUE_LIMIT = 500
+DELIVERY_RESCHEDULE_DAYS = 366
+
+# Orders placed per transaction by the bulk intake path
+ORDER_CHUNK_SIZE = 1000
+
+# Archiving: default age (days) of the orders moved out of the hot tables, orders
+# moved per transaction and the pause (seconds) between transactions that lets the
+# tills get their writes in
+ARCHIVE_AFTER_DAYS = 365
+ARCHIVE_BATCH_SIZE = 500
+ARCHIVE_PAUSE = 0.05
+
+# Analytics: rows per fetch while loading the snapshot, the days of sales the
+# sell-through and stock-out forecast look at, the days since a customer's last
+# order that still count as active, and the order lines from which the analyses run
+# in worker processes
+ANALYTICS_CHUNK_SIZE = 50000
+ANALYTICS_WINDOW_DAYS = 28
+ANALYTICS_ACTIVE_DAYS = 90
+ANALYTICS_PARALLEL_LINES = 2000000
+
+# Rows per multi-row INSERT when importing customers and hats
+IMPORT_CHUNK_SIZE = 1000
+
+# In-process hat catalog cache: maximum entries and seconds an entry is trusted
+HAT_CACHE_SIZE = 1000
+HAT_CACHE_TTL = 60
+
+# Statements taking at least this many milliseconds are written to the slow query log
+SLOW_QUERY_MS = 100
+SLOW_QUERY_LOG = "HatHive-slow.log"
+
+# Most recent latencies kept per statement shape for the percentiles
+LATENCY_SAMPLES = 1000
+
+# Milliseconds between refreshes of the diagnostics window
+DIAGNOSTICS_REFRESH_MS = 1000
+
+# Milliseconds between checks for changes to the page on screen when auto-refresh is on
+VIEW_REFRESH_MS = 5000
+
+# Headless service mode: default address, largest page and request body accepted, and
+# the seconds a client connection may sit idle or stall mid-request before it is dropped
+SERVICE_ADDRESS = ("127.0.0.1", 8080)
+SERVICE_MAX_PAGE_SIZE = 1000
+SERVICE_MAX_REQUEST_BYTES = 16 * 1024 * 1024
+SERVICE_TIMEOUT_SECONDS = 30
+
+# Base tables, in creation order (referenced tables first)
 TABLES = {
     'customers': (
-        "CREATE TABLE `customers` ("
+        "CREATE TABLE IF NOT EXISTS `customers` ("
         "  `customer_id` int NOT NULL AUTO_INCREMENT,"
         "  `name` varchar(255) NOT NULL,"
         "  `DOB` date NOT NULL,"
@@ -18,20 +134,8 @@ TABLES = {
         "  PRIMARY KEY (`customer_id`)"
         ") ENGINE=InnoDB"
     ),
-    'orders': (
-        "CREATE TABLE `orders` ("
-        "  `order_id` int NOT NULL AUTO_INCREMENT,"
-        "  `customer_id` int NOT NULL,"
-        "  `hat_id` int NOT NULL,"
-        "  `date` date NOT NULL,"
-        "  `quantity` int NOT NULL,"
-        "  PRIMARY KEY (`order_id`),"
-        "  FOREIGN KEY (`customer_id`) REFERENCES `customers` (`customer_id`) ON DELETE CASCADE,"
-        "  FOREIGN KEY (`hat_id`) REFERENCES `hats` (`hat_id`) ON DELETE CASCADE"
-        ") ENGINE=InnoDB"
-    ),
     'hats': (
-        "CREATE TABLE `hats` ("
+        "CREATE TABLE IF NOT EXISTS `hats` ("
         "  `hat_id` int NOT NULL AUTO_INCREMENT,"
         "  `brand_id` int NOT NULL,"
         "  `brand_name` varchar(255) NOT NULL,"
@@ -42,8 +146,20 @@ TABLES = {
         "  PRIMARY KEY (`hat_id`)"
         ") ENGINE=InnoDB"
     ),
+    'orders': (
+        "CREATE TABLE IF NOT EXISTS `orders` ("
+        "  `order_id` int NOT NULL AUTO_INCREMENT,"
+        "  `customer_id` int NOT NULL,"
+        "  `hat_id` int NOT NULL,"
+        "  `date` date NOT NULL,"
+        "  `quantity` int NOT NULL,"
+        "  PRIMARY KEY (`order_id`),"
+        "  FOREIGN KEY (`customer_id`) REFERENCES `customers` (`customer_id`) ON DELETE CASCADE,"
+        "  FOREIGN KEY (`hat_id`) REFERENCES `hats` (`hat_id`) ON DELETE CASCADE"
+        ") ENGINE=InnoDB"
+    ),
     'bills': (
-        "CREATE TABLE `bills` ("
+        "CREATE TABLE IF NOT EXISTS `bills` ("
         "  `bill_id` int NOT NULL AUTO_INCREMENT,"
         "  `order_id` int NOT NULL,"
         "  `tax` decimal(10,2) NOT NULL,"
@@ -56,7 +172,7 @@ TABLES = {
         ") ENGINE=InnoDB"
     ),
     'delivery': (
-        "CREATE TABLE `delivery` ("
+        "CREATE TABLE IF NOT EXISTS `delivery` ("
         "  `delivery_id` int NOT NULL AUTO_INCREMENT,"
         "  `order_id` int NOT NULL,"
         "  `arrival_date` date NOT NULL,"
@@ -66,578 +182,3591 @@ TABLES = {
     )
 }
 
+# Sales summaries kept up to date by every order so reports never scan the order history
+SUMMARY_TABLES = {
+    'sales_daily_hat': (
+        "CREATE TABLE IF NOT EXISTS `sales_daily_hat` ("
+        "  `sale_date` date NOT NULL,"
+        "  `hat_id` int NOT NULL,"
+        "  `order_count` int NOT NULL,"
+        "  `units` int NOT NULL,"
+        "  `revenue` decimal(14,2) NOT NULL,"
+        "  `tax` decimal(14,2) NOT NULL,"
+        "  PRIMARY KEY (`sale_date`, `hat_id`)"
+        ") ENGINE=InnoDB"
+    ),
+    'sales_daily_brand': (
+        "CREATE TABLE IF NOT EXISTS `sales_daily_brand` ("
+        "  `sale_date` date NOT NULL,"
+        "  `brand_id` int NOT NULL,"
+        "  `order_count` int NOT NULL,"
+        "  `units` int NOT NULL,"
+        "  `revenue` decimal(14,2) NOT NULL,"
+        "  `tax` decimal(14,2) NOT NULL,"
+        "  PRIMARY KEY (`sale_date`, `brand_id`)"
+        ") ENGINE=InnoDB"
+    ),
+    'customer_ltv': (
+        "CREATE TABLE IF NOT EXISTS `customer_ltv` ("
+        "  `customer_id` int NOT NULL,"
+        "  `order_count` int NOT NULL,"
+        "  `units` int NOT NULL,"
+        "  `revenue` decimal(14,2) NOT NULL,"
+        "  `tax` decimal(14,2) NOT NULL,"
+        "  `first_order` date NOT NULL,"
+        "  `last_order` date NOT NULL,"
+        "  PRIMARY KEY (`customer_id`)"
+        ") ENGINE=InnoDB"
+    ),
+}
 
-class DatabaseManager:
-    def __init__(self, host, user, password, db_name):
-        self.host = host
-        self.user = user
-        self.password = password
-        self.db_name = db_name
-        self.connection = None
+# Initial fill of the summaries by migration 4, which predates order lines: back then
+# every order was a single hat and its bill
+SUMMARY_BACKFILL = [
+    "DELETE FROM sales_daily_hat",
+    "INSERT INTO sales_daily_hat (sale_date, hat_id, order_count, units, revenue, tax)"
+    " SELECT o.date, o.hat_id, COUNT(*), SUM(o.quantity), SUM(b.price), SUM(b.tax)"
+    " FROM orders o JOIN bills b ON b.order_id = o.order_id"
+    " GROUP BY o.date, o.hat_id",
+    "DELETE FROM sales_daily_brand",
+    "INSERT INTO sales_daily_brand (sale_date, brand_id, order_count, units, revenue, tax)"
+    " SELECT o.date, h.brand_id, COUNT(*), SUM(o.quantity), SUM(b.price), SUM(b.tax)"
+    " FROM orders o JOIN bills b ON b.order_id = o.order_id JOIN hats h ON h.hat_id = o.hat_id"
+    " GROUP BY o.date, h.brand_id",
+    "DELETE FROM customer_ltv",
+    "INSERT INTO customer_ltv (customer_id, order_count, units, revenue, tax, first_order, last_order)"
+    " SELECT o.customer_id, COUNT(*), SUM(o.quantity), SUM(b.price), SUM(b.tax), MIN(o.date), MAX(o.date)"
+    " FROM orders o JOIN bills b ON b.order_id = o.order_id"
+    " GROUP BY o.customer_id",
+]
+
+# Recompute the summaries from the order lines, archived ones included. An order
+# counts once per hat, brand and customer however many of its lines they appear on.
+SUMMARY_REBUILD = [
+    "DELETE FROM sales_daily_hat",
+    "INSERT INTO sales_daily_hat (sale_date, hat_id, order_count, units, revenue, tax)"
+    " SELECT o.date, l.hat_id, COUNT(DISTINCT o.order_id), SUM(l.quantity), SUM(l.price), SUM(l.tax)"
+    " FROM all_orders o JOIN all_order_lines l ON l.order_id = o.order_id"
+    " GROUP BY o.date, l.hat_id",
+    "DELETE FROM sales_daily_brand",
+    "INSERT INTO sales_daily_brand (sale_date, brand_id, order_count, units, revenue, tax)"
+    " SELECT o.date, h.brand_id, COUNT(DISTINCT o.order_id), SUM(l.quantity), SUM(l.price), SUM(l.tax)"
+    " FROM all_orders o JOIN all_order_lines l ON l.order_id = o.order_id JOIN hats h ON h.hat_id = l.hat_id"
+    " GROUP BY o.date, h.brand_id",
+    "DELETE FROM customer_ltv",
+    "INSERT INTO customer_ltv (customer_id, order_count, units, revenue, tax, first_order, last_order)"
+    " SELECT o.customer_id, COUNT(DISTINCT o.order_id), SUM(l.quantity), SUM(l.price), SUM(l.tax),"
+    " MIN(o.date), MAX(o.date)"
+    " FROM all_orders o JOIN all_order_lines l ON l.order_id = o.order_id"
+    " GROUP BY o.customer_id",
+]
+
+# The hats of an order, one row per hat with its quantity and its share of the bill.
+# orders.hat_id and orders.quantity keep the first line, as older releases read them.
+ORDER_LINES_TABLE = (
+    "CREATE TABLE IF NOT EXISTS `order_lines` ("
+    "  `line_id` int NOT NULL AUTO_INCREMENT,"
+    "  `order_id` int NOT NULL,"
+    "  `hat_id` int NOT NULL,"
+    "  `quantity` int NOT NULL,"
+    "  `price` decimal(10,2) NOT NULL,"
+    "  `tax` decimal(10,2) NOT NULL,"
+    "  PRIMARY KEY (`line_id`),"
+    "  FOREIGN KEY (`order_id`) REFERENCES `orders` (`order_id`) ON DELETE CASCADE,"
+    "  FOREIGN KEY (`hat_id`) REFERENCES `hats` (`hat_id`) ON DELETE CASCADE"
+    ") ENGINE=InnoDB"
+)
+
+# Lead times for deliveries and the days nothing is delivered. A rule applies to one
+# hat, one region (see address_region) or both; one with neither is the shop default.
+DELIVERY_TABLES = {
+    'delivery_rules': (
+        "CREATE TABLE IF NOT EXISTS `delivery_rules` ("
+        "  `rule_id` int NOT NULL AUTO_INCREMENT,"
+        "  `hat_id` int,"
+        "  `region` varchar(64),"
+        "  `lead_days` int NOT NULL,"
+        "  `business_days` tinyint NOT NULL DEFAULT 0,"
+        "  PRIMARY KEY (`rule_id`),"
+        "  FOREIGN KEY (`hat_id`) REFERENCES `hats` (`hat_id`) ON DELETE CASCADE"
+        ") ENGINE=InnoDB"
+    ),
+    'delivery_holidays': (
+        "CREATE TABLE IF NOT EXISTS `delivery_holidays` ("
+        "  `day` date NOT NULL,"
+        "  `description` varchar(255),"
+        "  PRIMARY KEY (`day`)"
+        ") ENGINE=InnoDB"
+    ),
+}
 
-    def connect(self):
-        try:
-            self.connection = mysql.connector.connect(
-                host=self.host,
-                user=self.user,
-                password=self.password
-            )
-            if self.connection.is_connected():
-                db_info = self.connection.get_server_info()
-                print(f"Connected to MySQL Server version {db_info}")
-                cursor = self.connection.cursor()
-                cursor.execute(f"CREATE DATABASE IF NOT EXISTS {self.db_name}")
-                cursor.execute(f"USE {self.db_name}")
-                print(f"You're connected to database: {self.db_name}")
-        except Error as e:
-            print(f"Error while connecting to MySQL: {e}")
-
-    def ensure_table_columns(self):
-        # Ensure the bills table has all the required columns
-        alter_queries = [
-            "ALTER TABLE bills ADD COLUMN payment_status VARCHAR(255)",
-            "ALTER TABLE bills ADD COLUMN transaction_id VARCHAR(255)"
+# Archived orders, order lines, bills and deliveries keep their IDs; the columns are
+# those of the hot tables, without foreign keys so old rows never block new ones
+ARCHIVE_TABLES = {
+    'orders_archive': (
+        "CREATE TABLE IF NOT EXISTS `orders_archive` ("
+        "  `order_id` int NOT NULL,"
+        "  `customer_id` int NOT NULL,"
+        "  `hat_id` int NOT NULL,"
+        "  `date` date NOT NULL,"
+        "  `quantity` int NOT NULL,"
+        "  PRIMARY KEY (`order_id`)"
+        ") ENGINE=InnoDB"
+    ),
+    'order_lines_archive': (
+        "CREATE TABLE IF NOT EXISTS `order_lines_archive` ("
+        "  `line_id` int NOT NULL,"
+        "  `order_id` int NOT NULL,"
+        "  `hat_id` int NOT NULL,"
+        "  `quantity` int NOT NULL,"
+        "  `price` decimal(10,2) NOT NULL,"
+        "  `tax` decimal(10,2) NOT NULL,"
+        "  PRIMARY KEY (`line_id`)"
+        ") ENGINE=InnoDB"
+    ),
+    'bills_archive': (
+        "CREATE TABLE IF NOT EXISTS `bills_archive` ("
+        "  `bill_id` int NOT NULL,"
+        "  `order_id` int NOT NULL,"
+        "  `tax` decimal(10,2) NOT NULL,"
+        "  `price` decimal(10,2) NOT NULL,"
+        "  `payment_method` varchar(255) NOT NULL,"
+        "  `payment_status` varchar(255),"
+        "  `transaction_id` varchar(255),"
+        "  PRIMARY KEY (`bill_id`)"
+        ") ENGINE=InnoDB"
+    ),
+    'delivery_archive': (
+        "CREATE TABLE IF NOT EXISTS `delivery_archive` ("
+        "  `delivery_id` int NOT NULL,"
+        "  `order_id` int NOT NULL,"
+        "  `arrival_date` date NOT NULL,"
+        "  PRIMARY KEY (`delivery_id`)"
+        ") ENGINE=InnoDB"
+    ),
+}
+
+# Columns moved by the archiver, per hot table; orders must come last as the other
+# tables reference it
+ARCHIVED_COLUMNS = {
+    'order_lines': "line_id, order_id, hat_id, quantity, price, tax",
+    'bills': "bill_id, order_id, tax, price, payment_method, payment_status, transaction_id",
+    'delivery': "delivery_id, order_id, arrival_date, status, region, version",
+    'orders': "order_id, customer_id, hat_id, date, quantity, journal_key",
+}
+
+
+# Statements (re)creating the all_<table> views, which read the hot and archived rows
+# together, over `archived_columns`. A migration that archives more columns recreates
+# them; earlier migrations pass the columns the tables had at their version.
+def archive_views(archived_columns):
+    statements = []
+    for table, columns in archived_columns.items():
+        select = f"SELECT {columns} FROM {table} UNION ALL SELECT {columns} FROM {table}_archive"
+        statements += [
+            {'SQLite': f"DROP VIEW IF EXISTS all_{table}"},
+            {'MySQL': f"CREATE OR REPLACE VIEW all_{table} AS {select}",
+             'SQLite': f"CREATE VIEW all_{table} AS {select}"},
         ]
+    return statements
+
+
+SCHEMA_VERSION_TABLE = (
+    "CREATE TABLE IF NOT EXISTS `schema_version` ("
+    "  `version` int NOT NULL,"
+    "  `description` varchar(255) NOT NULL,"
+    "  `applied_at` timestamp NOT NULL DEFAULT CURRENT_TIMESTAMP,"
+    "  PRIMARY KEY (`version`)"
+    ")"
+)
+
+# Ordered schema migrations as (version, description, statements). Statements must be
+# safe against a database that already has their effect: databases created before
+# versioning existed have the base tables but no schema_version rows, and two
+# stations may migrate at the same time. "Already exists" errors are ignored.
+# A statement that differs between engines is a dict keyed by backend name; engines
+# missing from the dict skip it.
+MIGRATIONS = [
+    (1, "Base tables", list(TABLES.values()) + [
+        # Databases from the earliest releases lack the payment columns
+        "ALTER TABLE bills ADD COLUMN payment_status VARCHAR(255)",
+        "ALTER TABLE bills ADD COLUMN transaction_id VARCHAR(255)",
+    ]),
+    (2, "Secondary indexes for lookups and joins", [
+        "CREATE INDEX idx_orders_date ON orders (date)",
+        "CREATE INDEX idx_orders_customer_date ON orders (customer_id, date)",
+        "CREATE INDEX idx_delivery_arrival_date ON delivery (arrival_date)",
+        "CREATE INDEX idx_bills_status_order ON bills (payment_status, order_id)",
+        "CREATE INDEX idx_customers_email ON customers (email)",
+        "CREATE INDEX idx_hats_brand_style_size ON hats (brand_id, style, size)",
+    ]),
+    (3, "Row version on hats for cache revalidation", [
+        "ALTER TABLE hats ADD COLUMN version int NOT NULL DEFAULT 0",
+    ]),
+    (4, "Sales summary tables", list(SUMMARY_TABLES.values()) + SUMMARY_BACKFILL),
+    # SQLite only uses an index for a case-insensitive LIKE when the index is NOCASE
+    (5, "Indexes for prefix search", [
+        {'MySQL': "CREATE INDEX idx_customers_name ON customers (name)",
+         'SQLite': "CREATE INDEX idx_customers_name ON customers (name COLLATE NOCASE)"},
+        {'SQLite': "CREATE INDEX idx_customers_email_nocase ON customers (email COLLATE NOCASE)"},
+        {'MySQL': "CREATE INDEX idx_hats_brand_name_style_size ON hats (brand_name, style, size)",
+         'SQLite': "CREATE INDEX idx_hats_brand_name_style_size"
+                   " ON hats (brand_name COLLATE NOCASE, style COLLATE NOCASE, size)"},
+    ]),
+    # MySQL indexes foreign key columns by itself; SQLite needs them spelled out.
+    # Every existing order becomes a single line carrying its whole bill.
+    (6, "Order lines for multi-item orders", [
+        ORDER_LINES_TABLE,
+        {'SQLite': "CREATE INDEX idx_order_lines_order ON order_lines (order_id)"},
+        {'SQLite': "CREATE INDEX idx_order_lines_hat ON order_lines (hat_id)"},
+        "INSERT INTO order_lines (order_id, hat_id, quantity, price, tax)"
+        " SELECT o.order_id, o.hat_id, o.quantity, b.price, b.tax"
+        " FROM orders o JOIN bills b ON b.order_id = o.order_id"
+        " WHERE NOT EXISTS (SELECT 1 FROM order_lines l WHERE l.order_id = o.order_id)",
+    ]),
+    (7, "Archive tables for old orders", list(ARCHIVE_TABLES.values()) + archive_views(
+        {**ARCHIVED_COLUMNS, 'delivery': "delivery_id, order_id, arrival_date",
+         'orders': "order_id, customer_id, hat_id, date, quantity"}) + [
+        "CREATE INDEX idx_orders_archive_date ON orders_archive (date)",
+        "CREATE INDEX idx_orders_archive_customer_date ON orders_archive (customer_id, date)",
+        "CREATE INDEX idx_order_lines_archive_order ON order_lines_archive (order_id)",
+        "CREATE INDEX idx_bills_archive_order ON bills_archive (order_id)",
+        "CREATE INDEX idx_delivery_archive_order ON delivery_archive (order_id)",
+        # The archiver looks bills and deliveries up by order
+        {'SQLite': "CREATE INDEX idx_bills_order ON bills (order_id)"},
+        {'SQLite': "CREATE INDEX idx_delivery_order ON delivery (order_id)"},
+    ]),
+    (8, "Row version on bills for view refresh", [
+        "ALTER TABLE bills ADD COLUMN version int NOT NULL DEFAULT 0",
+    ]),
+    # Orders replayed from a station's order journal carry the entry's key
+    (9, "Order journal keys", [
+        "ALTER TABLE orders ADD COLUMN journal_key varchar(64)",
+        "CREATE UNIQUE INDEX idx_orders_journal_key ON orders (journal_key)",
+    ]),
+    # Deliveries whose arrival date has passed were treated as delivered so far
+    (10, "Delivery scheduling", list(DELIVERY_TABLES.values()) + [
+        "ALTER TABLE delivery ADD COLUMN status varchar(20) NOT NULL DEFAULT 'Scheduled'",
+        "ALTER TABLE delivery ADD COLUMN region varchar(64)",
+        "ALTER TABLE delivery ADD COLUMN version int NOT NULL DEFAULT 0",
+        "UPDATE delivery SET status = 'Delivered' WHERE arrival_date < CURRENT_DATE AND status = 'Scheduled'",
+        # address_region in SQL for the deliveries still to come; SQLite has no
+        # SUBSTRING_INDEX, so the part after the last comma is cut off with RTRIM
+        {'MySQL': "UPDATE delivery d JOIN orders o ON o.order_id = d.order_id"
+                  " JOIN customers c ON c.customer_id = o.customer_id"
+                  " SET d.region = NULLIF(LEFT(LOWER(TRIM(SUBSTRING_INDEX(c.address, ',', -1))), 64), '')"
+                  " WHERE d.status = 'Scheduled'",
+         'SQLite': "UPDATE delivery SET region = (SELECT NULLIF(SUBSTR(LOWER(TRIM(SUBSTR(c.address,"
+                   " LENGTH(RTRIM(c.address, REPLACE(c.address, ',', ''))) + 1))), 1, 64), '')"
+                   " FROM orders o JOIN customers c ON c.customer_id = o.customer_id"
+                   " WHERE o.order_id = delivery.order_id) WHERE status = 'Scheduled'"},
+        "CREATE INDEX idx_delivery_status_arrival ON delivery (status, arrival_date)",
+        "CREATE INDEX idx_delivery_region_status_arrival ON delivery (region, status, arrival_date)",
+        {'SQLite': "CREATE INDEX idx_delivery_rules_hat ON delivery_rules (hat_id)"},
+    ]),
+    # Deliveries archived before this were past their arrival date, hence delivered
+    (11, "Delivery scheduling columns on archived deliveries", [
+        "ALTER TABLE delivery_archive ADD COLUMN status varchar(20) NOT NULL DEFAULT 'Delivered'",
+        "ALTER TABLE delivery_archive ADD COLUMN region varchar(64)",
+        "ALTER TABLE delivery_archive ADD COLUMN version int NOT NULL DEFAULT 0",
+    ] + archive_views({**ARCHIVED_COLUMNS, 'orders': "order_id, customer_id, hat_id, date, quantity"})),
+    # The journal replay looks keys up in both tables, so an archived order is never
+    # placed again
+    (12, "Journal keys on archived orders", [
+        "ALTER TABLE orders_archive ADD COLUMN journal_key varchar(64)",
+        "CREATE UNIQUE INDEX idx_orders_archive_journal_key ON orders_archive (journal_key)",
+    ] + archive_views(ARCHIVED_COLUMNS)),
+    # A station claims a bill (Processing, until an epoch second) before charging it
+    (13, "Payment claims on bills", [
+        "ALTER TABLE bills ADD COLUMN claimed_until bigint",
+    ]),
+    # The bulk intake tags its rows here while it reads their IDs back. It used to put
+    # the tags (a 32-digit batch ID, a dash and the row number) in journal_key, where
+    # they would pass for journal entries, so those are cleared.
+    (14, "Bulk intake tags on orders", [
+        "ALTER TABLE orders ADD COLUMN intake_tag varchar(64)",
+        "CREATE UNIQUE INDEX idx_orders_intake_tag ON orders (intake_tag)",
+        "UPDATE orders SET journal_key = NULL WHERE journal_key LIKE '" + "_" * 32 + "-%'",
+        "UPDATE orders_archive SET journal_key = NULL WHERE journal_key LIKE '" + "_" * 32 + "-%'",
+    ]),
+]
+
+# Paginated table views. Every query selects its keyset column first; pages are
+# fetched with `WHERE key > last ORDER BY key LIMIT n` so each page costs the same
+# no matter how deep into the table it is. `versions` selects each row's key and a
+# number that changes whenever the row does (0 for rows that never change), so a page
+# on screen can be brought up to date by re-reading only what changed.
+VIEWS = {
+    'customers': {
+        'query': "SELECT customer_id, name, DOB, email, contact_info, address FROM customers",
+        'key': "customer_id",
+        'versions': "SELECT customer_id, 0 FROM customers",
+        'headers': ["ID", "Name", "DOB", "Email", "Contact", "Address"],
+        'label': "customer",
+    },
+    'hats': {
+        'query': "SELECT hat_id, brand_id, brand_name, style, size, quantity, price FROM hats",
+        'key': "hat_id",
+        'versions': "SELECT hat_id, version FROM hats",
+        'headers': ["ID", "Brand ID", "Brand Name", "Style", "Size", "Quantity", "Price"],
+        'label': "hat",
+    },
+    'orders': {
+        'query': "SELECT order_id, customer_id, hat_id, date, quantity FROM orders",
+        'key': "order_id",
+        'versions': "SELECT order_id, 0 FROM orders",
+        'headers': ["Order ID", "Customer ID", "Hat ID", "Order Date", "Quantity"],
+        'label': "order",
+    },
+    'order_lines': {
+        'query': "SELECT order_lines.line_id, order_lines.order_id, order_lines.hat_id, hats.brand_name, hats.style,"
+                 " order_lines.quantity, order_lines.price, order_lines.tax"
+                 " FROM order_lines JOIN hats ON hats.hat_id = order_lines.hat_id",
+        'key': "order_lines.line_id",
+        'versions': "SELECT order_lines.line_id, 0 FROM order_lines",
+        'headers': ["Line ID", "Order ID", "Hat ID", "Brand Name", "Style", "Quantity", "Price", "Tax"],
+        'label': "order line",
+    },
+    'deliveries': {
+        'query': "SELECT delivery.delivery_id, orders.order_id, delivery.arrival_date, delivery.status,"
+                 " delivery.region FROM delivery JOIN orders ON delivery.order_id = orders.order_id",
+        'key': "delivery.delivery_id",
+        'versions': "SELECT delivery.delivery_id, delivery.version FROM delivery",
+        'headers': ["Delivery ID", "Order ID", "Arrival Date", "Status", "Region"],
+        'label': "delivery",
+    },
+    'bills': {
+        'query': "SELECT bill_id, order_id, tax, price, payment_method, payment_status FROM bills",
+        'key': "bill_id",
+        'versions': "SELECT bill_id, version FROM bills",
+        'headers': ["Bill ID", "Order ID", "Tax", "Price", "Payment Method", "Payment Status"],
+        'label': "billing",
+    },
+}
 
-        with self.connection.cursor() as cursor:
-            for query in alter_queries:
-                try:
-                    cursor.execute(query)
-                    self.connection.commit()
-                except Error as e:
-                    if e.errno == mysql.connector.errorcode.ER_DUP_FIELDNAME:
-                        print("Column already exists: ", e)
-                    else:
-                        raise
-
-    def create_tables(self):
-        self.ensure_table_columns()  # Call this method before creating tables
-        cursor = self.connection.cursor()
-        for table_name, ddl in TABLES.items():
-            try:
-                print(f"Creating table {table_name}: ", end='')
-                cursor.execute(ddl)
-            except mysql.connector.Error as err:
-                if err.errno == mysql.connector.errorcode.ER_TABLE_EXISTS_ERROR:
-                    print("already exists.")
-                else:
-                    print(err.msg)
-            else:
-                print("OK")
-        cursor.close()
+# Sales reports over the summary tables. `{where}` receives the date range filter on
+# the `start`/`end` columns; rows come back ordered and limited to REPORT_LIMIT. The
+# `money` columns are returned as Decimals in cents whatever the engine.
+REPORTS = {
+    'daily': {
+        'query': "SELECT sale_date, SUM(order_count), SUM(units), SUM(revenue), SUM(tax)"
+                 " FROM sales_daily_brand {where} GROUP BY sale_date ORDER BY sale_date DESC",
+        'start': "sale_date",
+        'end': "sale_date",
+        'headers': ["Date", "Orders", "Units", "Revenue", "Tax"],
+        'money': (3, 4),
+        'label': "Daily sales",
+    },
+    'hats': {
+        'query': "SELECT s.hat_id, h.brand_name, h.style, h.size, SUM(s.order_count), SUM(s.units), SUM(s.revenue)"
+                 " FROM sales_daily_hat s JOIN hats h ON h.hat_id = s.hat_id {where}"
+                 " GROUP BY s.hat_id, h.brand_name, h.style, h.size ORDER BY SUM(s.revenue) DESC",
+        'start': "s.sale_date",
+        'end': "s.sale_date",
+        'headers': ["Hat ID", "Brand", "Style", "Size", "Orders", "Units", "Revenue"],
+        'money': (6,),
+        'label': "Sales by hat",
+    },
+    'brands': {
+        'query': "SELECT s.brand_id, b.brand_name, SUM(s.order_count), SUM(s.units), SUM(s.revenue)"
+                 " FROM sales_daily_brand s"
+                 " JOIN (SELECT brand_id, MAX(brand_name) AS brand_name FROM hats GROUP BY brand_id) b"
+                 " ON b.brand_id = s.brand_id {where}"
+                 " GROUP BY s.brand_id, b.brand_name ORDER BY SUM(s.revenue) DESC",
+        'start': "s.sale_date",
+        'end': "s.sale_date",
+        'headers': ["Brand ID", "Brand", "Orders", "Units", "Revenue"],
+        'money': (4,),
+        'label': "Sales by brand",
+    },
+    # Lifetime totals; the date range selects customers who ordered within it
+    'customers': {
+        'query': "SELECT l.customer_id, c.name, c.email, l.order_count, l.units, l.revenue, l.first_order,"
+                 " l.last_order FROM customer_ltv l JOIN customers c ON c.customer_id = l.customer_id {where}"
+                 " ORDER BY l.revenue DESC",
+        'start': "l.last_order",
+        'end': "l.first_order",
+        'headers': ["Customer ID", "Name", "Email", "Orders", "Units", "Lifetime Value", "First Order", "Last Order"],
+        'money': (5,),
+        'label': "Customer lifetime value",
+    },
+}
 
-    def execute_query(self, query, params=None):
-        with self.connection.cursor() as cursor:
-            try:
-                cursor.execute(query, params or ())
-                if query.strip().lower().startswith("select"):
-                    return cursor.fetchall()  # Return the result for 'select' queries
-                self.connection.commit()  # Commit changes for 'insert', 'update', 'delete'
-                return None  # For non-select queries, we don't need to return anything
-            except Error as e:
-                print(f"An error occurred: {e}")
-                raise
+# Column headings of the search results
+SEARCH_HEADERS = {
+    'customers': ["ID", "Name", "Email", "Contact"],
+    'hats': ["ID", "Brand Name", "Style", "Size", "Quantity", "Price"],
+    'orders': ["Order ID", "Date", "Customer ID", "Hat ID", "Hat", "Quantity", "Price", "Status"],
+}
 
-    def close(self):
-        if self.connection and self.connection.is_connected():
-            self.connection.close()
-            print("MySQL connection is closed")
+# Exportable data. Like VIEWS, every query selects its key first; rows are streamed in
+# key order and can be limited to a range of `date` or to keys after a given one.
+# Archived tables are written as {orders}, {bills}, ... so that the hot and archived
+# rows can both be read (see DatabaseManager.export_chunks).
+EXPORTS = {
+    'orders': {
+        'query': "SELECT order_id, customer_id, hat_id, date, quantity FROM {orders}",
+        'key': "order_id",
+        'date': "date",
+        'columns': ["order_id", "customer_id", "hat_id", "date", "quantity"],
+    },
+    'bills': {
+        'query': "SELECT b.bill_id, b.order_id, o.date, b.price, b.tax, b.payment_method, b.payment_status,"
+                 " b.transaction_id FROM {bills} b JOIN {orders} o ON o.order_id = b.order_id",
+        'key': "b.bill_id",
+        'date': "o.date",
+        'columns': ["bill_id", "order_id", "order_date", "price", "tax", "payment_method", "payment_status",
+                    "transaction_id"],
+    },
+    'deliveries': {
+        'query': "SELECT delivery_id, order_id, arrival_date FROM {delivery}",
+        'key': "delivery_id",
+        'date': "arrival_date",
+        'columns': ["delivery_id", "order_id", "arrival_date"],
+    },
+    # One row per order line; all lines of an order are written together
+    'order_details': {
+        'query': "SELECT o.order_id, o.date, o.customer_id, c.name, c.email, l.hat_id, h.brand_name, h.style, h.size,"
+                 " l.quantity, l.price, l.tax, b.price, b.tax, b.payment_method, b.payment_status, b.transaction_id,"
+                 " d.arrival_date"
+                 " FROM {orders} o JOIN customers c ON c.customer_id = o.customer_id"
+                 " JOIN {order_lines} l ON l.order_id = o.order_id"
+                 " JOIN hats h ON h.hat_id = l.hat_id"
+                 " LEFT JOIN {bills} b ON b.order_id = o.order_id"
+                 " LEFT JOIN {delivery} d ON d.order_id = o.order_id",
+        'key': "o.order_id",
+        'date': "o.date",
+        'columns': ["order_id", "order_date", "customer_id", "customer_name", "customer_email", "hat_id",
+                    "brand_name", "style", "size", "quantity", "price", "tax", "order_price", "order_tax",
+                    "payment_method", "payment_status", "transaction_id", "arrival_date"],
+    },
+}
 
+EXPORT_FORMATS = ("csv", "jsonl", "parquet")
 
-# Utility function to validate the date format
-def validate_date(date_text):
-    try:
-        if date_text != datetime.strptime(date_text, "%Y-%m-%d").strftime('%Y-%m-%d'):
-            raise ValueError
-        return True
-    except ValueError:
-        return False
+# Delivery statuses, in the order a delivery goes through them; all but the last
+# still need work from dispatch
+DELIVERY_STATUSES = ("Scheduled", "Dispatched", "Delivered")
+DELIVERY_OPEN = DELIVERY_STATUSES[:-1]
 
+# Dispatch work lists: open deliveries due from `start` up to (not including) `end`
+# days after today; no `start` means no lower bound
+DELIVERY_QUEUES = {
+    'today': {'start': 0, 'end': 1, 'label': "Due today"},
+    'overdue': {'start': None, 'end': 0, 'label': "Overdue"},
+    'week': {'start': 0, 'end': 7, 'label': "Due this week"},
+}
 
-class HatHiveApp:
-    def __init__(self, master):
-        self.master = master
-        self.master.title("HatHive: Hat Sales Management System")
-        self.db_manager = None
-        self.setup_gui()
-
-    def setup_gui(self):
-        self.master.geometry('1024x768')
-
-        # Left panel for inputs and actions
-        input_frame = LabelFrame(self.master, text="Database Connection", padx=5, pady=5)
-        input_frame.pack(side="left", padx=10, pady=10, fill="both")
-
-        Label(input_frame, text="Host:").grid(row=0, column=0, sticky="w")
-        self.host_entry = Entry(input_frame)
-        self.host_entry.grid(row=0, column=1, sticky="ew")
-
-        Label(input_frame, text="User:").grid(row=1, column=0, sticky="w")
-        self.user_entry = Entry(input_frame)
-        self.user_entry.grid(row=1, column=1, sticky="ew")
-
-        Label(input_frame, text="Password:").grid(row=2, column=0, sticky="w")
-        self.password_entry = Entry(input_frame, show="*")
-        self.password_entry.grid(row=2, column=1, sticky="ew")
-
-        connect_button = Button(input_frame, text="Connect", command=self.connect_to_database)
-        connect_button.grid(row=3, column=1, sticky="ew", pady=5)
-
-        # Right panel for displaying results
-        output_frame = Frame(self.master, padx=5, pady=5)
-        output_frame.pack(side="right", expand=True, fill="both")
-        self.query_result = scrolledtext.ScrolledText(output_frame, height=20)
-        self.query_result.pack(fill="both", expand=True)
-
-        # Customer related actions
-        customer_action_frame = Frame(input_frame, padx=5, pady=5)
-        customer_action_frame.grid(row=4, column=0, columnspan=2, sticky="ew")
-        Button(customer_action_frame, text="View Customers", command=self.view_customers).pack(side="left", padx=5)
-        Button(customer_action_frame, text="Add Customer", command=self.add_customer).pack(side="left", padx=5)
-
-        # Hat related actions
-        hat_action_frame = Frame(input_frame, padx=5, pady=5)
-        hat_action_frame.grid(row=5, column=0, columnspan=2, sticky="ew")
-        Button(hat_action_frame, text="View Hats", command=self.view_hats).pack(side="left", padx=5)
-        Button(hat_action_frame, text="Add Hat", command=self.add_hat).pack(side="left", padx=5)
-
-        # Order related actions
-        order_action_frame = Frame(input_frame, padx=5, pady=5)
-        order_action_frame.grid(row=6, column=0, columnspan=2, sticky="ew")
-        Button(order_action_frame, text="Place Order", command=self.add_order).pack(side="left", padx=5)
-        Button(order_action_frame, text="View Orders", command=self.view_orders).pack(side="left", padx=5)
-
-        # Delivery related actions
-        delivery_action_frame = Frame(input_frame, padx=5, pady=5)
-        delivery_action_frame.grid(row=8, column=0, columnspan=2, sticky="ew")
-        Button(delivery_action_frame, text="View Deliveries", command=self.view_deliveries).pack(side="left", padx=5)
-
-        # Billing actions
-        billing_action_frame = Frame(input_frame, padx=5, pady=5)
-        billing_action_frame.grid(row=9, column=0, columnspan=2, sticky="ew")
-        Button(billing_action_frame, text="View Bills", command=self.view_bills).pack(side="left", padx=5)
-
-        # Application-wide actions
-        app_action_frame = Frame(input_frame, padx=5, pady=5)
-        app_action_frame.grid(row=7, column=0, columnspan=2, sticky="ew")
-        Button(app_action_frame, text="Clear All Data", command=self.clear_all_data).pack(side="left", padx=5)
-        Button(app_action_frame, text="Exit", command=self.on_closing).pack(side="left", padx=5)
-
-    def connect_to_database(self):
-        host = self.host_entry.get()
-        user = self.user_entry.get()
-        password = self.password_entry.get()
-        try:
-            self.db_manager = DatabaseManager(host, user, password, 'HatHive')
-            self.db_manager.connect()
-            self.db_manager.create_tables()  # Ensure tables and columns are created after connection
-            messagebox.showinfo("Connection", "Connected to the database successfully.")
-        except Error as e:
-            messagebox.showerror("Database Connection", f"An error occurred: {e}")
-
-    # Function to fetch and display customers from the database
-    def view_customers(self):
-        query = "SELECT * FROM customers"
-        try:
-            records = self.db_manager.execute_query(query)
-            self.query_result.delete('1.0', tk.END)
+DELIVERY_QUEUE_HEADERS = ["Delivery ID", "Order ID", "Arrival Date", "Status", "Region", "Customer", "Address"]
+
+# Inventory and customer analytics computed by AnalyticsSnapshot
+ANALYTICS = {
+    'sell-through': {
+        'headers': ["Style", "Size", f"Sold ({ANALYTICS_WINDOW_DAYS} days)", "In Stock", "Sell-through %"],
+        'label': "Sell-through by style and size",
+    },
+    'stockouts': {
+        'headers': ["Hat ID", "Brand", "Style", "Size", "In Stock", "Sold/Day", "Days Left", "Stock-out Date"],
+        'label': "Stock-out forecast",
+    },
+    'cohorts': {
+        'headers': ["Cohort", "Customers", "Orders", "Revenue", "Revenue/Customer", "Repeat %",
+                    f"Active {ANALYTICS_ACTIVE_DAYS}d %", "Paid %"],
+        'label': "Customer cohorts by first order month",
+    },
+}
 
-            # Dynamically compute column widths
-            col_widths = [max(len(str(row[i])) for row in records) for i in range(len(records[0]))]
 
-            headers = ["ID", "Name", "DOB", "Email", "Contact", "Address"]
-            header_string = "".join(h.ljust(col_widths[i] + 2) for i, h in enumerate(headers))
+class DatabaseError(Exception):
+    # Raised by HatHive itself for database problems that are not driver errors
+    pass
 
-            # Add headers
-            self.query_result.insert(tk.END, header_string + "\n")
-            self.query_result.insert(tk.END, "-" * len(header_string) + "\n")
 
-            for record in records:
-                formatted_record = "".join(str(field).ljust(col_widths[i] + 2) for i, field in enumerate(record))
-                self.query_result.insert(tk.END, formatted_record + "\n")
-        except Exception as e:
-            messagebox.showerror("Database Error", f"An error occurred: {e}")
-
-    # Function to add a new customer to the database
-    def add_customer(self):
-        # Open a new window to input new customer details
-        add_window = tk.Toplevel(self.master)
-        add_window.title("Add New Customer")
-
-        Label(add_window, text="Name:").grid(row=0, column=0)
-        name_entry = Entry(add_window)
-        name_entry.grid(row=0, column=1)
-
-        Label(add_window, text="Date of Birth (YYYY-MM-DD):").grid(row=1, column=0)
-        dob_entry = Entry(add_window)
-        dob_entry.grid(row=1, column=1)
-
-        Label(add_window, text="Email:").grid(row=2, column=0)
-        email_entry = Entry(add_window)
-        email_entry.grid(row=2, column=1)
-
-        Label(add_window, text="Contact Info:").grid(row=3, column=0)
-        contact_info_entry = Entry(add_window)
-        contact_info_entry.grid(row=3, column=1)
-
-        Label(add_window, text="Address:").grid(row=4, column=0)
-        address_entry = Entry(add_window)
-        address_entry.grid(row=4, column=1)
-
-        submit_button = Button(add_window, text="Submit", command=lambda: self.submit_new_customer(
-            name_entry.get(),
-            dob_entry.get(),
-            email_entry.get(),
-            contact_info_entry.get(),
-            address_entry.get(),
-            add_window
-        ))
-        submit_button.grid(row=5, column=1, pady=5)
-
-    def submit_new_customer(self, name, dob, email, contact_info, address, window):
-        if not all([name, dob, email, contact_info, address]):
-            messagebox.showwarning("Warning", "All fields are required to add a new customer.")
-            return
+class OrderError(Exception):
+    # Raised when an order cannot be placed for a business reason (unknown customer,
+    # not enough stock, ...) rather than because of a database failure.
+    pass
 
-        if not validate_date(dob):
-            messagebox.showerror("Invalid Date", "The Date of Birth is in an incorrect format. Please use YYYY-MM-DD.")
-            return
 
-        query = "INSERT INTO customers (name, DOB, email, contact_info, address) VALUES (%s, %s, %s, %s, %s)"
-        try:
-            self.db_manager.execute_query(query, (name, dob, email, contact_info, address))
-            messagebox.showinfo("Success", "New customer added successfully.")
-            window.destroy()  # Close the add new customer window
-            self.view_customers()  # Refresh the customer view
-        except Exception as e:
-            messagebox.showerror("Database Error", f"An error occurred: {e}")
+class PaymentDeclined(Exception):
+    # Raised by a payment gateway that refused the charge. Any other exception from a
+    # gateway is taken as a temporary failure and the charge is retried.
+    pass
 
-    def view_hats(self):
-        query = "SELECT * FROM hats"
-        try:
-            records = self.db_manager.execute_query(query)
-            self.query_result.delete('1.0', tk.END)
 
-            # Dynamically compute column widths
-            col_widths = [max(len(str(row[i])) for row in records) for i in range(len(records[0]))]
+def calculate_tax(total_price):
+    # Rounded to cents like the DECIMAL(10,2) column it is stored in
+    return (total_price * TAX_RATE).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
 
-            headers = ["ID", "Brand ID", "Brand Name", "Style", "Size", "Quantity"]
-            header_string = "".join(h.ljust(col_widths[i] + 2) for i, h in enumerate(headers))
 
-            # Add headers
-            self.query_result.insert(tk.END, header_string + "\n")
-            self.query_result.insert(tk.END, "-" * len(header_string) + "\n")
+def make_transaction_id(order_id, amount_due):
+    # In a real system the payment processor/gateway would hand out the transaction id.
+    # Simulate generating a secure hash for the transaction (in reality, use secure methods)
+    return hashlib.sha256(f"{order_id}{amount_due}".encode()).hexdigest()
 
-            for record in records:
-                formatted_record = "".join(str(field).ljust(col_widths[i] + 2) for i, field in enumerate(record))
-                self.query_result.insert(tk.END, formatted_record + "\n")
-        except Exception as e:
-            messagebox.showerror("Database Error", f"An error occurred: {e}")
-
-    def add_hat(self):
-        add_hat_window = tk.Toplevel(self.master)
-        add_hat_window.title("Add New Hat")
-
-        Label(add_hat_window, text="Brand ID:").grid(row=0, column=0)
-        brand_id_entry = Entry(add_hat_window)
-        brand_id_entry.grid(row=0, column=1)
-
-        Label(add_hat_window, text="Brand Name:").grid(row=1, column=0)
-        brand_name_entry = Entry(add_hat_window)
-        brand_name_entry.grid(row=1, column=1)
-
-        Label(add_hat_window, text="Style:").grid(row=2, column=0)
-        style_entry = Entry(add_hat_window)
-        style_entry.grid(row=2, column=1)
-
-        Label(add_hat_window, text="Size:").grid(row=3, column=0)
-        size_entry = Entry(add_hat_window)
-        size_entry.grid(row=3, column=1)
-
-        Label(add_hat_window, text="Quantity:").grid(row=4, column=0)
-        quantity_entry = Entry(add_hat_window)
-        quantity_entry.grid(row=4, column=1)
-
-        submit_button = Button(add_hat_window, text="Submit", command=lambda: self.submit_new_hat(
-            brand_id_entry.get(),
-            brand_name_entry.get(),
-            style_entry.get(),
-            size_entry.get(),
-            quantity_entry.get(),
-            add_hat_window
-        ))
-        submit_button.grid(row=5, column=1, pady=5)
-
-    def submit_new_hat(self, brand_id, brand_name, style, size, quantity, window):
-        if not all([brand_id, brand_name, style, size, quantity]):
-            messagebox.showwarning("Warning", "All fields are required to add a new hat.")
+
+# Merge streams of row chunks, each in order of the first column, into one such
+# stream of chunks of at most `size` rows
+def merge_chunks(streams, size):
+    import heapq
+    try:
+        rows = heapq.merge(*[(row for chunk in stream for row in chunk) for stream in streams],
+                           key=lambda row: row[0])
+        yield from chunked(rows, size)
+    finally:
+        for stream in streams:
+            stream.close()
+
+
+# Split an iterable into lists of at most `size` items without materialising it
+def chunked(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
             return
+        yield chunk
 
-        # Additional validation can go here (e.g., check if size is an integer)
 
-        query = "INSERT INTO hats (brand_id, brand_name, style, size, quantity) VALUES (%s, %s, %s, %s, %s)"
-        try:
-            self.db_manager.execute_query(query, (brand_id, brand_name, style, size, quantity))
-            messagebox.showinfo("Success", "New hat added successfully.")
-            window.destroy()
-            self.view_hats()  # Optionally refresh the hats view
-        except Exception as e:
-            messagebox.showerror("Database Error", f"An error occurred: {e}")
-
-    def add_order(self):
-        add_order_window = tk.Toplevel(self.master)
-        add_order_window.title("Place New Order")
-
-        Label(add_order_window, text="Customer ID:").grid(row=0, column=0)
-        customer_id_entry = Entry(add_order_window)
-        customer_id_entry.grid(row=0, column=1)
-
-        Label(add_order_window, text="Hat ID:").grid(row=1, column=0)
-        hat_id_entry = Entry(add_order_window)
-        hat_id_entry.grid(row=1, column=1)
-
-        Label(add_order_window, text="Order Date (YYYY-MM-DD):").grid(row=2, column=0)
-        order_date_entry = Entry(add_order_window)
-        order_date_entry.grid(row=2, column=1)
-
-        Label(add_order_window, text="Quantity:").grid(row=3, column=0)
-        quantity_entry = Entry(add_order_window)
-        quantity_entry.grid(row=3, column=1)
-
-        submit_button = Button(add_order_window, text="Submit", command=lambda: self.submit_new_order(
-            customer_id_entry.get(),
-            hat_id_entry.get(),
-            order_date_entry.get(),
-            quantity_entry.get(),
-            add_order_window
-        ))
-        submit_button.grid(row=4, column=1, pady=5)
-
-    def submit_new_order(self, customer_id, hat_id, order_date, quantity, window):
-        if not all([customer_id, hat_id, order_date, quantity]):
-            messagebox.showwarning("Warning", "All fields are required to place an order.")
-            return
+def placeholders(count):
+    return ", ".join(["%s"] * count)
 
-        if not validate_date(order_date):
-            messagebox.showerror("Invalid Date", "The order date is in an incorrect format. Please use YYYY-MM-DD.")
-            return
 
-        try:
-            # Check if customer ID exists
-            customer_query = "SELECT * FROM customers WHERE customer_id = %s"
-            customer_result = self.db_manager.execute_query(customer_query, (customer_id,))
-            if not customer_result:
-                messagebox.showerror("Error", "Customer ID does not exist.")
-                return
+# LIKE pattern matching values that start with `text`, escaped with '!'
+def like_prefix(text):
+    return re.sub(r"([!%_])", r"!\1", text) + "%"
 
-            # Check if hat ID exists and if there's enough stock
-            hat_query = "SELECT quantity FROM hats WHERE hat_id = %s"
-            hat_result = self.db_manager.execute_query(hat_query, (hat_id,))
-            if not hat_result:
-                messagebox.showerror("Error", "Hat ID does not exist.")
-                return
 
-            available_quantity = hat_result[0][0]
-            if int(quantity) > available_quantity:
-                messagebox.showerror("Error", "Not enough stock for the hat.")
-                return
+# Multi-row INSERT of `rows` rows into `columns`
+def insert_sql(table, columns, rows=1):
+    return f"INSERT INTO {table} ({', '.join(columns)}) VALUES " + ", ".join([f"({placeholders(len(columns))})"] * rows)
 
-            # All checks passed, place the order
-            insert_order_query = "INSERT INTO orders (customer_id, hat_id, date, quantity) VALUES (%s, %s, %s, %s)"
-            self.db_manager.execute_query(insert_order_query, (customer_id, hat_id, order_date, quantity))
 
-            # Update hats quantity
-            new_quantity = available_quantity - int(quantity)
-            update_hat_query = "UPDATE hats SET quantity = %s WHERE hat_id = %s"
-            self.db_manager.execute_query(update_hat_query, (new_quantity, hat_id))
+# Money as a Decimal in cents. Sums of money come back from SQLite as floats or ints.
+def money(value):
+    if isinstance(value, float):
+        value = Decimal(repr(value))
+    return Decimal(value).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
 
-            # Get the last inserted order_id for the delivery
-            last_order_id_query = "SELECT LAST_INSERT_ID();"
-            last_order_id_result = self.db_manager.execute_query(last_order_id_query)
-            last_order_id = last_order_id_result[0][0]
 
-            # Calculate the estimated arrival date and insert into delivery
-            order_date_obj = datetime.strptime(order_date, '%Y-%m-%d')
-            estimated_arrival = order_date_obj + timedelta(days=5)
-            insert_delivery_query = "INSERT INTO delivery (order_id, arrival_date) VALUES (%s, %s)"
-            self.db_manager.execute_query(insert_delivery_query, (last_order_id, estimated_arrival))
+# Parse a YYYY-MM-DD date, returning None unless the text is exactly in that format.
+# date.fromisoformat is far cheaper than a strptime/strftime round trip, but it also
+# accepts compact (YYYYMMDD) and week-based forms, hence the shape check.
+def parse_date(date_text):
+    if not isinstance(date_text, str) or len(date_text) != 10 or date_text[4] != '-' or date_text[7] != '-':
+        return None
+    try:
+        return date.fromisoformat(date_text)
+    except ValueError:
+        return None
 
-            messagebox.showinfo("Success", "Order placed and delivery scheduled successfully.")
 
-            # Get the price for the hat
-            hat_price = self.get_hat_price(hat_id)  # You'll implement this method
+# Utility function to validate the date format
+def validate_date(date_text):
+    return parse_date(date_text) is not None
 
-            # Calculate the total price and tax for the order
-            # Ensure quantity is an integer
-            quantity = int(quantity)
 
-            # Now the multiplication should work
-            total_price = quantity * hat_price
+# Row validators for the importers. Each turns a record read from a file into the
+# tuple of column values to insert, raising ValueError with the reason to reject it.
+def customer_row(record):
+    values = [(record.get(field) or "").strip() for field in ("name", "DOB", "email", "contact_info", "address")]
+    if not all(values):
+        raise ValueError("All fields are required to add a new customer.")
+    if parse_date(values[1]) is None:
+        raise ValueError("The Date of Birth is in an incorrect format. Please use YYYY-MM-DD.")
+    if "@" not in values[2]:
+        raise ValueError("The email address is not valid.")
+    return tuple(values)
 
-            tax = self.calculate_tax(total_price)  # You'll implement this method
-            payment_method = "Credit Card"  # Example payment method
 
-            # Get the last order ID to link the bill to the correct order
-            last_order_id = self.get_last_inserted_id()
+def hat_row(record):
+    try:
+        brand_id = int(record["brand_id"])
+        brand_name = (record["brand_name"] or "").strip()
+        style = (record["style"] or "").strip()
+        size = int(record["size"])
+        quantity = int(record["quantity"])
+        price = Decimal(str(record["price"]))
+    except (KeyError, TypeError, ValueError, ArithmeticError):
+        raise ValueError("Hat is missing a field or has a non-numeric brand ID, size, quantity or price.")
+    if not brand_name or not style:
+        raise ValueError("All fields are required to add a new hat.")
+    if quantity < 0 or price < 0:
+        raise ValueError("Quantity and price cannot be negative.")
+    return brand_id, brand_name, style, size, quantity, price
+
+
+# Tables that can be loaded with DatabaseManager.import_rows: columns and row validator
+IMPORTS = {
+    'customers': (("name", "DOB", "email", "contact_info", "address"), customer_row),
+    'hats': (("brand_id", "brand_name", "style", "size", "quantity", "price"), hat_row),
+}
 
-            # Create the bill
-            self.create_bill(last_order_id, tax, total_price, payment_method)
 
-            # Proceed to payment
-            self.process_payment(last_order_id, total_price + tax)  # You'll implement this method
+class HatCache:
+    # Read-through cache of hat rows keyed by hat_id with LRU eviction and a TTL.
+    # The app invalidates a hat whenever it writes to it. Changes made by other
+    # stations are picked up when the TTL runs out, or straight away when reading with
+    # revalidate=True, which compares the cached `version` values in one cheap query.
+    def __init__(self, load, check_versions, max_size=HAT_CACHE_SIZE, ttl=HAT_CACHE_TTL):
+        self._load = load  # hat ids -> {hat_id: row}, the row ending with its version
+        self._check_versions = check_versions  # hat ids -> {hat_id: version}
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()  # hat_id -> (row, loaded_at)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get_many(self, hat_ids, revalidate=False):
+        now = time.monotonic()
+        found, missing = {}, []
+        with self._lock:
+            for hat_id in hat_ids:
+                entry = self._entries.get(hat_id)
+                if entry is not None and now - entry[1] < self.ttl:
+                    self._entries.move_to_end(hat_id)
+                    found[hat_id] = entry[0]
+                else:
+                    missing.append(hat_id)
+
+        if revalidate and found:
+            versions = self._check_versions(list(found))
+            for hat_id, row in list(found.items()):
+                if versions.get(hat_id) != row[-1]:
+                    del found[hat_id]
+                    missing.append(hat_id)
+
+        with self._lock:
+            self.hits += len(found)
+            self.misses += len(missing)
+        if missing:
+            loaded = self._load(missing)
+            self.put_many(loaded, now)
+            found.update(loaded)
+        return found
+
+    def get(self, hat_id, revalidate=False):
+        return self.get_many([hat_id], revalidate).get(hat_id)
+
+    def put_many(self, rows, loaded_at=None):
+        loaded_at = time.monotonic() if loaded_at is None else loaded_at
+        with self._lock:
+            for hat_id, row in rows.items():
+                self._entries[hat_id] = (row, loaded_at)
+                self._entries.move_to_end(hat_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, *hat_ids):
+        with self._lock:
+            for hat_id in hat_ids:
+                self._entries.pop(hat_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+# The delivery region of a customer: the last comma-separated part of the address
+# (the town in "12 Main St, Springfield"), lower-cased
+def address_region(address):
+    region = (address or "").rpartition(",")[2].strip().lower()
+    return region[:64] or None
+
+
+class DeliverySchedule:
+    # Lead-time rules and holidays as read from delivery_rules and delivery_holidays.
+    # The most specific rule for a hat and region wins: hat and region, hat, region,
+    # then the shop default, and DELIVERY_DAYS calendar days without any rule. Rules
+    # counting business days skip DELIVERY_WEEKEND and the holidays. An order with
+    # several hats arrives when its slowest hat does.
+    def __init__(self, rules, holidays):
+        self.rules = {(hat_id, region): (lead_days, bool(business_days))
+                      for hat_id, region, lead_days, business_days in rules}
+        self.holidays = set(holidays)
+        self.loaded_at = time.monotonic()
+
+    def lead_time(self, hat_id, region):
+        for key in ((hat_id, region), (hat_id, None), (None, region), (None, None)):
+            if key in self.rules:
+                return self.rules[key]
+        return DELIVERY_DAYS, False
+
+    def is_business_day(self, day):
+        return day.weekday() not in DELIVERY_WEEKEND and day not in self.holidays
+
+    # `day` moved by `days` days, or by `days` business days. A business-day move
+    # always lands on a business day, so a move of 0 rolls a weekend or holiday
+    # forward to the next working day.
+    def shift(self, day, days, business_days=False):
+        if not business_days:
+            return day + timedelta(days=days)
+        step = timedelta(days=-1 if days < 0 else 1)
+        for _ in range(abs(days)):
+            day += step
+            while not self.is_business_day(day):
+                day += step
+        while not self.is_business_day(day):
+            day += timedelta(days=1)
+        return day
+
+    def arrival(self, order_date, hat_ids, region):
+        return max(self.shift(order_date, *self.lead_time(hat_id, region)) for hat_id in hat_ids)
+
+
+# Reduce a statement to its shape for the statistics: literals and parameters become ?
+# and repeated IN lists, VALUES rows and CASE branches collapse to one, so batches
+# of every size are counted together.
+@lru_cache(maxsize=1024)
+def statement_shape(query):
+    shape = " ".join(query.split())
+    shape = re.sub(r"'(?:[^']|'')*'|%s|\b\d+(?:\.\d+)?\b", "?", shape)
+    shape = re.sub(r"\(\?(?:, \?)+\)", "(?, ...)", shape)
+    shape = re.sub(r"(\([^()]*\))(?:, \1)+", r"\1, ...", shape)
+    shape = re.sub(r"(WHEN \? THEN \? )(?:\1)+", r"\1... ", shape)
+    return shape
+
+
+def percentile(samples, p):
+    # `samples` must be sorted
+    return samples[min(len(samples) - 1, int(p * len(samples)))] if samples else 0.0
+
+
+def prometheus_label(value):
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class QueryStats:
+    # Call counts, rows, errors and recent latencies of every statement the
+    # DatabaseManager runs, grouped by statement shape. Statements slower than
+    # `slow_ms` are appended to the `slow_log` file (None turns the log off).
+    def __init__(self, slow_ms=SLOW_QUERY_MS, slow_log=SLOW_QUERY_LOG, samples=LATENCY_SAMPLES):
+        self.slow_ms = slow_ms
+        self.slow_log = slow_log
+        self.samples = samples
+        self._shapes = {}  # shape -> {'calls', 'errors', 'rows', 'total', 'max', 'latencies'}
+        self._lock = threading.Lock()
+        self._log_lock = threading.Lock()
+        self.calls = 0
+        self.errors = 0
+        self.slow = 0
+
+    def record(self, query, elapsed, rows, failed=False):
+        shape = statement_shape(query)
+        slow = elapsed * 1000 >= self.slow_ms
+        with self._lock:
+            entry = self._shapes.get(shape)
+            if entry is None:
+                entry = self._shapes[shape] = {
+                    'calls': 0, 'errors': 0, 'rows': 0, 'total': 0.0, 'max': 0.0,
+                    'latencies': deque(maxlen=self.samples)}
+            entry['calls'] += 1
+            entry['errors'] += failed
+            entry['rows'] += rows
+            entry['total'] += elapsed
+            entry['max'] = max(entry['max'], elapsed)
+            entry['latencies'].append(elapsed)
+            self.calls += 1
+            self.errors += failed
+            self.slow += slow
+        if slow and self.slow_log:
+            self._log_slow(shape, elapsed, rows, failed)
+
+    def _log_slow(self, shape, elapsed, rows, failed):
+        line = f"{time.strftime('%Y-%m-%dT%H:%M:%S')} {elapsed * 1000:.1f}ms rows={rows}"
+        line += f"{' FAILED' if failed else ''} {shape}\n"
+        try:
+            with self._log_lock, open(self.slow_log, "a", encoding="utf-8") as f:
+                f.write(line)
+        except OSError as e:
+            print(f"Could not write to the slow query log {self.slow_log}: {e}")
+            self.slow_log = None
+
+    # One dict per statement shape, most total time first
+    def snapshot(self):
+        with self._lock:
+            entries = [(shape, dict(entry, latencies=sorted(entry['latencies'])))
+                       for shape, entry in self._shapes.items()]
+        result = []
+        for shape, entry in entries:
+            latencies = entry['latencies']
+            result.append({
+                'shape': shape,
+                'calls': entry['calls'],
+                'errors': entry['errors'],
+                'rows': entry['rows'],
+                'total_ms': entry['total'] * 1000,
+                'mean_ms': entry['total'] * 1000 / entry['calls'],
+                'p50_ms': percentile(latencies, 0.50) * 1000,
+                'p95_ms': percentile(latencies, 0.95) * 1000,
+                'p99_ms': percentile(latencies, 0.99) * 1000,
+                'max_ms': entry['max'] * 1000,
+            })
+        result.sort(key=lambda entry: entry['total_ms'], reverse=True)
+        return result
+
+    def reset(self):
+        with self._lock:
+            self._shapes.clear()
+            self.calls = self.errors = self.slow = 0
+
+    # `counters` holds extra gauges (pool, cache) to export alongside the statements
+    def to_json(self, counters=None):
+        return json.dumps({'counters': counters or {}, 'statements': self.snapshot()}, indent=2)
+
+    def to_prometheus(self, counters=None):
+        lines = []
+        for name, value in (counters or {}).items():
+            lines.append(f"# TYPE hathive_{name} gauge")
+            lines.append(f"hathive_{name} {value}")
+        snapshot = self.snapshot()
+        metrics = (
+            ('query_seconds', 'summary', "Statement latency by statement shape"),
+            ('query_rows_total', 'counter', "Rows returned or affected by statement shape"),
+            ('query_errors_total', 'counter', "Failed statements by statement shape"),
+        )
+        for metric, kind, description in metrics:
+            lines.append(f"# HELP hathive_{metric} {description}")
+            lines.append(f"# TYPE hathive_{metric} {kind}")
+            for entry in snapshot:
+                label = f'shape="{prometheus_label(entry["shape"])}"'
+                if metric == 'query_seconds':
+                    for quantile, key in (('0.5', 'p50_ms'), ('0.95', 'p95_ms'), ('0.99', 'p99_ms')):
+                        lines.append(f'hathive_{metric}{{{label},quantile="{quantile}"}} {entry[key] / 1000}')
+                    lines.append(f"hathive_{metric}_sum{{{label}}} {entry['total_ms'] / 1000}")
+                    lines.append(f"hathive_{metric}_count{{{label}}} {entry['calls']}")
+                elif metric == 'query_rows_total':
+                    lines.append(f"hathive_{metric}{{{label}}} {entry['rows']}")
+                else:
+                    lines.append(f"hathive_{metric}{{{label}}} {entry['errors']}")
+        return "\n".join(lines) + "\n"
 
-            messagebox.showinfo("Success", "Order placed, bill created, and payment processed successfully.")
-            window.destroy()
 
-        except Exception as e:
-            messagebox.showerror("Database Error", f"An error occurred: {e}")
+# What a write statement reports, kept once its cursor is closed
+StatementResult = namedtuple("StatementResult", "rowcount lastrowid")
 
-        # Implement the get_hat_price method to retrieve the price of a hat from the database
 
-    def get_hat_price(self, hat_id):
-        query = "SELECT price FROM hats WHERE hat_id = %s"
-        result = self.db_manager.execute_query(query, (hat_id,))
-        if result:
-            return Decimal(result[0][0])
-        else:
-            raise Exception("Hat not found.")
+class Transaction:
+    # The statements of one DatabaseManager.transaction() block. They all run on the
+    # same connection and are committed together when the block ends.
+    def __init__(self, db_manager, connection):
+        self.db_manager = db_manager
+        self.connection = connection
 
-        # Implement the calculate_tax method to calculate the tax based on the total price
+    def fetch(self, query, params=None):
+        return self.db_manager._run(self.connection, query, params, fetch=True)
 
-    def calculate_tax(self, total_price):
-        tax_rate = Decimal('0.07')  # Example tax rate of 7%
-        return total_price * tax_rate
+    def fetchone(self, query, params=None):
+        rows = self.fetch(query, params)
+        return rows[0] if rows else None
 
-        # Implement the get_last_inserted_id method to get the ID of the last inserted record
+    # Returns the statement's rowcount and lastrowid as a StatementResult
+    def execute(self, query, params=None):
+        return self.db_manager._run(self.connection, query, params)
 
-    def get_last_inserted_id(self):
-        last_order_id_query = "SELECT LAST_INSERT_ID();"
-        last_order_id_result = self.db_manager.execute_query(last_order_id_query)
-        return last_order_id_result[0][0]
+    def executemany(self, query, seq_params):
+        return self.db_manager._run_many(self.connection, query, seq_params)
 
-        # Implement the create_bill method to create a bill record in the database
 
-    def create_bill(self, order_id, tax, total_price, payment_method):
-        insert_bill_query = """
-          INSERT INTO bills (order_id, tax, price, payment_method) VALUES (%s, %s, %s, %s)
-          """
-        self.db_manager.execute_query(insert_bill_query, (order_id, tax, total_price, payment_method))
+class MySQLBackend:
+    # MySQL/InnoDB through mysql-connector. The connector is imported here rather than
+    # at module level so installs that only use SQLite do not need it.
+    name = "MySQL"
+    max_connections = None
+    prepares_statements = True
 
-    # Implement the process_payment method to handle payment processing
-    def process_payment(self, order_id, amount_due):
-        # In a real system, you would now interact with a payment processor/gateway
-        # For this example, we'll simulate a successful payment by updating the bill status
+    def __init__(self, host, user, password, db_name):
+        try:
+            import mysql.connector
+            from mysql.connector import errorcode
+        except ImportError:
+            raise DatabaseError("MySQL support needs mysql-connector-python: pip install mysql-connector-python")
+        self.connector = mysql.connector
+        self.Error = mysql.connector.Error
+        # Errors after which a connection is not trusted again
+        self.disconnect_errors = (mysql.connector.InterfaceError, mysql.connector.OperationalError)
+        self.already_applied_errors = {
+            errorcode.ER_TABLE_EXISTS_ERROR,
+            errorcode.ER_DUP_FIELDNAME,
+            errorcode.ER_DUP_KEYNAME,
+        }
+        self.errorcode = errorcode
+        self.host = host
+        self.user = user
+        self.password = password
+        self.db_name = db_name
 
-        # Simulate generating a secure hash for the transaction (in reality, use secure methods)
-        transaction_id = hashlib.sha256(f"{order_id}{amount_due}".encode()).hexdigest()
+    # Open the first connection. The database usually exists, so connect to it
+    # directly and only create it when the server says it is unknown.
+    def bootstrap(self):
+        try:
+            connection = self.connect()
+        except self.Error as e:
+            if e.errno != self.errorcode.ER_BAD_DB_ERROR:
+                raise
+            connection = self.connector.connect(
+                host=self.host,
+                user=self.user,
+                password=self.password,
+                autocommit=True
+            )
+            with connection.cursor() as cursor:
+                cursor.execute(f"CREATE DATABASE IF NOT EXISTS {self.db_name}")
+                cursor.execute(f"USE {self.db_name}")
+            print(f"Created database: {self.db_name}")
+        print(f"Connected to MySQL Server version {connection.get_server_info()}, database: {self.db_name}")
+        return connection
+
+    # Pooled connections run in autocommit mode so plain reads never hold a stale
+    # snapshot; multi-statement work goes through DatabaseManager.transaction()
+    def connect(self):
+        return self.connector.connect(
+            host=self.host,
+            user=self.user,
+            password=self.password,
+            database=self.db_name,
+            autocommit=True
+        )
+
+    def is_alive(self, connection):
+        try:
+            connection.ping(reconnect=False)
+            return True
+        except self.Error:
+            return False
+
+    def begin(self, connection):
+        connection.start_transaction()
+
+    def cursor(self, connection, prepared=False):
+        return connection.cursor(prepared=prepared)
+
+    # Rows are read from the server as they are fetched instead of all at once
+    def stream_cursor(self, connection):
+        return connection.cursor(buffered=False)
+
+    def sql(self, query):
+        return query
+
+    def is_missing_table(self, error):
+        return getattr(error, 'errno', None) == self.errorcode.ER_NO_SUCH_TABLE
+
+    def is_already_applied(self, error):
+        return getattr(error, 'errno', None) in self.already_applied_errors
+
+    def is_duplicate(self, error):
+        return getattr(error, 'errno', None) == self.errorcode.ER_DUP_ENTRY
+
+    # Multi-row INSERT that adds `sums` to an existing row with the same key and keeps
+    # the lowest/highest value of the `lowest`/`highest` columns
+    def upsert_sql(self, table, keys, sums, lowest=(), highest=(), rows=1):
+        updates = [f"{c} = {c} + VALUES({c})" for c in sums]
+        updates += [f"{c} = LEAST({c}, VALUES({c}))" for c in lowest]
+        updates += [f"{c} = GREATEST({c}, VALUES({c}))" for c in highest]
+        return (insert_sql(table, keys + sums + lowest + highest, rows)
+                + " ON DUPLICATE KEY UPDATE " + ", ".join(updates))
+
+    def clear_tables(self, connection, tables):
+        # FOREIGN_KEY_CHECKS is a session variable, so this needs a single connection
+        with connection.cursor() as cursor:
+            cursor.execute("SET FOREIGN_KEY_CHECKS = 0")  # Disable foreign key checks
+            try:
+                for table in tables:
+                    cursor.execute(f"TRUNCATE TABLE {table}")
+            finally:
+                cursor.execute("SET FOREIGN_KEY_CHECKS = 1")  # Re-enable foreign key checks
+
+
+def _adapt_date(value):
+    return value.isoformat()
+
+
+def _convert_date(value):
+    return date.fromisoformat(value.decode())
+
+
+# SQLite gives DECIMAL columns numeric affinity, so 40.00 is stored as the integer 40
+# and 40.50 as the real 40.5. Every DECIMAL column holds money, so they are read back
+# in cents like MySQL returns them.
+def _convert_decimal(value):
+    return money(Decimal(value.decode()))
+
+
+# Rewrite a statement written for MySQL into SQLite's dialect: `?` placeholders, no
+# row locks (write transactions take the database lock up front instead) and, for
+# DDL, inline INTEGER PRIMARY KEY AUTOINCREMENT columns without a table engine.
+@lru_cache(maxsize=1024)
+def sqlite_sql(query):
+    query = query.replace("%s", "?").replace(" FOR UPDATE", "")
+    match = re.search(r"`(\w+)` int NOT NULL AUTO_INCREMENT", query)
+    if match:
+        column = match.group(1)
+        query = query.replace(match.group(0), f"`{column}` INTEGER PRIMARY KEY AUTOINCREMENT")
+        query = re.sub(rf",\s*PRIMARY KEY \(`{column}`\)", "", query)
+    return query.replace(" ENGINE=InnoDB", "")
+
+
+class SQLiteBackend:
+    # Embedded SQLite database in a single file: no server, no network round trips.
+    # WAL mode lets readers run alongside the single writer.
+    name = "SQLite"
+    prepares_statements = False  # sqlite3 caches compiled statements per connection itself
+    Error = sqlite3.Error
+    disconnect_errors = (sqlite3.InterfaceError,)
+
+    PRAGMAS = (
+        "PRAGMA journal_mode = WAL",
+        "PRAGMA synchronous = NORMAL",  # Durable at checkpoints; safe against corruption in WAL mode
+        "PRAGMA foreign_keys = ON",
+        "PRAGMA cache_size = -65536",  # 64 MiB page cache per connection
+        "PRAGMA temp_store = MEMORY",
+        "PRAGMA mmap_size = 268435456",
+    )
 
-        update_payment_query = """
-        UPDATE bills SET payment_status = %s, transaction_id = %s WHERE order_id = %s
-        """
-        self.db_manager.execute_query(update_payment_query, ('Paid', transaction_id, order_id))
+    def __init__(self, path, busy_timeout=30):
+        self.path = path
+        self.busy_timeout = busy_timeout
+        # Every connection to ":memory:" is a separate database, so only one is allowed
+        self.max_connections = 1 if path == ":memory:" else None
+        self.db_name = path
+        sqlite3.register_adapter(Decimal, str)
+        sqlite3.register_adapter(date, _adapt_date)
+        sqlite3.register_converter("decimal", _convert_decimal)
+        sqlite3.register_converter("date", _convert_date)
+
+    def bootstrap(self):
+        connection = self.connect()
+        print(f"Connected to SQLite {sqlite3.sqlite_version} database: {self.path}")
+        return connection
 
-    def view_deliveries(self):
-        self.query_result.delete('1.0', tk.END)  # Clear existing content
-        query = "SELECT delivery.delivery_id, orders.order_id, delivery.arrival_date FROM delivery JOIN orders ON delivery.order_id = orders.order_id"
+    def connect(self):
+        connection = sqlite3.connect(
+            self.path,
+            timeout=self.busy_timeout,
+            detect_types=sqlite3.PARSE_DECLTYPES,
+            isolation_level=None,  # Autocommit unless a transaction is begun explicitly
+            check_same_thread=False,  # Pooled connections move between worker threads
+            cached_statements=STATEMENT_CACHE_SIZE * 4
+        )
+        for pragma in self.PRAGMAS:
+            connection.execute(pragma)
+        return connection
+
+    def is_alive(self, connection):
         try:
-            records = self.db_manager.execute_query(query)
-            print("Fetched records:", records)  # Debugging line
+            connection.execute("SELECT 1")
+            return True
+        except self.Error:
+            return False
 
-            if not records:
-                self.query_result.insert(tk.END, "No delivery records found.\n")
-                return
+    def begin(self, connection):
+        # Take the write lock now so two writers cannot both read and then fail to upgrade
+        connection.execute("BEGIN IMMEDIATE")
 
-            # Dynamically compute column widths
-            col_widths = [max(len(str(row[i])) for row in records) for i in range(len(records[0]))]
+    def cursor(self, connection, prepared=False):
+        return connection.cursor()
 
-            headers = ["Delivery ID", "Order ID", "Arrival Date"]
-            header_string = "".join(h.ljust(col_widths[i] + 2) for i, h in enumerate(headers))
+    # sqlite3 cursors always step through the result as it is fetched
+    def stream_cursor(self, connection):
+        return connection.cursor()
 
-            # Add headers
-            self.query_result.insert(tk.END, header_string + "\n")
-            self.query_result.insert(tk.END, "-" * len(header_string) + "\n")
+    def sql(self, query):
+        return sqlite_sql(query)
 
-            for record in records:
-                formatted_record = "".join(str(field).ljust(col_widths[i] + 2) for i, field in enumerate(record))
-                self.query_result.insert(tk.END, formatted_record + "\n")
-        except Exception as e:
-            messagebox.showerror("Database Error", f"An error occurred: {e}")
+    def is_missing_table(self, error):
+        return "no such table" in str(error)
+
+    def is_already_applied(self, error):
+        message = str(error)
+        return "already exists" in message or "duplicate column name" in message
 
-    def view_orders(self):
-        query = "SELECT * FROM orders"
+    def is_duplicate(self, error):
+        return isinstance(error, sqlite3.IntegrityError) and "UNIQUE constraint failed" in str(error)
+
+    def upsert_sql(self, table, keys, sums, lowest=(), highest=(), rows=1):
+        updates = [f"{c} = {c} + excluded.{c}" for c in sums]
+        updates += [f"{c} = MIN({c}, excluded.{c})" for c in lowest]
+        updates += [f"{c} = MAX({c}, excluded.{c})" for c in highest]
+        return (insert_sql(table, keys + sums + lowest + highest, rows)
+                + f" ON CONFLICT ({', '.join(keys)}) DO UPDATE SET " + ", ".join(updates))
+
+    def clear_tables(self, connection, tables):
+        # foreign_keys cannot change inside a transaction, so switch it off around it
+        connection.execute("PRAGMA foreign_keys = OFF")
         try:
-            records = self.db_manager.execute_query(query)
-            self.query_result.delete('1.0', tk.END)
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                for table in tables:
+                    connection.execute(f"DELETE FROM {table}")
+                connection.execute(
+                    f"DELETE FROM sqlite_sequence WHERE name IN ({', '.join('?' * len(tables))})", tables)
+            except BaseException:
+                connection.rollback()
+                raise
+            connection.commit()
+        finally:
+            connection.execute("PRAGMA foreign_keys = ON")
+
+
+class ConnectionPool:
+    # Fixed-size pool of database connections. Connections are opened lazily (so a
+    # server blip does not cause a reconnect storm), pinged when they are checked out
+    # after sitting idle and transparently replaced if they turn out to be dead.
+    def __init__(self, backend, size=POOL_SIZE, timeout=30, ping_interval=1.0):
+        self.backend = backend
+        self.size = size
+        self.timeout = timeout
+        self.ping_interval = ping_interval
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+        self._closed = False
+        self._lock = threading.Lock()
+        self.in_use = 0
+        self.opened = 0
+        self.waits = 0  # checkouts that found every connection in use
+
+    def put(self, connection):
+        # Hand an already opened connection to the pool (used for the bootstrap connection)
+        with self._lock:
+            self.opened += 1
+        self._idle.put((connection, time.monotonic()))
+
+    def checkout(self):
+        if self._closed:
+            raise DatabaseError("Connection pool is closed")
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self.waits += 1
+            if not self._slots.acquire(timeout=self.timeout):
+                raise DatabaseError(f"No database connection available after {self.timeout} seconds")
+        try:
+            connection = self._take()
+        except BaseException:
+            self._slots.release()
+            raise
+        with self._lock:
+            self.in_use += 1
+        return connection
+
+    def _take(self):
+        while True:
+            try:
+                connection, returned_at = self._idle.get_nowait()
+            except queue.Empty:
+                connection = self.backend.connect()
+                with self._lock:
+                    self.opened += 1
+                return connection
+            if time.monotonic() - returned_at < self.ping_interval or self.backend.is_alive(connection):
+                return connection
+            self._discard(connection)
+
+    def release(self, connection, discard=False):
+        with self._lock:
+            self.in_use -= 1
+        try:
+            if discard or self._closed:
+                self._discard(connection)
+            else:
+                self._idle.put((connection, time.monotonic()))
+        finally:
+            self._slots.release()
 
-            # Dynamically compute column widths
-            col_widths = [max(len(str(row[i])) for row in records) for i in range(len(records[0]))]
+    def idle(self):
+        return self._idle.qsize()
 
-            headers = ["Order ID", "Customer ID", "Hat ID", "Order Date", "Quantity"]
-            header_string = "".join(h.ljust(col_widths[i] + 2) for i, h in enumerate(headers))
+    def close(self):
+        self._closed = True
+        while True:
+            try:
+                connection, _ = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._discard(connection)
 
-            # Add headers
-            self.query_result.insert(tk.END, header_string + "\n")
-            self.query_result.insert(tk.END, "-" * len(header_string) + "\n")
+    def _discard(self, connection):
+        try:
+            connection.close()
+        except self.backend.Error:
+            pass
 
-            for record in records:
-                formatted_record = "".join(str(field).ljust(col_widths[i] + 2) for i, field in enumerate(record))
-                self.query_result.insert(tk.END, formatted_record + "\n")
-        except Exception as e:
-            messagebox.showerror("Database Error", f"An error occurred: {e}")
 
-    def clear_all_data(self):
-        confirm = messagebox.askyesno("Confirm", "Are you sure you want to delete all data?")
-        if confirm:
+class DatabaseManager:
+    # `backend` is a MySQLBackend or SQLiteBackend; everything engine-specific goes
+    # through it, so the SQL here is written once in MySQL's dialect
+    def __init__(self, backend, pool_size=POOL_SIZE, slow_query_ms=SLOW_QUERY_MS, slow_query_log=SLOW_QUERY_LOG):
+        self.backend = backend
+        self.db_name = backend.db_name
+        self.pool_size = min(pool_size, backend.max_connections or pool_size)
+        self.pool = None
+        self._local = threading.local()
+        self._statements = weakref.WeakKeyDictionary()  # connection -> prepared cursors by SQL
+        self._statements_lock = threading.Lock()
+        self.hat_cache = HatCache(self._load_hats, self._hat_versions)
+        self.stats = QueryStats(slow_query_ms, slow_query_log)
+        self.payments = None
+        self._delivery_schedule = None
+
+    def connect(self):
+        try:
+            connection = self.backend.bootstrap()
+            # The bootstrap connection becomes the first pooled connection
+            self.pool = ConnectionPool(self.backend, self.pool_size)
+            self.pool.put(connection)
+        except self.backend.Error as e:
+            print(f"Error while connecting to {self.backend.name}: {e}")
+            raise
+
+    @contextmanager
+    def checkout(self):
+        # Borrow a connection from the pool for the duration of the with-block.
+        # Anything left uncommitted by a failing block is rolled back, and connections
+        # that broke during the block are replaced instead of being handed out again.
+        # Nested checkouts on the same thread share the outer connection, so statements
+        # issued inside a transaction() block all run in that transaction.
+        connection = getattr(self._local, 'connection', None)
+        if connection is not None:
+            yield connection
+            return
+
+        connection = self.pool.checkout()
+        self._local.connection = connection
+        discard = False
+        try:
+            yield connection
+        except self.backend.disconnect_errors:
+            discard = True
+            raise
+        except BaseException:
             try:
-                self.db_manager.execute_query("SET FOREIGN_KEY_CHECKS = 0;")  # Disable foreign key checks
-                self.db_manager.execute_query("TRUNCATE TABLE bills;")
-                self.db_manager.execute_query("TRUNCATE TABLE delivery;")
-                self.db_manager.execute_query("TRUNCATE TABLE orders;")
-                self.db_manager.execute_query("TRUNCATE TABLE hats;")
-                self.db_manager.execute_query("TRUNCATE TABLE customers;")
-                self.db_manager.execute_query("SET FOREIGN_KEY_CHECKS = 1;")  # Re-enable foreign key checks
-                messagebox.showinfo("Success", "All data has been deleted.")
-            except Exception as e:
-                messagebox.showerror("Database Error", f"An error occurred: {e}")
+                connection.rollback()
+            except self.backend.Error:
+                discard = True
+            raise
+        finally:
+            self._local.connection = None
+            self.pool.release(connection, discard)
+
+    @contextmanager
+    def transaction(self):
+        # Run the with-block as a single transaction: the yielded Transaction's statements
+        # are committed together when the block completes and rolled back if it raises.
+        with self.checkout() as connection:
+            self.backend.begin(connection)
+            try:
+                yield Transaction(self, connection)
+            except BaseException:
+                connection.rollback()
+                raise
+            connection.commit()
+
+    # A prepared cursor for `query` on `connection`. Each connection keeps its most
+    # recently used statements prepared on the server, so running the same SQL again
+    # skips parsing and planning. The cached query string is returned with the cursor:
+    # the connector only reuses a statement when it is given the identical object.
+    def _prepared_cursor(self, connection, query):
+        with self._statements_lock:
+            statements = self._statements.get(connection)
+            if statements is None:
+                statements = self._statements[connection] = OrderedDict()
+        entry = statements.get(query)
+        if entry is None:
+            entry = statements[query] = (self.backend.cursor(connection, prepared=True), query)
+            if len(statements) > STATEMENT_CACHE_SIZE:
+                _, (evicted, _) = statements.popitem(last=False)
+                evicted.close()
+        else:
+            statements.move_to_end(query)
+        return entry
 
-    def view_bills(self):
-        self.query_result.delete('1.0', tk.END)  # Clear existing content in the text box
-        query = "SELECT bill_id, order_id, tax, price, payment_method, payment_status FROM bills"
+    def _forget_statement(self, connection, query):
+        statements = self._statements.get(connection)
+        entry = statements.pop(query, None) if statements else None
+        if entry:
+            try:
+                entry[0].close()
+            except self.backend.Error:
+                pass
+
+    # Run one statement on `connection`. Statements with parameters go through the
+    # prepared statement cache (where the backend needs one); parameterless ones (DDL,
+    # session settings) use the text protocol. Returns the rows when `fetch` is set,
+    # otherwise a StatementResult with the rowcount and lastrowid.
+    def _run(self, connection, query, params=None, fetch=False):
+        started = time.perf_counter()
+        rows, failed = 0, True
         try:
-            records = self.db_manager.execute_query(query)
+            result = self._execute(connection, query, params, fetch)
+            rows, failed = len(result) if fetch else max(result.rowcount, 0), False
+            return result
+        finally:
+            self.stats.record(query, time.perf_counter() - started, rows, failed)
+
+    def _execute(self, connection, query, params, fetch):
+        query = self.backend.sql(query)
+        if params and self.backend.prepares_statements:
+            cursor, query = self._prepared_cursor(connection, query)
+            try:
+                cursor.execute(query, tuple(params))
+                return cursor.fetchall() if fetch else StatementResult(cursor.rowcount, cursor.lastrowid)
+            except self.backend.Error:
+                self._forget_statement(connection, query)
+                raise
+        # Closing resets rowcount and lastrowid, so they are read first
+        with closing(self.backend.cursor(connection)) as cursor:
+            cursor.execute(query, tuple(params or ()))
+            return cursor.fetchall() if fetch else StatementResult(cursor.rowcount, cursor.lastrowid)
+
+    # Batched writes use the text protocol, where the MySQL connector rewrites an
+    # INSERT's parameter sets into a single multi-row statement
+    def _run_many(self, connection, query, seq_params):
+        started = time.perf_counter()
+        rows, failed = 0, True
+        try:
+            with closing(self.backend.cursor(connection)) as cursor:
+                cursor.executemany(self.backend.sql(query), seq_params)
+                result = StatementResult(cursor.rowcount, cursor.lastrowid)
+            rows, failed = max(result.rowcount, 0), False
+            return result
+        finally:
+            self.stats.record(query, time.perf_counter() - started, rows, failed)
+
+    # Return all rows of a query
+    def fetch(self, query, params=None):
+        with self.checkout() as connection:
+            return self._run(connection, query, params, fetch=True)
+
+    # Run a single INSERT/UPDATE/DELETE/DDL statement and return the affected row count.
+    # Connections run in autocommit mode, so outside transaction() it commits at once.
+    def execute(self, query, params=None):
+        with self.checkout() as connection:
+            return self._run(connection, query, params).rowcount
+
+    def executemany(self, query, seq_params):
+        with self.checkout() as connection:
+            return self._run_many(connection, query, seq_params).rowcount
+
+    def schema_version(self, connection):
+        with closing(self.backend.cursor(connection)) as cursor:
+            try:
+                cursor.execute("SELECT MAX(version) FROM schema_version")
+            except self.backend.Error as e:
+                if not self.backend.is_missing_table(e):
+                    raise
+                return 0
+            return cursor.fetchone()[0] or 0
+
+    # Bring the schema up to date. When it already is, this is a single query.
+    def migrate(self):
+        with self.checkout() as connection:
+            current = self.schema_version(connection)
+            pending = [migration for migration in MIGRATIONS if migration[0] > current]
+            if not pending:
+                return
+            self._run(connection, SCHEMA_VERSION_TABLE)
+            for version, description, statements in pending:
+                print(f"Applying migration {version}: {description}")
+                for statement in statements:
+                    if isinstance(statement, dict):
+                        statement = statement.get(self.backend.name)
+                        if statement is None:
+                            continue
+                    try:
+                        with closing(self.backend.cursor(connection)) as cursor:
+                            cursor.execute(self.backend.sql(statement))
+                    except self.backend.Error as e:
+                        if not self.backend.is_already_applied(e):
+                            raise
+                        print(f"  already applied: {e}")
+                try:
+                    self._run(
+                        connection,
+                        "INSERT INTO schema_version (version, description) VALUES (%s, %s)",
+                        (version, description))
+                except self.backend.Error as e:
+                    if not self.backend.is_duplicate(e):
+                        raise  # Otherwise another station recorded it first
+
+    # Fetch one page of `query` ordered by `key`. Pass `after` for the page following a
+    # key, `before` for the page preceding it or `at` to start at a key (inclusive).
+    # Returns the rows in ascending key order and whether more rows exist beyond the
+    # page in the direction that was read.
+    def fetch_page(self, query, key, limit, after=None, before=None, at=None):
+        if before is not None:
+            condition, params, order = f"WHERE {key} < %s", (before,), "DESC"
+        elif after is not None:
+            condition, params, order = f"WHERE {key} > %s", (after,), "ASC"
+        elif at is not None:
+            condition, params, order = f"WHERE {key} >= %s", (at,), "ASC"
+        else:
+            condition, params, order = "", (), "ASC"
+        # One extra row tells us whether there is another page without a COUNT(*)
+        page_query = f"{query} {condition} ORDER BY {key} {order} LIMIT %s"
+        rows = self.fetch(page_query, params + (limit + 1,))
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        if order == "DESC":
+            rows.reverse()
+        return rows, has_more
+
+    # Versions ({key: version}) of the rows of a view between two keys (inclusive)
+    def page_versions(self, view, first_key, last_key):
+        return dict(self.fetch(
+            f"{view['versions']} WHERE {view['key']} BETWEEN %s AND %s ORDER BY {view['key']}",
+            (first_key, last_key)))
+
+    # Bring a page of a view up to date. `versions` holds the {key: version} of the rows
+    # on screen. The page keeps its first key; on the last page of the view (`at_end`)
+    # it takes in rows added since, up to `limit` rows. Costs one range read of the
+    # page's versions plus a read of just the rows that are new or changed, however
+    # big the table. Returns (new or changed rows, keys no longer on the page, the
+    # page's new versions, whether rows follow the page).
+    def page_changes(self, view, versions, limit, at_end):
+        key = view['key']
+        first_key, last_key = min(versions), max(versions)
+        # Versions are read before the rows, so a row changed in between is only
+        # ever shown newer than its recorded version and simply read again next time
+        if at_end:
+            current = self.fetch(
+                f"{view['versions']} WHERE {key} >= %s ORDER BY {key} LIMIT %s", (first_key, limit + 1))
+            has_more = len(current) > limit
+            current = dict(current[:limit])
+        else:
+            current, has_more = self.page_versions(view, first_key, last_key), True
+        stale = [row_key for row_key, version in current.items() if versions.get(row_key) != version]
+        rows = []
+        if stale:
+            rows = self.fetch(
+                f"{view['query']} WHERE {key} IN ({placeholders(len(stale))}) ORDER BY {key}", stale)
+        removed = [row_key for row_key in versions if row_key not in current]
+        return rows, removed, current, has_more
+
+    def _load_hats(self, hat_ids):
+        rows = self.fetch(
+            "SELECT hat_id, brand_id, brand_name, style, size, quantity, price, version FROM hats"
+            f" WHERE hat_id IN ({placeholders(len(hat_ids))})",
+            tuple(hat_ids))
+        return {row[0]: tuple(row) for row in rows}
+
+    def _hat_versions(self, hat_ids):
+        rows = self.fetch(
+            f"SELECT hat_id, version FROM hats WHERE hat_id IN ({placeholders(len(hat_ids))})",
+            tuple(hat_ids))
+        return dict(rows)
+
+    # Catalog lookups served from the hat cache. A row is
+    # (hat_id, brand_id, brand_name, style, size, quantity, price, version).
+    def get_hat(self, hat_id, revalidate=False):
+        return self.hat_cache.get(int(hat_id), revalidate)
+
+    def get_hat_price(self, hat_id):
+        hat = self.get_hat(hat_id)
+        if hat:
+            return Decimal(hat[6])
+        else:
+            raise OrderError("Hat not found.")
+
+    # Place a single-hat order. Returns (order_id, total_price, tax).
+    def place_order(self, customer_id, hat_id, order_date, quantity, payment_method=PAYMENT_METHOD):
+        return self.place_cart(customer_id, [(hat_id, quantity)], order_date, payment_method)
+
+    # Place an order for several hats in one transaction: a single read for the
+    # customer and every hat's price and stock, one conditional UPDATE that decrements
+    # the stock of all of them and cannot oversell, and the order, its lines, one
+    # delivery and one bill. `lines` holds (hat_id, quantity) pairs; a hat listed twice
+    # becomes one line. The bill starts out Pending and is handed to the payment queue
+    # (when one is running) once the order is committed, so the gateway's latency is
+    # not part of placing the order. Returns (order_id, total_price, tax).
+    def place_cart(self, customer_id, lines, order_date, payment_method=PAYMENT_METHOD, journal_key=None):
+        quantities, order_date = self._cart_quantities(lines, order_date)
+        with self.transaction() as tx:
+            order_id, total_price, tax, bill_id = self._write_cart(
+                tx, customer_id, quantities, order_date, payment_method, journal_key)
+        self.hat_cache.invalidate(*quantities)
+        if self.payments:
+            self.payments.submit(bill_id, total_price + tax, payment_method)
+        return order_id, total_price, tax
+
+    # Merge the (hat_id, quantity) lines of a cart into quantities by hat_id
+    def _cart_quantities(self, lines, order_date):
+        quantities = {}
+        for hat_id, quantity in lines:
+            try:
+                quantity = int(quantity)
+            except (TypeError, ValueError):
+                quantity = 0
+            if quantity <= 0:
+                raise OrderError("Quantity must be a positive whole number.")
+            quantities[int(hat_id)] = quantities.get(int(hat_id), 0) + quantity
+        if not quantities:
+            raise OrderError("The order has no hats.")
+        order_date = parse_date(order_date)
+        if order_date is None:
+            raise OrderError("The order date is in an incorrect format. Please use YYYY-MM-DD.")
+        return quantities, order_date
+
+    # The statements of place_cart inside the caller's transaction. An OrderError may
+    # leave the stock UPDATE applied, so the caller must roll back (or roll back to a
+    # savepoint). Returns (order_id, total_price, tax, bill_id).
+    def _write_cart(self, tx, customer_id, quantities, order_date, payment_method, journal_key=None):
+        hat_ids = list(quantities)
+        rows = tx.fetch(
+            "SELECT c.customer_id, h.hat_id, h.price, h.quantity, h.brand_id, c.address FROM (SELECT 1) AS probe"
+            " LEFT JOIN customers c ON c.customer_id = %s"
+            f" LEFT JOIN hats h ON h.hat_id IN ({placeholders(len(hat_ids))})",
+            [customer_id] + hat_ids)
+        if rows[0][0] is None:
+            raise OrderError("Customer ID does not exist.")
+        hats = {hat_id: (Decimal(price), stock, brand_id)
+                for _, hat_id, price, stock, brand_id, _ in rows if hat_id is not None}
+        for hat_id in hat_ids:
+            if hat_id not in hats:
+                raise OrderError("Hat ID does not exist." if len(hat_ids) == 1 else
+                                 f"Hat ID {hat_id} does not exist.")
+            if quantities[hat_id] > hats[hat_id][1]:
+                raise OrderError("Not enough stock for the hat." if len(hat_ids) == 1 else
+                                 f"Not enough stock for hat {hat_id}.")
+
+        # Another clerk may have sold the stock since the read above; the UPDATE
+        # only touches hats that still have enough, so all lines must match
+        cases = " ".join(["WHEN %s THEN %s"] * len(hat_ids))
+        case_params = [value for item in quantities.items() for value in item]
+        decrement = tx.execute(
+            f"UPDATE hats SET quantity = quantity - CASE hat_id {cases} END, version = version + 1"
+            f" WHERE hat_id IN ({placeholders(len(hat_ids))}) AND quantity >= CASE hat_id {cases} END",
+            case_params + hat_ids + case_params)
+        if decrement.rowcount != len(hat_ids):
+            raise OrderError("Not enough stock for the hat." if len(hat_ids) == 1 else
+                             "Not enough stock for one of the hats.")
+
+        order_id = tx.execute(
+            "INSERT INTO orders (customer_id, hat_id, date, quantity, journal_key) VALUES (%s, %s, %s, %s, %s)",
+            (customer_id, hat_ids[0], order_date, quantities[hat_ids[0]], journal_key)).lastrowid
+
+        # Schedule the delivery by the lead-time rules for the hats and the customer's region
+        region = address_region(rows[0][5])
+        tx.execute(
+            "INSERT INTO delivery (order_id, arrival_date, region) VALUES (%s, %s, %s)",
+            (order_id, self.delivery_schedule().arrival(order_date, hat_ids, region), region))
+
+        line_rows, sales = [], []
+        for hat_id in hat_ids:
+            price, _, brand_id = hats[hat_id]
+            line_price = quantities[hat_id] * price
+            line_tax = calculate_tax(line_price)
+            line_rows.append((order_id, hat_id, quantities[hat_id], line_price, line_tax))
+            sales.append((order_id, order_date, hat_id, brand_id, int(customer_id), quantities[hat_id],
+                          line_price, line_tax))
+        tx.execute(
+            "INSERT INTO order_lines (order_id, hat_id, quantity, price, tax) VALUES "
+            + ", ".join(["(%s, %s, %s, %s, %s)"] * len(line_rows)),
+            [value for row in line_rows for value in row])
+
+        total_price = sum(row[3] for row in line_rows)
+        tax = sum(row[4] for row in line_rows)
+        bill_id = tx.execute(
+            "INSERT INTO bills (order_id, tax, price, payment_method, payment_status) VALUES (%s, %s, %s, %s, %s)",
+            (order_id, tax, total_price, payment_method, 'Pending')).lastrowid
+        self._record_sales(tx, sales)
+        return order_id, total_price, tax, bill_id
+
+    # Apply orders taken into an OrderJournal, all in one transaction. Each entry is a
+    # mapping with key, customer_id, lines, date and payment_method. Entries whose key
+    # is already on an order, archived or not, were applied before (the station stopped
+    # before it could note that) and are not placed again; the unique index on
+    # orders.journal_key backs this up. Each entry runs under a savepoint so a rejected one does not undo
+    # the rest. Returns (key, order_id, reason) per entry; order_id is None and reason
+    # says why for rejected entries. Database errors roll back the whole batch.
+    def replay_orders(self, entries):
+        results, placed = [], []
+        with self.transaction() as tx:
+            keys = [entry['key'] for entry in entries]
+            applied = dict(tx.fetch(
+                f"SELECT journal_key, order_id FROM orders WHERE journal_key IN ({placeholders(len(keys))})"
+                " UNION ALL SELECT journal_key, order_id FROM orders_archive"
+                f" WHERE journal_key IN ({placeholders(len(keys))})",
+                keys + keys))
+            for entry in entries:
+                key = entry['key']
+                if key in applied:
+                    results.append((key, applied[key], None))
+                    continue
+                tx.execute("SAVEPOINT journal_entry")
+                try:
+                    quantities, order_date = self._cart_quantities(entry['lines'], entry['date'])
+                    order_id, total_price, tax, bill_id = self._write_cart(
+                        tx, entry['customer_id'], quantities, order_date, entry['payment_method'], key)
+                except OrderError as e:
+                    tx.execute("ROLLBACK TO SAVEPOINT journal_entry")
+                    results.append((key, None, str(e)))
+                    continue
+                tx.execute("RELEASE SAVEPOINT journal_entry")
+                applied[key] = order_id
+                results.append((key, order_id, None))
+                placed.append((quantities, bill_id, total_price + tax, entry['payment_method']))
+        for quantities, bill_id, amount_due, payment_method in placed:
+            self.hat_cache.invalidate(*quantities)
+            if self.payments:
+                self.payments.submit(bill_id, amount_due, payment_method)
+        return results
+
+    # Bulk order intake. `orders` is an iterable of mappings with customer_id, hat_id,
+    # date and quantity. Each chunk is validated with two set-based reads (the hat rows
+    # are locked so stock cannot change underneath us) and written with multi-row
+    # inserts in one transaction. Invalid orders are rejected individually; the rest of
+    # the chunk still goes through. Returns (placed, rejected) as lists of
+    # (index, order_id) and (index, reason), indexes counting from 0 in `orders`.
+    def place_orders(self, orders, payment_method=PAYMENT_METHOD, chunk_size=ORDER_CHUNK_SIZE):
+        placed, rejected = [], []
+        for offset, chunk in enumerate(chunked(orders, chunk_size)):
+            self._place_order_chunk(chunk, offset * chunk_size, payment_method, placed, rejected)
+        return placed, rejected
+
+    def _place_order_chunk(self, chunk, first_index, payment_method, placed, rejected):
+        sold, bills = {}, []
+        try:
+            self._write_order_chunk(chunk, first_index, payment_method, placed, rejected, sold, bills)
+        finally:
+            self.hat_cache.invalidate(*sold)
+        if self.payments:
+            for bill_id, amount_due in bills:
+                self.payments.submit(bill_id, amount_due, payment_method)
+
+    # Appends (bill_id, amount_due) to `bills` for every order placed
+    def _write_order_chunk(self, chunk, first_index, payment_method, placed, rejected, sold, bills):
+        candidates = []
+        for index, order in enumerate(chunk, first_index):
+            try:
+                customer_id, hat_id = int(order['customer_id']), int(order['hat_id'])
+                quantity = int(order['quantity'])
+                order_date = str(order['date'])
+            except (KeyError, TypeError, ValueError):
+                rejected.append((index, "Order is missing a field or has a non-numeric ID/quantity."))
+                continue
+            if quantity <= 0:
+                rejected.append((index, "Quantity must be a positive whole number."))
+            elif not validate_date(order_date):
+                rejected.append((index, "The order date is in an incorrect format. Please use YYYY-MM-DD."))
+            else:
+                candidates.append((index, customer_id, hat_id, parse_date(order_date), quantity))
+        if not candidates:
+            return
 
-            if not records:
-                self.query_result.insert(tk.END, "No billing records found.\n")
+        with self.transaction() as tx:
+            customer_ids = sorted({c[1] for c in candidates})
+            regions = {customer_id: address_region(address) for customer_id, address in tx.fetch(
+                "SELECT customer_id, address FROM customers"
+                f" WHERE customer_id IN ({placeholders(len(customer_ids))})",
+                customer_ids)}
+
+            hat_ids = sorted({c[2] for c in candidates})
+            hats = {hat_id: [Decimal(price), stock, brand_id] for hat_id, price, stock, brand_id in tx.fetch(
+                "SELECT hat_id, price, quantity, brand_id FROM hats"
+                f" WHERE hat_id IN ({placeholders(len(hat_ids))}) FOR UPDATE",
+                hat_ids)}
+
+            # Allocate stock in arrival order so earlier orders win
+            accepted = []
+            for index, customer_id, hat_id, order_date, quantity in candidates:
+                if customer_id not in regions:
+                    rejected.append((index, "Customer ID does not exist."))
+                elif hat_id not in hats:
+                    rejected.append((index, "Hat ID does not exist."))
+                elif quantity > hats[hat_id][1]:
+                    rejected.append((index, "Not enough stock for the hat."))
+                else:
+                    hats[hat_id][1] -= quantity
+                    sold[hat_id] = sold.get(hat_id, 0) + quantity
+                    accepted.append((index, customer_id, hat_id, order_date, quantity))
+            if not accepted:
                 return
 
-            # Dynamically compute column widths
-            col_widths = [max(len(str(row[i])) for row in records) for i in range(len(records[0]))]
+            # One UPDATE for every hat touched by the chunk
+            cases = " ".join(["WHEN %s THEN %s"] * len(sold))
+            params = [value for item in sold.items() for value in item]
+            tx.execute(
+                f"UPDATE hats SET quantity = quantity - CASE hat_id {cases} END, version = version + 1"
+                f" WHERE hat_id IN ({placeholders(len(sold))})",
+                params + list(sold))
+
+            # The IDs of a multi-row INSERT need not be consecutive (auto_increment_increment
+            # above 1 on a cluster, interleaved auto-increment locking), so every order is
+            # tagged in intake_tag, the IDs are read back by tag and the tags cleared again
+            batch = uuid.uuid4().hex
+            tags = [f"{batch}-{i}" for i in range(len(accepted))]
+            tx.execute(
+                "INSERT INTO orders (customer_id, hat_id, date, quantity, intake_tag) VALUES "
+                + ", ".join(["(%s, %s, %s, %s, %s)"] * len(accepted)),
+                [value for order, tag in zip(accepted, tags) for value in order[1:] + (tag,)])
+            order_ids = dict(tx.fetch(
+                f"SELECT intake_tag, order_id FROM orders WHERE intake_tag IN ({placeholders(len(tags))})", tags))
+            tx.execute(
+                f"UPDATE orders SET intake_tag = NULL WHERE order_id IN ({placeholders(len(order_ids))})",
+                list(order_ids.values()))
+
+            schedule = self.delivery_schedule()
+            deliveries, lines, bill_rows, amounts_due, sales = [], [], [], [], []
+            for tag, (index, customer_id, hat_id, order_date, quantity) in zip(tags, accepted):
+                order_id = order_ids[tag]
+                region = regions[customer_id]
+                deliveries.append((order_id, schedule.arrival(order_date, [hat_id], region), region))
+                total_price = quantity * hats[hat_id][0]
+                tax = calculate_tax(total_price)
+                lines.append((order_id, hat_id, quantity, total_price, tax))
+                bill_rows.append((order_id, tax, total_price, payment_method, 'Pending'))
+                amounts_due.append(total_price + tax)
+                sales.append((order_id, order_date, hat_id, hats[hat_id][2], customer_id, quantity, total_price, tax))
+                placed.append((index, order_id))
+            tx.executemany("INSERT INTO delivery (order_id, arrival_date, region) VALUES (%s, %s, %s)", deliveries)
+            tx.executemany(
+                "INSERT INTO order_lines (order_id, hat_id, quantity, price, tax) VALUES (%s, %s, %s, %s, %s)", lines)
+            # The bill IDs are read back by order for the payment queue
+            tx.execute(
+                "INSERT INTO bills (order_id, tax, price, payment_method, payment_status) VALUES "
+                + ", ".join(["(%s, %s, %s, %s, %s)"] * len(bill_rows)),
+                [value for row in bill_rows for value in row])
+            bill_ids = dict(tx.fetch(
+                f"SELECT order_id, bill_id FROM bills WHERE order_id IN ({placeholders(len(bill_rows))})",
+                [row[0] for row in bill_rows]))
+            self._record_sales(tx, sales)
+        bills.extend((bill_ids[row[0]], amount_due) for row, amount_due in zip(bill_rows, amounts_due))
+
+    # Fold order lines into the summary tables inside the transaction that places them.
+    # `sales` holds (order_id, date, hat_id, brand_id, customer_id, units, revenue, tax)
+    # tuples, one per line. Rows are summed per key first (an order counts once per key
+    # however many of its lines share it) and written in key order, one upsert per
+    # table, so concurrent transactions lock summary rows in the same order.
+    def _record_sales(self, tx, sales):
+        by_hat, by_brand, by_customer = {}, {}, {}
+        for order_id, order_date, hat_id, brand_id, customer_id, units, revenue, tax in sales:
+            for totals, key in ((by_hat, (order_date, hat_id)), (by_brand, (order_date, brand_id))):
+                entry = totals.setdefault(key, [set(), 0, 0, 0])
+                entry[0].add(order_id)
+                entry[1] += units
+                entry[2] += revenue
+                entry[3] += tax
+            entry = by_customer.setdefault(customer_id, [set(), 0, 0, 0, order_date, order_date])
+            entry[0].add(order_id)
+            entry[1] += units
+            entry[2] += revenue
+            entry[3] += tax
+            entry[4] = min(entry[4], order_date)
+            entry[5] = max(entry[5], order_date)
+
+        sums = ("order_count", "units", "revenue", "tax")
+        for table, key_columns, totals in (
+                ("sales_daily_hat", ("sale_date", "hat_id"), by_hat),
+                ("sales_daily_brand", ("sale_date", "brand_id"), by_brand)):
+            tx.execute(
+                self.backend.upsert_sql(table, key_columns, sums, rows=len(totals)),
+                [value for key in sorted(totals) for value in key + (len(totals[key][0]), *totals[key][1:])])
+        tx.execute(
+            self.backend.upsert_sql(
+                "customer_ltv", ("customer_id",), sums, ("first_order",), ("last_order",), rows=len(by_customer)),
+            [value for key in sorted(by_customer)
+             for value in (key, len(by_customer[key][0]), *by_customer[key][1:])])
+
+    # Stream the rows of `query` as lists of up to `chunk_size` rows from an unbuffered
+    # cursor, so memory stays flat however large the result is. The cursor gets a pooled
+    # connection of its own for as long as the generator runs. If the generator is not
+    # run to the end, the server still has rows queued on that connection, so it is
+    # closed instead of going back to the pool.
+    def iter_query(self, query, params=None, chunk_size=EXPORT_CHUNK_SIZE):
+        connection = self.pool.checkout()
+        started = time.perf_counter()
+        rows, finished, failed = 0, False, True
+        try:
+            cursor = self.backend.stream_cursor(connection)
+            cursor.execute(self.backend.sql(query), tuple(params or ()))
+            while True:
+                chunk = cursor.fetchmany(chunk_size)
+                if not chunk:
+                    break
+                rows += len(chunk)
+                yield chunk
+            cursor.close()
+            finished, failed = True, False
+        except GeneratorExit:
+            failed = False  # Closed early by the consumer
+            raise
+        finally:
+            self.pool.release(connection, discard=not finished)
+            # The time includes whatever the consumer did with the rows
+            self.stats.record(query, time.perf_counter() - started, rows, failed)
+
+    # Chunks of one of EXPORTS in key order, hot and archived rows alike, optionally only
+    # rows dated between `start` and `end` (inclusive) and/or with a key above
+    # `since_id`. The hot and the archive tables are streamed side by side on two
+    # connections and merged, so each side reads its own indexes; with a single
+    # connection the all_* views are read instead.
+    def export_chunks(self, name, start=None, end=None, since_id=None, chunk_size=EXPORT_CHUNK_SIZE):
+        export = EXPORTS[name]
+        conditions, params = [], []
+        for bound, operator in ((start, ">="), (end, "<=")):
+            if bound:
+                bound_date = parse_date(bound)
+                if bound_date is None:
+                    raise ValueError("Export dates must use the format YYYY-MM-DD.")
+                conditions.append(f"{export['date']} {operator} %s")
+                params.append(bound_date)
+        if since_id is not None:
+            conditions.append(f"{export['key']} > %s")
+            params.append(parse_id(since_id, "Since ID"))
+        where = f" WHERE {' AND '.join(conditions)}" if conditions else ""
+        query = f"{export['query']}{where} ORDER BY {export['key']}"
+        if self.pool_size < 2:
+            return self.iter_query(query.format(**{table: f"all_{table}" for table in ARCHIVED_COLUMNS}),
+                                   params, chunk_size)
+        return merge_chunks([
+            self.iter_query(query.format(**{table: table + suffix for table in ARCHIVED_COLUMNS}), params, chunk_size)
+            for suffix in ("", "_archive")], chunk_size)
+
+    # Customers whose name or email starts with `term`, or the customer with that ID
+    def search_customers(self, term, limit=SEARCH_LIMIT):
+        term = term.strip()
+        if not term:
+            return []
+        columns = "SELECT customer_id, name, email, contact_info FROM customers"
+        if term.isdigit():
+            return self.fetch(f"{columns} WHERE customer_id = %s", (int(term),))
+        pattern = like_prefix(term)
+        return self.fetch(
+            f"{columns} WHERE name LIKE %s ESCAPE '!' OR email LIKE %s ESCAPE '!' ORDER BY name LIMIT %s",
+            (pattern, pattern, limit))
+
+    # Hats by brand name prefix, style prefix and exact size; any of them may be left out
+    def search_hats(self, brand=None, style=None, size=None, limit=SEARCH_LIMIT):
+        conditions, params = [], []
+        if brand:
+            conditions.append("brand_name LIKE %s ESCAPE '!'")
+            params.append(like_prefix(brand.strip()))
+        if style:
+            conditions.append("style LIKE %s ESCAPE '!'")
+            params.append(like_prefix(style.strip()))
+        if size not in (None, ""):
+            conditions.append("size = %s")
+            params.append(parse_id(size, "Size"))
+        if not conditions:
+            return []
+        return self.fetch(
+            "SELECT hat_id, brand_name, style, size, quantity, price FROM hats"
+            f" WHERE {' AND '.join(conditions)} ORDER BY brand_name, style, size LIMIT %s",
+            params + [limit])
+
+    # A customer's orders and/or the orders between two dates, newest first
+    def search_orders(self, customer_id=None, start=None, end=None, limit=SEARCH_LIMIT):
+        conditions, params = [], []
+        if customer_id not in (None, ""):
+            conditions.append("o.customer_id = %s")
+            params.append(parse_id(customer_id, "Customer ID"))
+        for bound, operator in ((start, ">="), (end, "<=")):
+            if bound:
+                bound_date = parse_date(bound)
+                if bound_date is None:
+                    raise ValueError("Search dates must use the format YYYY-MM-DD.")
+                conditions.append(f"o.date {operator} %s")
+                params.append(bound_date)
+        if not conditions:
+            return []
+        # The hat shown is the order's first line; the quantity counts every line. The
+        # hot and archive tables are searched separately, each with its own indexes.
+        rows = []
+        for suffix in ("", "_archive"):
+            rows += self.fetch(
+                "SELECT o.order_id, o.date, o.customer_id, o.hat_id, h.brand_name, h.style,"
+                f" (SELECT COUNT(*) FROM order_lines{suffix} l WHERE l.order_id = o.order_id),"
+                f" (SELECT SUM(l.quantity) FROM order_lines{suffix} l WHERE l.order_id = o.order_id),"
+                f" b.price, b.payment_status FROM orders{suffix} o"
+                f" JOIN hats h ON h.hat_id = o.hat_id LEFT JOIN bills{suffix} b ON b.order_id = o.order_id"
+                f" WHERE {' AND '.join(conditions)} ORDER BY o.date DESC, o.order_id DESC LIMIT %s",
+                params + [limit])
+        rows = sorted(rows, key=lambda row: (row[1], row[0]), reverse=True)[:limit]
+        return [(order_id, order_date, customer_id, hat_id,
+                 f"{brand_name} {style}" + (f" (+{lines - 1} more)" if lines > 1 else ""), units, price, status)
+                for order_id, order_date, customer_id, hat_id, brand_name, style, lines, units, price, status in rows]
+
+    # Move closed orders dated before `before` (paid or declined, and with every
+    # delivery marked Delivered) with their lines, bills and deliveries to the archive
+    # tables. Each batch of `batch_size` orders is copied and deleted in a transaction
+    # of its own, with a short pause in between, so locks are only held briefly while
+    # the shop keeps selling. `progress` is called with the running total after each batch. Returns
+    # the number of orders archived.
+    def archive_orders(self, before, batch_size=ARCHIVE_BATCH_SIZE, progress=None):
+        before = parse_date(before)
+        if before is None:
+            raise ValueError("The archive cutoff must use the format YYYY-MM-DD.")
+        archived = 0
+        while True:
+            with self.transaction() as tx:
+                order_ids = [row[0] for row in tx.fetch(
+                    "SELECT o.order_id FROM orders o WHERE o.date < %s"
+                    " AND NOT EXISTS (SELECT 1 FROM bills b WHERE b.order_id = o.order_id"
+                    " AND b.payment_status IN (%s, %s))"
+                    " AND NOT EXISTS (SELECT 1 FROM delivery d WHERE d.order_id = o.order_id AND d.status <> %s)"
+                    # Oldest first, in the order of the date index so the scan stops at the LIMIT
+                    " ORDER BY o.date, o.order_id LIMIT %s FOR UPDATE",
+                    (before, 'Pending', 'Processing', 'Delivered', batch_size))]
+                if not order_ids:
+                    return archived
+                in_list = placeholders(len(order_ids))
+                for table, columns in ARCHIVED_COLUMNS.items():
+                    tx.execute(
+                        f"INSERT INTO {table}_archive ({columns}) SELECT {columns} FROM {table}"
+                        f" WHERE order_id IN ({in_list})",
+                        order_ids)
+                for table in ARCHIVED_COLUMNS:
+                    tx.execute(f"DELETE FROM {table} WHERE order_id IN ({in_list})", order_ids)
+            archived += len(order_ids)
+            if progress:
+                progress(archived)
+            time.sleep(ARCHIVE_PAUSE)
+
+    # The lead-time rules and holidays, re-read every DELIVERY_RULES_TTL seconds so
+    # changes made at other stations are picked up
+    def delivery_schedule(self):
+        schedule = self._delivery_schedule
+        if schedule is None or time.monotonic() - schedule.loaded_at >= DELIVERY_RULES_TTL:
+            schedule = self._delivery_schedule = DeliverySchedule(
+                self.fetch("SELECT hat_id, region, lead_days, business_days FROM delivery_rules"),
+                [row[0] for row in self.fetch("SELECT day FROM delivery_holidays")])
+        return schedule
+
+    def delivery_rules(self):
+        return self.fetch(
+            "SELECT rule_id, hat_id, region, lead_days, business_days FROM delivery_rules"
+            " ORDER BY hat_id IS NULL, hat_id, region IS NULL, region")
+
+    # Add a lead-time rule, replacing the rule for the same hat and region if there is
+    # one. Returns the rule's ID.
+    def set_delivery_rule(self, hat_id, region, lead_days, business_days=False):
+        with self.transaction() as tx:
+            tx.execute(
+                "DELETE FROM delivery_rules WHERE COALESCE(hat_id, 0) = %s AND COALESCE(region, '') = %s",
+                (hat_id or 0, region or ""))
+            rule_id = tx.execute(
+                "INSERT INTO delivery_rules (hat_id, region, lead_days, business_days) VALUES (%s, %s, %s, %s)",
+                (hat_id, region, lead_days, int(business_days))).lastrowid
+        self._delivery_schedule = None
+        return rule_id
+
+    def delete_delivery_rule(self, rule_id):
+        with self.transaction() as tx:
+            deleted = tx.execute("DELETE FROM delivery_rules WHERE rule_id = %s", (rule_id,)).rowcount
+        self._delivery_schedule = None
+        return deleted
+
+    def delivery_holidays(self):
+        return self.fetch("SELECT day, description FROM delivery_holidays ORDER BY day")
+
+    def set_delivery_holiday(self, day, description=None):
+        with self.transaction() as tx:
+            tx.execute("DELETE FROM delivery_holidays WHERE day = %s", (day,))
+            tx.execute("INSERT INTO delivery_holidays (day, description) VALUES (%s, %s)", (day, description))
+        self._delivery_schedule = None
+
+    def delete_delivery_holiday(self, day):
+        with self.transaction() as tx:
+            deleted = tx.execute("DELETE FROM delivery_holidays WHERE day = %s", (day,)).rowcount
+        self._delivery_schedule = None
+        return deleted
+
+    # One of the DELIVERY_QUEUES: the open deliveries due in its window, optionally in
+    # one region, soonest first. Reads only the window's slice of the status/arrival
+    # date index however long the delivery history is.
+    def due_deliveries(self, queue, region=None, limit=DELIVERY_QUEUE_LIMIT):
+        window = DELIVERY_QUEUES[queue]
+        today = date.today()
+        conditions = [f"d.status IN ({placeholders(len(DELIVERY_OPEN))})", "d.arrival_date < %s"]
+        params = list(DELIVERY_OPEN) + [today + timedelta(days=window['end'])]
+        if window['start'] is not None:
+            conditions.append("d.arrival_date >= %s")
+            params.append(today + timedelta(days=window['start']))
+        if region:
+            conditions.append("d.region = %s")
+            params.append(region)
+        return self.fetch(
+            "SELECT d.delivery_id, d.order_id, d.arrival_date, d.status, d.region, c.name, c.address"
+            " FROM delivery d JOIN orders o ON o.order_id = d.order_id"
+            " JOIN customers c ON c.customer_id = o.customer_id"
+            f" WHERE {' AND '.join(conditions)} ORDER BY d.arrival_date, d.delivery_id LIMIT %s",
+            params + [limit])
+
+    # Set the status of many deliveries with one UPDATE. Returns the number changed.
+    def set_delivery_status(self, delivery_ids, status):
+        delivery_ids = sorted(set(delivery_ids))
+        if not delivery_ids:
+            return 0
+        with self.transaction() as tx:
+            return tx.execute(
+                "UPDATE delivery SET status = %s, version = version + 1"
+                f" WHERE delivery_id IN ({placeholders(len(delivery_ids))}) AND status <> %s",
+                [status] + delivery_ids + [status]).rowcount
+
+    # Move the open deliveries due between `start` and `end` (inclusive dates) by
+    # `days` days, or business days, in one UPDATE: every date in the range is mapped
+    # to its new date in Python, so weekends and holidays need no SQL date functions.
+    # `region` and `hat_id` narrow it to one region or the orders containing one hat.
+    # Returns the number of deliveries moved.
+    def reschedule_deliveries(self, days, start, end, region=None, hat_id=None, business_days=False):
+        schedule = self.delivery_schedule()
+        moves = []
+        for offset in range((end - start).days + 1):
+            day = start + timedelta(days=offset)
+            new_day = schedule.shift(day, days, business_days)
+            if new_day != day:
+                moves.append((day, new_day))
+        if not moves:
+            return 0
+        conditions = [f"status IN ({placeholders(len(DELIVERY_OPEN))})",
+                      f"arrival_date IN ({placeholders(len(moves))})"]
+        params = list(DELIVERY_OPEN) + [day for day, _ in moves]
+        if region:
+            conditions.append("region = %s")
+            params.append(region)
+        if hat_id is not None:
+            conditions.append("order_id IN (SELECT order_id FROM order_lines WHERE hat_id = %s)")
+            params.append(hat_id)
+        cases = " ".join(["WHEN %s THEN %s"] * len(moves))
+        with self.transaction() as tx:
+            return tx.execute(
+                f"UPDATE delivery SET arrival_date = CASE arrival_date {cases} END, version = version + 1"
+                f" WHERE {' AND '.join(conditions)}",
+                [value for move in moves for value in move] + params).rowcount
+
+    # Recompute the summary tables from the order history, e.g. after orders were
+    # changed outside HatHive
+    def rebuild_sales_summary(self):
+        with self.transaction() as tx:
+            for statement in SUMMARY_REBUILD:
+                tx.execute(statement)
+
+    # Run one of REPORTS, optionally limited to orders between `start` and `end`
+    # (inclusive, YYYY-MM-DD). Returns the report's rows.
+    def sales_report(self, name, start=None, end=None, limit=REPORT_LIMIT):
+        report = REPORTS[name]
+        conditions, params = [], []
+        for bound, column, operator in ((start, report['start'], ">="), (end, report['end'], "<=")):
+            if bound:
+                bound_date = parse_date(bound)
+                if bound_date is None:
+                    raise ValueError("Report dates must use the format YYYY-MM-DD.")
+                conditions.append(f"{column} {operator} %s")
+                params.append(bound_date)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        rows = self.fetch(report['query'].format(where=where) + " LIMIT %s", params + [limit])
+        return [tuple(money(value) if i in report['money'] and value is not None else value
+                      for i, value in enumerate(row))
+                for row in rows]
+
+    # Load validated rows into `customers` or `hats`. Records are streamed from `records`
+    # (any iterable of mappings), validated one by one and written with multi-row
+    # INSERTs of `chunk_size` rows, each chunk in its own transaction so a large file
+    # never holds locks for long. Returns (loaded, rejected) where rejected lists
+    # (index, reason), indexes counting from 0 in `records`.
+    def import_rows(self, table, records, chunk_size=IMPORT_CHUNK_SIZE):
+        columns, make_row = IMPORTS[table]
+        rejected = []
+
+        def valid_rows():
+            for index, record in enumerate(records):
+                try:
+                    yield make_row(record)
+                except ValueError as e:
+                    rejected.append((index, str(e)))
+
+        row_sql = f"({placeholders(len(columns))})"
+        loaded = 0
+        for chunk in chunked(valid_rows(), chunk_size):
+            with self.transaction() as tx:
+                tx.execute(
+                    f"INSERT INTO {table} ({', '.join(columns)}) VALUES " + ", ".join([row_sql] * len(chunk)),
+                    [value for row in chunk for value in row])
+            loaded += len(chunk)
+        return loaded, rejected
+
+    # Charge bills through `gateway` on background workers from now on, starting with
+    # the bills left Pending by earlier runs
+    def start_payments(self, gateway, workers=PAYMENT_WORKERS):
+        self.payments = PaymentQueue(self, gateway, workers)
+        self.payments.start()
+        return self.payments
+
+    # Delete every row from the application tables
+    def clear_all_data(self):
+        with self.checkout() as connection:
+            self.backend.clear_tables(
+                connection,
+                ['bills', 'delivery', 'order_lines', 'orders', 'hats', 'customers']
+                + list(ARCHIVE_TABLES) + list(SUMMARY_TABLES))
+        self.hat_cache.clear()
+
+    # Live counters for the diagnostics panel and the stats exports
+    def counters(self):
+        pool = self.pool
+        return {
+            'queries': self.stats.calls,
+            'query_errors': self.stats.errors,
+            'slow_queries': self.stats.slow,
+            'pool_size': self.pool_size,
+            'pool_in_use': pool.in_use if pool else 0,
+            'pool_idle': pool.idle() if pool else 0,
+            'pool_opened': pool.opened if pool else 0,
+            'pool_waits': pool.waits if pool else 0,
+            'hat_cache_hits': self.hat_cache.hits,
+            'hat_cache_misses': self.hat_cache.misses,
+            'prepared_statements': sum(len(statements) for statements in list(self._statements.values())),
+            **(self.payments.counters() if self.payments else {}),
+        }
+
+    # Statement statistics as JSON, or in the Prometheus text format
+    def export_stats(self, fmt='json'):
+        if fmt == 'prometheus':
+            return self.stats.to_prometheus(self.counters())
+        return self.stats.to_json(self.counters())
+
+    def close(self):
+        if self.payments:
+            self.payments.stop()
+            self.payments = None
+        if self.pool:
+            self.pool.close()
+            print(f"{self.backend.name} connections are closed")
+
+
+class FakePaymentGateway:
+    # Stand-in for a card processor, for development and tests. Every charge takes
+    # `latency` seconds and a `decline_rate` share of them are declined. Like a real
+    # gateway it treats the bill ID as an idempotency key: charging a bill again
+    # returns the original transaction instead of charging twice.
+    def __init__(self, latency=0.0, decline_rate=0.0, seed=None):
+        import random
+        self.latency = latency
+        self.decline_rate = decline_rate
+        self._random = random.Random(seed)
+        self._charged = {}
+        self._lock = threading.Lock()
+
+    # Returns the transaction ID, or raises PaymentDeclined
+    def charge(self, bill_id, amount_due, payment_method):
+        if self.latency:
+            time.sleep(self.latency)
+        with self._lock:
+            if bill_id in self._charged:
+                return self._charged[bill_id]
+            if self._random.random() < self.decline_rate:
+                raise PaymentDeclined(f"{payment_method} declined")
+            transaction_id = self._charged[bill_id] = make_transaction_id(bill_id, amount_due)
+        return transaction_id
+
+
+# The gateway the app, the server and the order import charge bills through. A
+# client for the real card processor plugs in here; it needs the same charge().
+def make_payment_gateway():
+    return FakePaymentGateway()
+
+
+class PaymentQueue:
+    # Charges Pending bills on `workers` threads and writes the outcomes back to the
+    # bills table in batches: up to PAYMENT_BATCH_SIZE rows per transaction, keyed by
+    # bill_id. Before charging, a worker claims the bill by moving it from Pending to
+    # Processing for PAYMENT_CLAIM_SECONDS; a bill another station has claimed is
+    # skipped, so two stations resuming the same bills never both charge one. A bill
+    # whose gateway calls keep failing goes back to Pending, and one whose station
+    # died mid-charge is taken over once its claim runs out; either way the next
+    # start(), whichever station runs it, picks it up again.
+    def __init__(self, db_manager, gateway, workers=PAYMENT_WORKERS):
+        self.db_manager = db_manager
+        self.gateway = gateway
+        self.workers = workers
+        self._jobs = queue.Queue()
+        self._results = queue.Queue()
+        self._stopping = threading.Event()
+        self._charged = threading.Event()  # set once the workers have stopped
+        self._threads = []
+        self._writer = None
+        self._lock = threading.Lock()
+        self.paid = 0
+        self.declined = 0
+        self.failed = 0  # left Pending after PAYMENT_ATTEMPTS gateway errors
+
+    def start(self):
+        pending = self.db_manager.fetch(
+            "SELECT bill_id, price + tax, payment_method FROM bills WHERE payment_status = %s"
+            " OR (payment_status = %s AND claimed_until < %s) ORDER BY bill_id",
+            ('Pending', 'Processing', int(time.time())))
+        if pending:
+            print(f"Resuming {len(pending)} pending payments")
+        for bill_id, amount_due, payment_method in pending:
+            self.submit(bill_id, amount_due, payment_method)
+        self._threads = [threading.Thread(target=self._charge_bills, name=f"payment-{i}", daemon=True)
+                         for i in range(self.workers)]
+        self._writer = threading.Thread(target=self._write_results, name="payment-writer", daemon=True)
+        for thread in self._threads + [self._writer]:
+            thread.start()
+
+    def submit(self, bill_id, amount_due, payment_method):
+        self._jobs.put((bill_id, money(amount_due), payment_method))
+
+    def _charge_bills(self):
+        while not self._stopping.is_set():
+            try:
+                bill_id, amount_due, payment_method = self._jobs.get(timeout=PAYMENT_FLUSH_SECONDS)
+            except queue.Empty:
+                continue
+            try:
+                update = self._charge(bill_id, amount_due, payment_method)
+                if update is not None:
+                    self._results.put(update)
+            finally:
+                self._jobs.task_done()
+
+    # Take the bill for this station; False when another station holds it or it is
+    # no longer waiting to be charged
+    def _claim(self, bill_id):
+        now = int(time.time())
+        try:
+            return self.db_manager.execute(
+                "UPDATE bills SET payment_status = %s, claimed_until = %s, version = version + 1"
+                " WHERE bill_id = %s AND (payment_status = %s OR (payment_status = %s AND claimed_until < %s))",
+                ('Processing', now + PAYMENT_CLAIM_SECONDS, bill_id, 'Pending', 'Processing', now)) == 1
+        except Exception as e:
+            print(f"Could not claim bill {bill_id}: {e}")
+            return False
+
+    # Returns the (status, transaction_id, bill_id) update for the bill, or None when
+    # it was not claimed. A bill that could not be charged is handed back as Pending.
+    def _charge(self, bill_id, amount_due, payment_method):
+        if not self._claim(bill_id):
+            return None
+        for attempt in range(1, PAYMENT_ATTEMPTS + 1):
+            try:
+                return 'Paid', self.gateway.charge(bill_id, amount_due, payment_method), bill_id
+            except PaymentDeclined:
+                return 'Declined', None, bill_id
+            except Exception as e:
+                print(f"Payment of bill {bill_id} failed (attempt {attempt}): {e}")
+                if attempt == PAYMENT_ATTEMPTS or self._stopping.wait(0.5 * 2 ** attempt):
+                    return 'Pending', None, bill_id
+
+    def _write_results(self):
+        while True:
+            batch = []
+            deadline = time.monotonic() + PAYMENT_FLUSH_SECONDS
+            while len(batch) < PAYMENT_BATCH_SIZE:
+                try:
+                    batch.append(self._results.get(timeout=max(0, deadline - time.monotonic())))
+                except queue.Empty:
+                    break
+            try:
+                if batch:
+                    # One transaction, so the batch costs a single commit
+                    with self.db_manager.transaction() as tx:
+                        tx.executemany(
+                            "UPDATE bills SET payment_status = %s, transaction_id = %s, claimed_until = NULL,"
+                            " version = version + 1 WHERE bill_id = %s AND payment_status = 'Processing'",
+                            batch)
+            except Exception as e:
+                # The bills stay Processing until their claims run out, then another
+                # start() takes them over; the gateway will not charge them twice
+                print(f"Could not record {len(batch)} payments: {e}")
+            with self._lock:
+                self.paid += sum(1 for update in batch if update[0] == 'Paid')
+                self.declined += sum(1 for update in batch if update[0] == 'Declined')
+                self.failed += sum(1 for update in batch if update[0] == 'Pending')
+            for _ in batch:
+                self._results.task_done()
+            if self._charged.is_set() and self._results.empty():
+                return
+
+    # Block until every submitted bill has been charged and recorded
+    def drain(self):
+        self._jobs.join()
+        self._results.join()
+
+    # Stop taking new bills and write out the outcomes already known. Bills still
+    # queued were never claimed and stay Pending in the database; they are dropped from
+    # the queue so a later drain() does not wait for them.
+    def stop(self):
+        self._stopping.set()
+        for thread in self._threads:
+            thread.join()
+        while True:
+            try:
+                self._jobs.get_nowait()
+            except queue.Empty:
+                break
+            self._jobs.task_done()
+        self._charged.set()
+        if self._writer:
+            self._writer.join()
+        self._threads, self._writer = [], None
+
+    def counters(self):
+        return {
+            'payments_queued': self._jobs.qsize(),
+            'payments_paid': self.paid,
+            'payments_declined': self.declined,
+            'payments_failed': self.failed,
+        }
+
+
+class OrderJournal:
+    # Orders taken at this station, kept in an append-only JSON Lines file before the
+    # database has them. append() returns once the entry is on disk (flushed and
+    # fsync'd), so taking an order costs a local write whether the database is slow,
+    # unreachable or not connected yet. A replayer thread sends the entries to the
+    # database in batches (DatabaseManager.replay_orders) and appends a marker line for
+    # each applied or rejected one; entries without a marker are replayed after a
+    # restart. Rejected orders are also copied to `<journal>-rejected.jsonl` for
+    # follow-up. Once everything is applied the journal is truncated.
+    def __init__(self, path=JOURNAL_PATH):
+        self.path = path
+        self.rejected_path = os.path.splitext(path)[0] + "-rejected.jsonl"
+        self.db_manager = None
+        self._pending = OrderedDict()  # key -> entry, in the order they were taken
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopping = threading.Event()
+        self._thread = None
+        self.applied = 0
+        self.rejected = []  # (entry, reason) of the orders rejected since startup
+        self.replay_errors = 0
+        self._load()
+        self._file = open(path, "a", encoding="utf-8")
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, "rb+") as f:
+            data = f.read()
+            # A crash halfway through an append leaves a partial last line; drop it so
+            # the next entry starts on a line of its own
+            end = data.rfind(b"\n") + 1
+            if end < len(data):
+                f.truncate(end)
+        for line in data[:end].splitlines():
+            record = json.loads(line)
+            if 'key' in record:
+                self._pending[record['key']] = record
+            else:
+                self._pending.pop(record.get('applied') or record.get('rejected'), None)
+        if self._pending:
+            print(f"{len(self._pending)} orders in {self.path} are waiting to be placed")
+
+    def _write(self, records):
+        self._file.write("".join(json.dumps(record, default=str) + "\n" for record in records))
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    # Record an order. Raises ValueError for input that could never be placed; stock
+    # and customer checks happen when the entry is replayed. Returns the entry's key.
+    # `key` reuses the journal key of an order that may already have reached the
+    # database, so replaying it cannot place it twice
+    def append(self, customer_id, lines, order_date=None, payment_method=PAYMENT_METHOD, key=None):
+        pairs = []
+        for hat_id, quantity in parse_cart(lines):
+            try:
+                quantity = int(quantity)
+            except (TypeError, ValueError):
+                quantity = 0
+            if quantity <= 0:
+                raise ValueError("Quantity must be a positive whole number.")
+            pairs.append([hat_id, quantity])
+        order_date = order_date or date.today().isoformat()
+        if not validate_date(order_date):
+            raise ValueError("The order date is in an incorrect format. Please use YYYY-MM-DD.")
+        entry = {
+            'key': key or uuid.uuid4().hex,
+            'customer_id': parse_id(customer_id, "Customer ID"),
+            'lines': pairs,
+            'date': order_date,
+            'payment_method': payment_method,
+            'taken_at': time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        }
+        with self._lock:
+            self._write([entry])
+            self._pending[entry['key']] = entry
+        self._wake.set()
+        return entry['key']
+
+    def backlog(self):
+        return len(self._pending)
+
+    # Send the oldest pending entries to the database. Returns how many were sent;
+    # database errors propagate and leave the entries pending.
+    def replay_batch(self, batch_size=JOURNAL_BATCH_SIZE):
+        with self._lock:
+            batch = list(islice(self._pending.values(), batch_size))
+        if not batch:
+            return 0
+        results = self.db_manager.replay_orders(batch)
+        entries = {entry['key']: entry for entry in batch}
+        markers, rejected = [], []
+        for key, order_id, reason in results:
+            if order_id is None:
+                markers.append({'rejected': key, 'reason': reason})
+                rejected.append((entries[key], reason))
+            else:
+                markers.append({'applied': key, 'order_id': order_id})
+        if rejected:
+            with open(self.rejected_path, "a", encoding="utf-8") as f:
+                for entry, reason in rejected:
+                    f.write(json.dumps({**entry, 'reason': reason}) + "\n")
+            for entry, reason in rejected:
+                print(f"Journaled order {entry['key']} was rejected: {reason}")
+        with self._lock:
+            self._write(markers)
+            for key, _, _ in results:
+                del self._pending[key]
+            if not self._pending:
+                self._file.truncate(0)
+                os.fsync(self._file.fileno())
+            self.applied += len(results) - len(rejected)
+            self.rejected.extend(rejected)
+        return len(batch)
+
+    # Replay every pending entry now, on the calling thread
+    def drain(self):
+        while self.replay_batch():
+            pass
+
+    # Replay in the background against `db_manager`, retrying every
+    # JOURNAL_RETRY_SECONDS while the database cannot be reached
+    def start(self, db_manager):
+        self.stop()
+        self.db_manager = db_manager
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._replay, name="journal-replayer", daemon=True)
+        self._thread.start()
+
+    def _replay(self):
+        while not self._stopping.is_set():
+            self._wake.clear()
+            try:
+                if self.replay_batch():
+                    continue
+            except Exception as e:
+                self.replay_errors += 1
+                print(f"Could not place journaled orders, retrying in {JOURNAL_RETRY_SECONDS}s: {e}")
+                self._stopping.wait(JOURNAL_RETRY_SECONDS)
+                continue
+            self._wake.wait(JOURNAL_RETRY_SECONDS)
+
+    # Stop replaying once the batch in flight is done; pending entries stay journaled
+    def stop(self):
+        self._stopping.set()
+        self._wake.set()
+        if self._thread:
+            self._thread.join()
+        self._thread = None
+
+    def close(self):
+        self.stop()
+        self._file.close()
+
+    def counters(self):
+        return {
+            'journal_backlog': self.backlog(),
+            'journal_applied': self.applied,
+            'journal_rejected': len(self.rejected),
+            'journal_replay_errors': self.replay_errors,
+        }
+
+
+# NumPy is only needed by the analytics and is slow to import
+def import_numpy():
+    try:
+        import numpy
+    except ImportError:
+        raise ValueError("Analytics need NumPy: pip install numpy")
+    return numpy
+
+
+# The analytics computations below take and return NumPy arrays only, so they can run
+# in worker processes. Days are date.toordinal() numbers and money is in cents.
+
+# Units sold per style/size group since day `since`, the stock left in the group and
+# the sell-through rate sold / (sold + stock)
+def sell_through(line_hat, line_quantity, line_day, hat_group, hat_stock, groups, since):
+    np = import_numpy()
+    recent = line_day >= since
+    sold_by_hat = np.bincount(line_hat[recent], weights=line_quantity[recent], minlength=len(hat_stock))
+    sold = np.bincount(hat_group, weights=sold_by_hat, minlength=groups)
+    stock = np.bincount(hat_group, weights=np.maximum(hat_stock, 0), minlength=groups)
+    total = sold + stock
+    return sold, stock, np.divide(sold, total, out=np.zeros(groups), where=total > 0)
+
+
+# Units sold per day by each hat over the `window` days up to `today`, and the days
+# its stock lasts at that rate (infinite for hats that did not sell)
+def stockout_forecast(line_hat, line_quantity, line_day, hat_stock, today, window):
+    np = import_numpy()
+    recent = line_day > today - window
+    velocity = np.bincount(line_hat[recent], weights=line_quantity[recent], minlength=len(hat_stock)) / window
+    days_left = np.divide(np.maximum(hat_stock, 0), velocity, out=np.full(len(hat_stock), np.inf),
+                          where=velocity > 0)
+    return velocity, days_left
+
+
+# Customers grouped by the month of their first order. Per cohort: customers, orders,
+# revenue, customers with more than one order, customers who ordered on or after
+# `active_since`, and the billed and paid amounts (bill status 1 is Paid).
+def customer_cohorts(line_order, line_customer, line_day, line_cents, bill_order, bill_cents, bill_status,
+                     active_since):
+    np = import_numpy()
+    orders, first_line, order_of_line = np.unique(line_order, return_index=True, return_inverse=True)
+    order_cents = np.bincount(order_of_line, weights=line_cents, minlength=len(orders))
+    order_day = line_day[first_line]
+    customers, customer_of_order = np.unique(line_customer[first_line], return_inverse=True)
+    first_day = np.full(len(customers), np.iinfo(np.int32).max, dtype=np.int32)
+    np.minimum.at(first_day, customer_of_order, order_day)
+    last_day = np.zeros(len(customers), dtype=np.int32)
+    np.maximum.at(last_day, customer_of_order, order_day)
+    order_count = np.bincount(customer_of_order, minlength=len(customers))
+
+    months = (first_day.astype(np.int64) - date(1970, 1, 1).toordinal()).astype('datetime64[D]').astype(
+        'datetime64[M]')
+    cohorts, cohort_of_customer = np.unique(months, return_inverse=True)
+    size = len(cohorts)
+
+    def per_cohort(weights):
+        return np.bincount(cohort_of_customer, weights=weights, minlength=size)
+
+    # Bills of orders that are not in the snapshot (e.g. deleted) are left out
+    bill_index = np.minimum(np.searchsorted(orders, bill_order), max(len(orders) - 1, 0))
+    billed = orders[bill_index] == bill_order if len(orders) else np.zeros(len(bill_order), dtype=bool)
+    bill_cohort = cohort_of_customer[customer_of_order[bill_index[billed]]]
+    return (
+        np.datetime_as_string(cohorts, unit='M'),
+        per_cohort(None),
+        per_cohort(order_count),
+        per_cohort(np.bincount(customer_of_order, weights=order_cents, minlength=len(customers))),
+        per_cohort(order_count > 1),
+        per_cohort(last_day >= active_since),
+        np.bincount(bill_cohort, weights=bill_cents[billed], minlength=size),
+        np.bincount(bill_cohort, weights=bill_cents[billed] * (bill_status[billed] == 1), minlength=size),
+    )
+
+
+class AnalyticsSnapshot:
+    # Column arrays of the order lines (with their order's customer and date), bills
+    # and hats, for the analytics in ANALYTICS. The first refresh() streams the whole
+    # history, archive included, in chunks of ANALYTICS_CHUNK_SIZE rows. Later ones
+    # only read the lines and bills above the highest IDs already loaded, plus the
+    # bills from the oldest one still Pending, whose status may have changed. Hats are
+    # few and read in full every time.
+    LINE_COLUMNS = (("line_id", "int64"), ("order_id", "int64"), ("customer_id", "int64"), ("hat_id", "int64"),
+                    ("day", "int32"), ("quantity", "int32"), ("cents", "int64"))
+    BILL_COLUMNS = (("bill_id", "int64"), ("order_id", "int64"), ("cents", "int64"), ("status", "int8"))
+    BILL_STATUSES = {'Pending': 0, 'Processing': 0, 'Paid': 1, 'Declined': 2}
+
+    def __init__(self, db_manager, chunk_size=ANALYTICS_CHUNK_SIZE):
+        self.np = import_numpy()
+        self.db_manager = db_manager
+        self.chunk_size = chunk_size
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        np = self.np
+        self.lines = {name: np.empty(0, dtype) for name, dtype in self.LINE_COLUMNS}
+        self.bills = {name: np.empty(0, dtype) for name, dtype in self.BILL_COLUMNS}
+        self.hats = None
+        self.line_watermark = 0
+        self.bill_watermark = 0
+
+    def _chunks_to_columns(self, chunks, columns, convert):
+        np = self.np
+        parts = []
+        for chunk in chunks:
+            values = list(zip(*chunk))
+            parts.append([np.asarray(convert(name, values[i]), dtype) for i, (name, dtype) in enumerate(columns)])
+        return [np.concatenate([part[i] for part in parts]) if parts else np.empty(0, dtype)
+                for i, (_, dtype) in enumerate(columns)]
+
+    def _convert(self, name, values):
+        if name == "day":
+            return [value.toordinal() for value in values]
+        if name == "cents":
+            return self.np.round(self.np.asarray(values, dtype=self.np.float64) * 100)
+        if name == "status":
+            return [self.BILL_STATUSES.get(value, 3) for value in values]
+        return values
+
+    # Bring the arrays up to date. Returns the number of lines and bills read.
+    def refresh(self):
+        np = self.np
+        with self._lock:
+            newest = max(self.db_manager.fetch(f"SELECT MAX(line_id) FROM {table}")[0][0] or 0
+                         for table in ("order_lines", "order_lines_archive"))
+            if newest < self.line_watermark:
+                self._reset()  # Data was cleared since the last refresh
+            suffixes = ("_archive", "") if self.line_watermark == 0 else ("",)
+
+            def line_chunks():
+                for suffix in suffixes:
+                    yield from self.db_manager.iter_query(
+                        "SELECT l.line_id, l.order_id, o.customer_id, l.hat_id, o.date, l.quantity, l.price"
+                        f" FROM order_lines{suffix} l JOIN orders{suffix} o ON o.order_id = l.order_id"
+                        " WHERE l.line_id > %s",
+                        (self.line_watermark,), self.chunk_size)
+
+            new_lines = self._chunks_to_columns(line_chunks(), self.LINE_COLUMNS, self._convert)
+            lines = {name: np.concatenate([self.lines[name], column])
+                     for (name, _), column in zip(self.LINE_COLUMNS, new_lines)}
+            read = len(new_lines[0])
+
+            pending = self.bills['bill_id'][self.bills['status'] == 0]
+            since = int(pending.min()) if len(pending) else self.bill_watermark + 1
+
+            def bill_chunks():
+                for suffix in suffixes:
+                    yield from self.db_manager.iter_query(
+                        f"SELECT bill_id, order_id, price + tax, payment_status FROM bills{suffix} WHERE bill_id >= %s",
+                        (since,), self.chunk_size)
+
+            bill_ids, order_ids, cents, status = self._chunks_to_columns(bill_chunks(), self.BILL_COLUMNS, self._convert)
+            read += len(bill_ids)
+            known = bill_ids <= self.bill_watermark
+            bills = {name: self.bills[name].copy() for name, _ in self.BILL_COLUMNS}
+            if known.any():
+                # Bill IDs are kept sorted, so the bills re-read can be found by binary search
+                index = np.minimum(np.searchsorted(bills['bill_id'], bill_ids[known]), len(bills['bill_id']) - 1)
+                match = bills['bill_id'][index] == bill_ids[known]
+                bills['status'][index[match]] = status[known][match]
+            for name, column in zip(("bill_id", "order_id", "cents", "status"), (bill_ids, order_ids, cents, status)):
+                bills[name] = np.concatenate([bills[name], column[~known]])
+            if len(bills['bill_id']) and np.any(np.diff(bills['bill_id']) < 0):
+                order = np.argsort(bills['bill_id'], kind='stable')
+                bills = {name: column[order] for name, column in bills.items()}
+
+            rows = self.db_manager.fetch("SELECT hat_id, brand_name, style, size, quantity FROM hats ORDER BY hat_id")
+            groups = {}
+            self.hats = {
+                'hat_id': np.array([row[0] for row in rows], dtype=np.int64),
+                'stock': np.array([row[4] for row in rows], dtype=np.int64),
+                'group': np.array([groups.setdefault((row[2], row[3]), len(groups)) for row in rows], dtype=np.int64),
+                'groups': list(groups),
+                'rows': rows,
+            }
+            self.lines, self.bills = lines, bills
+            if len(lines['line_id']):
+                self.line_watermark = int(lines['line_id'].max())
+            if len(bills['bill_id']):
+                self.bill_watermark = int(bills['bill_id'][-1])
+            return read
+
+    # Run every analysis over the snapshot and return their rows by ANALYTICS name.
+    # With `parallel` (by default once there are ANALYTICS_PARALLEL_LINES lines) the
+    # analyses run side by side in worker processes.
+    def compute(self, today=None, parallel=None):
+        np = self.np
+        with self._lock:
+            lines, bills, hats = self.lines, self.bills, self.hats
+        if hats is None:
+            raise ValueError("The analytics snapshot has not been loaded yet.")
+        today = (today or date.today()).toordinal()
+        hat_count = len(hats['hat_id'])
+
+        # Lines of hats that no longer exist are left out of the inventory figures
+        hat_index = np.minimum(np.searchsorted(hats['hat_id'], lines['hat_id']), max(hat_count - 1, 0))
+        found = hats['hat_id'][hat_index] == lines['hat_id'] if hat_count else np.zeros(len(hat_index), dtype=bool)
+        line_hat, quantity, day = hat_index[found], lines['quantity'][found], lines['day'][found]
+        jobs = [
+            (sell_through, (line_hat, quantity, day, hats['group'], hats['stock'], len(hats['groups']),
+                            today - ANALYTICS_WINDOW_DAYS + 1)),
+            (stockout_forecast, (line_hat, quantity, day, hats['stock'], today, ANALYTICS_WINDOW_DAYS)),
+            (customer_cohorts, (lines['order_id'], lines['customer_id'], lines['day'], lines['cents'],
+                                bills['order_id'], bills['cents'], bills['status'], today - ANALYTICS_ACTIVE_DAYS)),
+        ]
+        if parallel is None:
+            parallel = len(lines['line_id']) >= ANALYTICS_PARALLEL_LINES
+        if parallel:
+            # Spawned rather than forked: the GUI and the server run other threads
+            import multiprocessing
+            from concurrent.futures import ProcessPoolExecutor
+            with ProcessPoolExecutor(len(jobs), mp_context=multiprocessing.get_context("spawn")) as pool:
+                futures = [pool.submit(function, *args) for function, args in jobs]
+                results = [future.result() for future in futures]
+        else:
+            results = [function(*args) for function, args in jobs]
+        (sold, stock, rate), (velocity, days_left), cohorts = results
+
+        def cents(value):
+            return money(Decimal(int(round(value))) / 100)
+
+        def percent(part, whole):
+            return f"{100 * part / whole:.1f}" if whole else "-"
+
+        report = {'sell-through': [
+            (style, size, int(sold[group]), int(stock[group]), f"{100 * rate[group]:.1f}")
+            for group, (style, size) in sorted(enumerate(hats['groups']), key=lambda item: -rate[item[0]])]}
+
+        selling = np.flatnonzero(velocity > 0)
+        selling = selling[np.argsort(days_left[selling], kind='stable')][:REPORT_LIMIT]
+        report['stockouts'] = [
+            hats['rows'][index][:4] + (int(hats['stock'][index]), f"{velocity[index]:.2f}", f"{days_left[index]:.1f}",
+                                       date.fromordinal(today + int(days_left[index]))
+                                       if today + days_left[index] < date.max.toordinal() else None)
+            for index in selling]
+
+        labels, customers, orders, revenue, repeat, active, billed, paid = cohorts
+        report['cohorts'] = [
+            (str(labels[i]), int(customers[i]), int(orders[i]), cents(revenue[i]),
+             cents(revenue[i] / customers[i]), percent(repeat[i], customers[i]), percent(active[i], customers[i]),
+             percent(paid[i], billed[i]))
+            for i in range(len(labels))]
+        return report
+
+    def counters(self):
+        return {
+            'analytics_lines': len(self.lines['line_id']),
+            'analytics_bills': len(self.bills['bill_id']),
+            'analytics_bytes': sum(column.nbytes for column in [*self.lines.values(), *self.bills.values()]),
+        }
+
+
+# Columns of a hat as returned by HatHiveService.get_hat, in hat cache row order
+HAT_FIELDS = ("hat_id", "brand_id", "brand_name", "style", "size", "quantity", "price", "version")
+
+
+class HatHiveService:
+    # The shop's operations without any user interface attached. The Tk app and the
+    # HTTP server are both clients of this class. Input the caller can correct raises
+    # ValueError, and an order that cannot be placed raises OrderError.
+    def __init__(self, db_manager):
+        self.db_manager = db_manager
+        self._analytics = None
+        self._analytics_lock = threading.Lock()
+
+    def add_customer(self, record):
+        values = customer_row(record)
+        with self.db_manager.transaction() as tx:
+            return tx.execute(
+                "INSERT INTO customers (name, DOB, email, contact_info, address) VALUES (%s, %s, %s, %s, %s)",
+                values).lastrowid
+
+    def add_hat(self, record):
+        values = hat_row(record)
+        with self.db_manager.transaction() as tx:
+            return tx.execute(
+                "INSERT INTO hats (brand_id, brand_name, style, size, quantity, price)"
+                " VALUES (%s, %s, %s, %s, %s, %s)",
+                values).lastrowid
+
+    def get_hat(self, hat_id, revalidate=False):
+        hat = self.db_manager.get_hat(parse_id(hat_id, "Hat ID"), revalidate)
+        return dict(zip(HAT_FIELDS, hat)) if hat else None
+
+    # Place one order; the date defaults to today. Returns (order_id, total_price, tax).
+    def place_order(self, customer_id, hat_id, quantity, order_date=None, payment_method=PAYMENT_METHOD):
+        customer_id = parse_id(customer_id, "Customer ID")
+        hat_id = parse_id(hat_id, "Hat ID")
+        order_date = order_date or date.today().isoformat()
+        return self.db_manager.place_order(customer_id, hat_id, order_date, quantity, payment_method)
+
+    # Place one order for several hats. `lines` is a list of {"hat_id": ..., "quantity": ...}
+    # mappings or (hat_id, quantity) pairs. Returns (order_id, total_price, tax).
+    def place_cart(self, customer_id, lines, order_date=None, payment_method=PAYMENT_METHOD, journal_key=None):
+        pairs = parse_cart(lines)
+        customer_id = parse_id(customer_id, "Customer ID")
+        order_date = order_date or date.today().isoformat()
+        return self.db_manager.place_cart(customer_id, pairs, order_date, payment_method, journal_key)
+
+    def place_orders(self, orders, payment_method=PAYMENT_METHOD):
+        return self.db_manager.place_orders(orders, payment_method)
+
+    def page(self, view_name, limit=PAGE_SIZE, after=None, before=None, at=None):
+        view = VIEWS.get(view_name)
+        if view is None:
+            raise ValueError(f"Unknown view: {view_name}")
+        return self.db_manager.fetch_page(view['query'], view['key'], limit, after, before, at)
+
+    def page_versions(self, view_name, first_key, last_key):
+        return self.db_manager.page_versions(VIEWS[view_name], first_key, last_key)
+
+    # See DatabaseManager.page_changes
+    def page_changes(self, view_name, versions, limit=PAGE_SIZE, at_end=False):
+        view = VIEWS.get(view_name)
+        if view is None:
+            raise ValueError(f"Unknown view: {view_name}")
+        return self.db_manager.page_changes(view, versions, limit, at_end)
+
+    def search_customers(self, term, limit=SEARCH_LIMIT):
+        return self.db_manager.search_customers(term, limit)
+
+    def search_hats(self, brand=None, style=None, size=None, limit=SEARCH_LIMIT):
+        return self.db_manager.search_hats(brand, style, size, limit)
+
+    # Free-text hat lookup for type-ahead: the first word is a brand prefix, the next
+    # words a style prefix and a number the size
+    def find_hats(self, text, limit=TYPEAHEAD_LIMIT):
+        words = text.split()
+        sizes = [word for word in words if word.isdigit()]
+        words = [word for word in words if not word.isdigit()]
+        return self.search_hats(words[0] if words else None, " ".join(words[1:]) or None,
+                                sizes[0] if sizes else None, limit)
+
+    def search_orders(self, customer_id=None, start=None, end=None, limit=SEARCH_LIMIT):
+        return self.db_manager.search_orders(customer_id, start, end, limit)
+
+    # Write one of EXPORTS to `path` and return (rows written, last key written). With
+    # since_last the export continues after the last key a previous since_last export
+    # of the same data reached, as recorded in `state_path`.
+    def export(self, name, path, fmt="csv", compress=False, start=None, end=None, since_id=None,
+               since_last=False, state_path=EXPORT_STATE_FILE):
+        if name not in EXPORTS:
+            raise ValueError(f"Unknown export: {name}")
+        if fmt not in EXPORT_FORMATS:
+            raise ValueError(f"Unknown export format: {fmt}")
+        state = load_export_state(state_path) if since_last else {}
+        if since_last and since_id is None:
+            since_id = state.get(name)
+        rows, last_key = write_export(
+            self.db_manager.export_chunks(name, start, end, since_id), EXPORTS[name]['columns'], path, fmt, compress)
+        if since_last and last_key is not None:
+            state[name] = last_key
+            save_export_state(state_path, state)
+        return rows, last_key
+
+    def sales_report(self, name, start=None, end=None, limit=REPORT_LIMIT):
+        if name not in REPORTS:
+            raise ValueError(f"Unknown report: {name}")
+        return self.db_manager.sales_report(name, start, end, limit)
+
+    def rebuild_sales_summary(self):
+        self.db_manager.rebuild_sales_summary()
+
+    # Archive closed orders dated before `before` (default: ARCHIVE_AFTER_DAYS ago)
+    def archive_orders(self, before=None, batch_size=ARCHIVE_BATCH_SIZE, progress=None):
+        before = before or (date.today() - timedelta(days=ARCHIVE_AFTER_DAYS)).isoformat()
+        return self.db_manager.archive_orders(before, batch_size, progress)
+
+    # Bring the analytics snapshot up to date (loading it on first use) and run every
+    # analysis in ANALYTICS. Returns the rows of each analysis by name, and the
+    # snapshot's counters with the number of rows the refresh read.
+    def analytics(self, parallel=None):
+        with self._analytics_lock:
+            if self._analytics is None:
+                self._analytics = AnalyticsSnapshot(self.db_manager)
+        read = self._analytics.refresh()
+        return self._analytics.compute(parallel=parallel), {'analytics_rows_read': read, **self._analytics.counters()}
+
+    # Dispatch: the work lists of DELIVERY_QUEUES, delivery status changes and
+    # rescheduling. Regions are matched the way address_region derives them.
+    def due_deliveries(self, queue, region=None, limit=DELIVERY_QUEUE_LIMIT):
+        if queue not in DELIVERY_QUEUES:
+            raise ValueError(f"Unknown delivery list: {queue}")
+        return self.db_manager.due_deliveries(queue, address_region(region), limit)
+
+    def set_delivery_status(self, delivery_ids, status):
+        if status not in DELIVERY_STATUSES:
+            raise ValueError(f"The delivery status must be one of {', '.join(DELIVERY_STATUSES)}.")
+        if not isinstance(delivery_ids, (list, tuple)):
+            raise ValueError("Expected a list of delivery IDs.")
+        return self.db_manager.set_delivery_status(
+            [parse_id(delivery_id, "Delivery ID") for delivery_id in delivery_ids], status)
+
+    def reschedule_deliveries(self, days, start, end, region=None, hat_id=None, business_days=False):
+        days = parse_id(days, "Days")
+        start_date, end_date = parse_date(start), parse_date(end)
+        if start_date is None or end_date is None:
+            raise ValueError("Reschedule dates must use the format YYYY-MM-DD.")
+        if end_date < start_date:
+            raise ValueError("The end date is before the start date.")
+        if (end_date - start_date).days >= DELIVERY_RESCHEDULE_DAYS:
+            raise ValueError(f"Reschedule at most {DELIVERY_RESCHEDULE_DAYS} days at a time.")
+        hat_id = parse_id(hat_id, "Hat ID") if hat_id not in (None, "") else None
+        return self.db_manager.reschedule_deliveries(
+            days, start_date, end_date, address_region(region), hat_id, bool(business_days))
+
+    def delivery_rules(self):
+        return self.db_manager.delivery_rules()
+
+    def set_delivery_rule(self, hat_id, region, lead_days, business_days=False):
+        hat_id = parse_id(hat_id, "Hat ID") if hat_id not in (None, "") else None
+        if hat_id is not None and self.db_manager.get_hat(hat_id) is None:
+            raise ValueError("Hat ID does not exist.")
+        lead_days = parse_id(lead_days, "Lead time")
+        if lead_days < 0:
+            raise ValueError("Lead time cannot be negative.")
+        return self.db_manager.set_delivery_rule(hat_id, address_region(region), lead_days, bool(business_days))
+
+    def delete_delivery_rule(self, rule_id):
+        return self.db_manager.delete_delivery_rule(parse_id(rule_id, "Rule ID"))
+
+    def delivery_holidays(self):
+        return self.db_manager.delivery_holidays()
+
+    def set_delivery_holiday(self, day, description=None):
+        holiday = parse_date(day)
+        if holiday is None:
+            raise ValueError("Holidays must use the format YYYY-MM-DD.")
+        self.db_manager.set_delivery_holiday(holiday, description or None)
+
+    def delete_delivery_holiday(self, day):
+        holiday = parse_date(day)
+        if holiday is None:
+            raise ValueError("Holidays must use the format YYYY-MM-DD.")
+        return self.db_manager.delete_delivery_holiday(holiday)
+
+    def clear_all_data(self):
+        self.db_manager.clear_all_data()
 
-            headers = ["Bill ID", "Order ID", "Tax", "Price", "Payment Method", "Payment Status"]
-            header_string = "".join(h.ljust(col_widths[i] + 2) for i, h in enumerate(headers))
+    def stats(self, fmt='json'):
+        return self.db_manager.export_stats(fmt)
 
-            # Add headers
-            self.query_result.insert(tk.END, header_string + "\n")
-            self.query_result.insert(tk.END, "-" * len(header_string) + "\n")
 
-            for record in records:
-                formatted_record = "".join(str(field).ljust(col_widths[i] + 2) for i, field in enumerate(record))
-                self.query_result.insert(tk.END, formatted_record + "\n")
+def parse_id(value, name):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"{name} must be a whole number.")
+
+
+# The `limit` query parameter of a request, `default` when it is not given, capped at
+# SERVICE_MAX_PAGE_SIZE
+def parse_limit(params, default):
+    limit = parse_id(params.get('limit', default), "limit")
+    if limit <= 0:
+        raise ValueError("limit must be positive.")
+    return min(limit, SERVICE_MAX_PAGE_SIZE)
+
+
+# The lines of a cart as (hat_id, quantity) pairs. `lines` is a list of
+# {"hat_id": ..., "quantity": ...} mappings or (hat_id, quantity) pairs.
+def parse_cart(lines):
+    if not isinstance(lines, (list, tuple)) or not lines:
+        raise ValueError("An order needs a list of hats with their quantities.")
+    pairs = []
+    for line in lines:
+        if isinstance(line, dict):
+            line = (line.get('hat_id'), line.get('quantity'))
+        if not isinstance(line, (list, tuple)) or len(line) != 2:
+            raise ValueError("Each line needs a hat_id and a quantity.")
+        pairs.append((parse_id(line[0], "Hat ID"), line[1]))
+    return pairs
+
+
+class ServiceRequestHandler:
+    # JSON API over HatHiveService, mixed into http.server's BaseHTTPRequestHandler by
+    # make_service_server. Every client connection gets its own thread and keep-alive
+    # is on; the connection pool bounds how many of them hit the database at once.
+    #   GET  /health, /stats, /metrics, /hats/<id>, /<view>?limit=&after=&before=&at=,
+    #        /reports/<report>?start=&end=&limit=, /search/customers?q=,
+    #        /search/hats?brand=&style=&size=, /search/orders?customer_id=&start=&end=,
+    #        /deliveries/today|overdue|week?region=&limit=, /analytics/<analysis>
+    #   POST /customers, /hats, /orders, /orders/bulk, /deliveries/status, /deliveries/reschedule
+    protocol_version = "HTTP/1.1"
+    timeout = SERVICE_TIMEOUT_SECONDS
+
+    def do_GET(self):
+        from urllib.parse import parse_qs, urlsplit
+        url = urlsplit(self.path)
+        parts = [part for part in url.path.split('/') if part]
+        params = {name: values[-1] for name, values in parse_qs(url.query).items()}
+        service = self.server.service
+
+        def route():
+            if parts == ['health']:
+                return 200, {'status': 'ok'}
+            if parts == ['stats']:
+                return 200, json.loads(service.stats('json'))
+            if parts == ['metrics']:
+                return 200, service.stats('prometheus')
+            if len(parts) == 2 and parts[0] == 'hats':
+                hat = service.get_hat(parts[1])
+                return (200, hat) if hat else (404, {'error': "Hat ID does not exist."})
+            if len(parts) == 2 and parts[0] == 'search' and parts[1] in SEARCH_HEADERS:
+                limit = parse_limit(params, SEARCH_LIMIT)
+                if parts[1] == 'customers':
+                    rows = service.search_customers(params.get('q', ""), limit)
+                elif parts[1] == 'hats':
+                    rows = service.search_hats(params.get('brand'), params.get('style'), params.get('size'), limit)
+                else:
+                    rows = service.search_orders(
+                        params.get('customer_id'), params.get('start'), params.get('end'), limit)
+                return 200, {'columns': SEARCH_HEADERS[parts[1]], 'rows': rows}
+            if len(parts) == 2 and parts[0] == 'analytics' and parts[1] in ANALYTICS:
+                report, _ = service.analytics()
+                return 200, {'columns': ANALYTICS[parts[1]]['headers'], 'rows': report[parts[1]]}
+            if len(parts) == 2 and parts[0] == 'deliveries' and parts[1] in DELIVERY_QUEUES:
+                limit = parse_limit(params, DELIVERY_QUEUE_LIMIT)
+                rows = service.due_deliveries(parts[1], params.get('region'), limit)
+                return 200, {'columns': DELIVERY_QUEUE_HEADERS, 'rows': rows}
+            if len(parts) == 2 and parts[0] == 'reports':
+                limit = parse_limit(params, REPORT_LIMIT)
+                rows = service.sales_report(parts[1], params.get('start'), params.get('end'), limit)
+                return 200, {'columns': REPORTS[parts[1]]['headers'], 'rows': rows}
+            if len(parts) == 1 and parts[0] in VIEWS:
+                limit = parse_limit(params, PAGE_SIZE)
+                keys = {name: parse_id(params[name], name) for name in ('after', 'before', 'at') if name in params}
+                rows, has_more = service.page(parts[0], limit, **keys)
+                return 200, {'columns': VIEWS[parts[0]]['headers'], 'rows': rows, 'has_more': has_more}
+            return 404, {'error': "Not found"}
+
+        self.respond(route)
+
+    def do_POST(self):
+        from urllib.parse import urlsplit
+        parts = [part for part in urlsplit(self.path).path.split('/') if part]
+        service = self.server.service
+
+        def route():
+            body = self.read_json()
+            if parts == ['customers']:
+                return 201, {'customer_id': service.add_customer(body)}
+            if parts == ['hats']:
+                return 201, {'hat_id': service.add_hat(body)}
+            if parts == ['orders']:
+                if 'lines' in body:
+                    order_id, total_price, tax = service.place_cart(
+                        body.get('customer_id'), body['lines'], body.get('date'),
+                        body.get('payment_method') or PAYMENT_METHOD)
+                else:
+                    order_id, total_price, tax = service.place_order(
+                        body.get('customer_id'), body.get('hat_id'), body.get('quantity'), body.get('date'),
+                        body.get('payment_method') or PAYMENT_METHOD)
+                # The bill is charged in the background; GET /bills shows the outcome
+                return 201, {'order_id': order_id, 'total_price': total_price, 'tax': tax, 'payment_status': 'Pending'}
+            if parts == ['orders', 'bulk']:
+                orders = body.get('orders')
+                if not isinstance(orders, list) or not all(isinstance(order, dict) for order in orders):
+                    raise ValueError("Expected a list of order objects under 'orders'.")
+                placed, rejected = service.place_orders(orders, body.get('payment_method') or PAYMENT_METHOD)
+                return 200, {
+                    'placed': [{'index': index, 'order_id': order_id} for index, order_id in placed],
+                    'rejected': [{'index': index, 'reason': reason} for index, reason in rejected],
+                }
+            if parts == ['deliveries', 'status']:
+                return 200, {'updated': service.set_delivery_status(body.get('delivery_ids'), body.get('status'))}
+            if parts == ['deliveries', 'reschedule']:
+                return 200, {'moved': service.reschedule_deliveries(
+                    body.get('days'), body.get('start'), body.get('end'), body.get('region'), body.get('hat_id'),
+                    body.get('business_days', False))}
+            return 404, {'error': "Not found"}
+
+        self.respond(route)
+
+    def read_json(self):
+        try:
+            length = int(self.headers.get('Content-Length') or 0)
+        except ValueError:
+            length = -1
+        if length < 0 or length > SERVICE_MAX_REQUEST_BYTES:
+            # The body is left unread (a negative length would wait for the client to
+            # close the connection), so the connection cannot carry another request
+            self.close_connection = True
+            raise ValueError("Request body is too large." if length > 0 else
+                             "Content-Length must be a non-negative integer.")
+        body = json.loads(self.rfile.read(length) or b"{}")
+        if not isinstance(body, dict):
+            raise ValueError("Expected a JSON object.")
+        return body
+
+    # Run `route` and send its (status, payload) back; errors become JSON error replies
+    def respond(self, route):
+        try:
+            status, payload = route()
+        except ValueError as e:
+            status, payload = 400, {'error': str(e)}
+        except OrderError as e:
+            status, payload = 409, {'error': str(e)}
+        except DatabaseError as e:
+            status, payload = 503, {'error': str(e)}
+        except TimeoutError:
+            self.close_connection = True
+            status, payload = 408, {'error': "Timed out reading the request."}
         except Exception as e:
-            messagebox.showerror("Database Error", f"An error occurred: {e}")
+            self.log_error("%s failed: %r", self.path, e)
+            status, payload = 500, {'error': "Internal server error"}
 
-    def on_closing(self):
-        if self.db_manager:
-            self.db_manager.close()
-        self.master.destroy()
+        if isinstance(payload, str):
+            body, content_type = payload.encode(), "text/plain; version=0.0.4"
+        else:
+            body, content_type = json.dumps(payload, default=str).encode(), "application/json"
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    # Only failed requests are logged; the statement statistics cover the rest
+    def log_request(self, code='-', size='-'):
+        if isinstance(code, int) and code >= 400:
+            super().log_request(code, size)
+
+
+# http.server is only needed in service mode and is slow to import, so it is
+# imported here rather than at startup
+def make_service_server(address, service):
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    handler = type("ServiceHandler", (ServiceRequestHandler, BaseHTTPRequestHandler), {})
+    server = ThreadingHTTPServer(address, handler)
+    server.daemon_threads = True
+    server.service = service
+    return server
+
+
+# Render rows as a fixed-width text table. Every cell is converted to text once and
+# the whole block is returned as a single string so the widget is updated in one insert.
+def format_table(headers, records):
+    cells = [list(map(str, record)) for record in records]
+    col_widths = [len(h) for h in headers]
+    for i, column in enumerate(zip(*cells)):
+        col_widths[i] = max(col_widths[i], max(map(len, column)))
+
+    header_string = "".join(h.ljust(col_widths[i] + 2) for i, h in enumerate(headers))
+    lines = [header_string, "-" * len(header_string)]
+    widths = [w + 2 for w in col_widths]
+    for row in cells:
+        lines.append("".join([field.ljust(width) for field, width in zip(row, widths)]))
+    lines.append("")
+    return "\n".join(lines)
+
+
+# Write the row chunks of an export to `path` as CSV, JSON Lines (both optionally
+# gzipped) or Parquet, one chunk at a time. The file appears under its name only once
+# it is complete. Returns (rows written, key of the last row).
+def write_export(chunks, columns, path, fmt, compress=False):
+    partial_path = path + ".part"
+    rows, last_key = 0, None
+    try:
+        if fmt == "parquet":
+            writer = ParquetExportWriter(partial_path, columns, compress)
+        else:
+            writer = TextExportWriter(partial_path, columns, fmt, compress)
+        with writer:
+            for chunk in chunks:
+                writer.write(chunk)
+                rows += len(chunk)
+                last_key = chunk[-1][0]
+        os.replace(partial_path, path)
+    except BaseException:
+        if os.path.exists(partial_path):
+            os.remove(partial_path)
+        raise
+    return rows, last_key
+
+
+class TextExportWriter:
+    def __init__(self, path, columns, fmt, compress):
+        self.columns = columns
+        self.fmt = fmt
+        if compress:
+            import gzip
+            self.file = gzip.open(path, "wt", encoding="utf-8", newline="", compresslevel=EXPORT_GZIP_LEVEL)
+        else:
+            self.file = open(path, "w", encoding="utf-8", newline="")
+        if fmt == "csv":
+            import csv
+            self.csv_writer = csv.writer(self.file)
+            self.csv_writer.writerow(columns)
+
+    def write(self, chunk):
+        if self.fmt == "csv":
+            self.csv_writer.writerows(chunk)
+        else:
+            self.file.write("".join(json.dumps(dict(zip(self.columns, row)), default=str) + "\n" for row in chunk))
 
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.file.close()
+
+
+class ParquetExportWriter:
+    # Each chunk becomes a row group. The column types are taken from the first chunk;
+    # money is stored as DECIMAL(18,2) and columns that start out empty as text.
+    def __init__(self, path, columns, compress):
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise ValueError("Parquet export needs pyarrow: pip install pyarrow")
+        self.pa = pyarrow
+        self.parquet = pyarrow.parquet
+        self.path = path
+        self.columns = columns
+        self.compression = "zstd" if compress else "snappy"
+        self.schema = None
+        self.writer = None
+
+    def write(self, chunk):
+        pa = self.pa
+        arrays = []
+        for values in zip(*chunk):
+            if any(isinstance(value, Decimal) for value in values):
+                values = [None if value is None else money(value) for value in values]
+                arrays.append(pa.array(values, pa.decimal128(18, 2)))
+            else:
+                arrays.append(pa.array(values))
+        table = pa.Table.from_arrays(arrays, names=self.columns)
+        if self.writer is None:
+            self.schema = pa.schema([
+                pa.field(field.name, pa.string()) if pa.types.is_null(field.type) else field
+                for field in table.schema])
+            self.writer = self.parquet.ParquetWriter(self.path, self.schema, compression=self.compression)
+        self.writer.write_table(table.cast(self.schema))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.writer is None:
+            # No rows: still write a valid file with the columns, typed as text
+            self.schema = self.pa.schema([self.pa.field(name, self.pa.string()) for name in self.columns])
+            self.writer = self.parquet.ParquetWriter(self.path, self.schema, compression=self.compression)
+        self.writer.close()
+
+
+def load_export_state(path):
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def save_export_state(path, state):
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(state, f, indent=2)
+    os.replace(path + ".tmp", path)
+
+
+# Stream records from a CSV file (with a header row) or a JSON Lines file
+def read_records(path):
+    import csv
+    with open(path, newline='', encoding='utf-8') as f:
+        if path.endswith(('.jsonl', '.ndjson')):
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+        else:
+            yield from csv.DictReader(f)
+
+
+def add_connection_arguments(parser):
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--user", default="root")
+    parser.add_argument("--password", help="defaults to $HATHIVE_PASSWORD or a prompt")
+    parser.add_argument("--database", default="HatHive")
+    parser.add_argument("--sqlite", metavar="PATH", help="use an embedded SQLite database file instead of MySQL")
+    parser.add_argument("--pool-size", type=int, default=POOL_SIZE, help="database connections to keep open at most")
+    parser.add_argument("--slow-query-log", metavar="PATH", default=SLOW_QUERY_LOG)
+    parser.add_argument("--slow-query-ms", type=float, default=SLOW_QUERY_MS)
+    parser.add_argument("--stats", metavar="PATH",
+                        help="write statement statistics here when done (Prometheus text for .prom, else JSON)")
+
+
+def connect_from_arguments(args):
+    if args.sqlite:
+        backend = SQLiteBackend(args.sqlite)
+    else:
+        password = args.password
+        if password is None:
+            password = os.environ.get("HATHIVE_PASSWORD")
+        if password is None:
+            import getpass
+            password = getpass.getpass("MySQL password: ")
+        backend = MySQLBackend(args.host, args.user, password, args.database)
+    db_manager = DatabaseManager(backend, args.pool_size, args.slow_query_ms, args.slow_query_log)
+    db_manager.connect()
+    db_manager.migrate()
+    return db_manager
+
+
+def write_stats(db_manager, path):
+    fmt = 'prometheus' if path.endswith('.prom') else 'json'
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(db_manager.export_stats(fmt))
+
+
+def import_orders_command(args):
+    db_manager = connect_from_arguments(args)
+    try:
+        payments = db_manager.start_payments(make_payment_gateway())
+        started = time.perf_counter()
+        placed, rejected = db_manager.place_orders(read_records(args.path), chunk_size=args.chunk_size)
+        elapsed = time.perf_counter() - started
+        payments.drain()
+        if args.stats:
+            write_stats(db_manager, args.stats)
+    finally:
+        db_manager.close()
+
+    for index, reason in rejected:
+        print(f"Rejected order {index + 1}: {reason}", file=sys.stderr)
+    rate = len(placed) / elapsed if elapsed else 0
+    print(f"Placed {len(placed)} orders, rejected {len(rejected)} in {elapsed:.2f}s ({rate:.0f} orders/s)")
+    print(f"Payments: {payments.paid} paid, {payments.declined} declined, {payments.failed} left pending")
+    return 1 if rejected else 0
+
+
+def import_rows_command(args):
+    db_manager = connect_from_arguments(args)
+    try:
+        started = time.perf_counter()
+        loaded, rejected = db_manager.import_rows(args.table, read_records(args.path), chunk_size=args.chunk_size)
+        elapsed = time.perf_counter() - started
+        if args.stats:
+            write_stats(db_manager, args.stats)
+    finally:
+        db_manager.close()
+
+    for index, reason in rejected:
+        print(f"Rejected row {index + 1}: {reason}", file=sys.stderr)
+    rate = loaded / elapsed if elapsed else 0
+    print(f"Loaded {loaded} {args.table}, rejected {len(rejected)} in {elapsed:.2f}s ({rate:.0f} rows/s)")
+    return 1 if rejected else 0
+
+
+def rebuild_summaries_command(args):
+    db_manager = connect_from_arguments(args)
+    try:
+        started = time.perf_counter()
+        db_manager.rebuild_sales_summary()
+        print(f"Rebuilt the sales summaries in {time.perf_counter() - started:.2f}s")
+    finally:
+        db_manager.close()
+    return 0
+
+
+# The format follows the file name unless given: .csv, .jsonl or .parquet, with .gz
+# on the text formats for gzip
+def export_format(path):
+    name = path.lower()
+    compress = name.endswith(".gz")
+    if compress:
+        name = name[:-3]
+    for fmt in EXPORT_FORMATS:
+        if name.endswith("." + fmt):
+            return fmt, compress
+    return "csv", compress
+
+
+def export_command(args):
+    fmt, compress = export_format(args.path)
+    fmt = args.format or fmt
+    compress = args.gzip or compress
+    db_manager = connect_from_arguments(args)
+    try:
+        started = time.perf_counter()
+        rows, last_key = HatHiveService(db_manager).export(
+            args.name, args.path, fmt, compress, args.start, args.end, args.since_id, args.since_last, args.state)
+        elapsed = time.perf_counter() - started
+        if args.stats:
+            write_stats(db_manager, args.stats)
+    finally:
+        db_manager.close()
+
+    rate = rows / elapsed if elapsed else 0
+    last = f", last ID {last_key}" if last_key is not None else ""
+    print(f"Exported {rows} {args.name} rows to {args.path} in {elapsed:.2f}s ({rate:.0f} rows/s{last})")
+    return 0
+
+
+def archive_command(args):
+    before = args.before or (date.today() - timedelta(days=args.older_than)).isoformat()
+    db_manager = connect_from_arguments(args)
+    try:
+        started = time.perf_counter()
+        archived = HatHiveService(db_manager).archive_orders(
+            before, args.batch_size, lambda total: print(f"  {total} orders archived", file=sys.stderr))
+        elapsed = time.perf_counter() - started
+        if args.stats:
+            write_stats(db_manager, args.stats)
+    finally:
+        db_manager.close()
+    print(f"Archived {archived} orders dated before {before} in {elapsed:.2f}s")
+    return 0
+
+
+def analytics_command(args):
+    for name in args.analyses:
+        if name not in ANALYTICS:
+            raise ValueError(f"Unknown analysis: {name} (choose from {', '.join(ANALYTICS)})")
+    db_manager = connect_from_arguments(args)
+    try:
+        started = time.perf_counter()
+        report, counters = HatHiveService(db_manager).analytics(args.parallel)
+        elapsed = time.perf_counter() - started
+        if args.stats:
+            write_stats(db_manager, args.stats)
+    finally:
+        db_manager.close()
+    for name in args.analyses or ANALYTICS:
+        print(f"{ANALYTICS[name]['label']}\n")
+        print(format_table(ANALYTICS[name]['headers'], report[name]) if report[name] else "No data.\n")
+    print(f"Read {counters['analytics_rows_read']} rows and computed the analytics in {elapsed:.2f}s",
+          file=sys.stderr)
+    return 0
+
+
+def deliveries_command(args):
+    db_manager = connect_from_arguments(args)
+    try:
+        rows = HatHiveService(db_manager).due_deliveries(args.queue, args.region, args.limit)
+        if args.stats:
+            write_stats(db_manager, args.stats)
+    finally:
+        db_manager.close()
+    print(format_table(DELIVERY_QUEUE_HEADERS, rows) if rows else "Nothing to deliver.")
+    return 0
+
+
+def reschedule_deliveries_command(args):
+    db_manager = connect_from_arguments(args)
+    try:
+        moved = HatHiveService(db_manager).reschedule_deliveries(
+            args.days, args.start, args.end, args.region, args.hat_id, args.business_days)
+        if args.stats:
+            write_stats(db_manager, args.stats)
+    finally:
+        db_manager.close()
+    print(f"Moved {moved} deliveries")
+    return 0
+
+
+# Place the orders waiting in a station's journal, e.g. one copied from a till
+# that cannot reach the database itself
+def replay_journal_command(args):
+    journal = OrderJournal(args.journal)
+    waiting = journal.backlog()
+    db_manager = connect_from_arguments(args)
+    try:
+        payments = db_manager.start_payments(make_payment_gateway())
+        journal.db_manager = db_manager
+        journal.drain()
+        payments.drain()
+        if args.stats:
+            write_stats(db_manager, args.stats)
+    finally:
+        journal.close()
+        db_manager.close()
+    print(f"Placed {journal.applied} of {waiting} journaled orders, rejected {len(journal.rejected)}")
+    return 1 if journal.rejected else 0
+
+
+def serve_command(args):
+    db_manager = connect_from_arguments(args)
+    db_manager.start_payments(make_payment_gateway())
+    server = make_service_server((args.bind, args.port), HatHiveService(db_manager))
+    print(f"Serving the HatHive API on http://{args.bind}:{server.server_port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if args.stats:
+            write_stats(db_manager, args.stats)
+        db_manager.close()
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="HatHive: Hat Sales Management System")
+    commands = parser.add_subparsers(dest="command")
+
+    import_orders = commands.add_parser("import-orders", help="place a batch of orders from a CSV or JSONL file")
+    import_orders.add_argument("path")
+    import_orders.add_argument("--chunk-size", type=int, default=ORDER_CHUNK_SIZE)
+    import_orders.set_defaults(func=import_orders_command)
+    add_connection_arguments(import_orders)
+
+    for table in IMPORTS:
+        import_table = commands.add_parser(f"import-{table}", help=f"load {table} from a CSV or JSONL file")
+        import_table.add_argument("path")
+        import_table.add_argument("--chunk-size", type=int, default=IMPORT_CHUNK_SIZE)
+        import_table.set_defaults(table=table, func=import_rows_command)
+        add_connection_arguments(import_table)
+
+    serve = commands.add_parser("serve", help="run the HTTP/JSON API without the GUI")
+    serve.add_argument("--bind", default=SERVICE_ADDRESS[0], help="address to listen on")
+    serve.add_argument("--port", type=int, default=SERVICE_ADDRESS[1])
+    serve.set_defaults(func=serve_command)
+    add_connection_arguments(serve)
+
+    rebuild_summaries = commands.add_parser(
+        "rebuild-summaries", help="recompute the sales summary tables from the order history")
+    rebuild_summaries.set_defaults(func=rebuild_summaries_command)
+    add_connection_arguments(rebuild_summaries)
+
+    export = commands.add_parser("export", help="stream orders, bills or deliveries to a CSV, JSONL or Parquet file")
+    export.add_argument("name", choices=list(EXPORTS))
+    export.add_argument("path")
+    export.add_argument("--format", choices=EXPORT_FORMATS, help="defaults to the file extension")
+    export.add_argument("--gzip", action="store_true", help="gzip a CSV or JSONL export (also set by a .gz path)")
+    export.add_argument("--start", metavar="YYYY-MM-DD", help="only rows dated on or after this day")
+    export.add_argument("--end", metavar="YYYY-MM-DD", help="only rows dated on or before this day")
+    export.add_argument("--since-id", type=int, help="only rows with a higher ID")
+    export.add_argument("--since-last", action="store_true",
+                        help="only rows added since the last --since-last export of the same data")
+    export.add_argument("--state", metavar="PATH", default=EXPORT_STATE_FILE,
+                        help="where --since-last keeps the last exported IDs")
+    export.set_defaults(func=export_command)
+    add_connection_arguments(export)
+
+    archive = commands.add_parser(
+        "archive", help="move old closed orders, with their bills and deliveries, to the archive tables")
+    cutoff = archive.add_mutually_exclusive_group()
+    cutoff.add_argument("--before", metavar="YYYY-MM-DD", help="archive orders dated before this day")
+    cutoff.add_argument("--older-than", type=int, default=ARCHIVE_AFTER_DAYS, metavar="DAYS",
+                        help=f"archive orders older than this many days (default {ARCHIVE_AFTER_DAYS})")
+    archive.add_argument("--batch-size", type=int, default=ARCHIVE_BATCH_SIZE, help="orders moved per transaction")
+    archive.set_defaults(func=archive_command)
+    add_connection_arguments(archive)
+
+    analytics = commands.add_parser("analytics", help="sell-through, stock-out forecast and customer cohorts")
+    analytics.add_argument("analyses", nargs="*", metavar="ANALYSIS",
+                           help=f"any of {', '.join(ANALYTICS)} (default: all)")
+    analytics.add_argument("--parallel", action=argparse.BooleanOptionalAction, default=None,
+                           help=f"run the analyses in worker processes (default: from {ANALYTICS_PARALLEL_LINES} lines)")
+    analytics.set_defaults(func=analytics_command)
+    add_connection_arguments(analytics)
+
+    deliveries = commands.add_parser("deliveries", help="list the open deliveries due today, overdue or this week")
+    deliveries.add_argument("queue", choices=list(DELIVERY_QUEUES))
+    deliveries.add_argument("--region", help="only deliveries to this region (the town of the address)")
+    deliveries.add_argument("--limit", type=int, default=DELIVERY_QUEUE_LIMIT)
+    deliveries.set_defaults(func=deliveries_command)
+    add_connection_arguments(deliveries)
+
+    reschedule = commands.add_parser(
+        "reschedule-deliveries", help="move the open deliveries due in a date range by a number of days")
+    reschedule.add_argument("--days", type=int, required=True, help="days to move them by (negative for earlier)")
+    reschedule.add_argument("--start", metavar="YYYY-MM-DD", required=True, help="first arrival date to move")
+    reschedule.add_argument("--end", metavar="YYYY-MM-DD", required=True, help="last arrival date to move")
+    reschedule.add_argument("--region", help="only deliveries to this region")
+    reschedule.add_argument("--hat-id", type=int, help="only orders containing this hat")
+    reschedule.add_argument("--business-days", action="store_true",
+                            help="count business days, skipping weekends and holidays")
+    reschedule.set_defaults(func=reschedule_deliveries_command)
+    add_connection_arguments(reschedule)
+
+    replay_journal = commands.add_parser("replay-journal", help="place the orders waiting in an order journal")
+    replay_journal.add_argument("--journal", metavar="PATH", default=JOURNAL_PATH,
+                                help=f"journal file (default {JOURNAL_PATH})")
+    replay_journal.set_defaults(func=replay_journal_command)
+    add_connection_arguments(replay_journal)
+
+    args = parser.parse_args(argv)
+    if args.command is not None:
+        # Bad input is reported like a bad argument; database failures without a traceback
+        try:
+            return args.func(args)
+        except ValueError as e:
+            parser.error(str(e))
+        except DatabaseError as e:
+            print(f"{parser.prog}: {e}", file=sys.stderr)
+            return 1
 
-def main():
-    root = tk.Tk()
-    app = HatHiveApp(root)
-    root.protocol("WM_DELETE_WINDOW", app.on_closing)
-    root.mainloop()
+    import hathive_gui
+    return hathive_gui.run()
 
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
@@ -0,0 +1,289 @@
+import argparse
+import contextlib
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import date, timedelta
+
+import HatHive
+from HatHive import DatabaseManager, MySQLBackend, SQLiteBackend, VIEWS, format_table
+
+STYLES = ["Fedora", "Baseball Cap", "Beanie", "Bucket", "Panama", "Trilby", "Beret", "Cowboy"]
+BRANDS = ["Stetson", "Kangol", "Brixton", "New Era", "Bailey", "Goorin", "Akubra", "Borsalino"]
+STREETS = ["Main St", "Oak Ave", "Pine Rd", "Maple Dr", "Cedar Ln", "Elm St"]
+CITIES = ["Springfield", "Riverside", "Fairview", "Greenville", "Madison", "Georgetown"]
+
+
+# Synthetic data, reproducible for a given seed
+def generate_customers(rng, count):
+    for i in range(count):
+        yield {
+            "name": f"Customer {i}",
+            "DOB": (date(1950, 1, 1) + timedelta(days=rng.randrange(20000))).isoformat(),
+            "email": f"customer{i}@example.com",
+            "contact_info": f"555-{rng.randrange(10 ** 7):07d}",
+            "address": f"{rng.randrange(1, 9999)} {rng.choice(STREETS)}, {rng.choice(CITIES)}",
+        }
+
+
+def generate_hats(rng, count, stock):
+    for _ in range(count):
+        brand = rng.randrange(len(BRANDS))
+        yield {
+            "brand_id": brand + 1,
+            "brand_name": BRANDS[brand],
+            "style": rng.choice(STYLES),
+            "size": rng.randrange(5, 9),
+            "quantity": stock,
+            "price": f"{rng.randrange(999, 19999) / 100:.2f}",
+        }
+
+
+def generate_orders(rng, count, customers, hats, start=date(2020, 1, 1), days=1460):
+    for _ in range(count):
+        yield {
+            "customer_id": rng.randrange(1, customers + 1),
+            "hat_id": rng.randrange(1, hats + 1),
+            "date": (start + timedelta(days=rng.randrange(days))).isoformat(),
+            "quantity": rng.randrange(1, 4),
+        }
+
+
+def summarize(samples):
+    samples = sorted(samples)
+    if not samples:
+        return {"count": 0}
+
+    def percentile(p):
+        return samples[min(len(samples) - 1, int(p * len(samples)))] * 1000
+
+    return {
+        "count": len(samples),
+        "mean_ms": statistics.fmean(samples) * 1000,
+        "p50_ms": percentile(0.50),
+        "p95_ms": percentile(0.95),
+        "p99_ms": percentile(0.99),
+        "max_ms": samples[-1] * 1000,
+    }
+
+
+def timed(fn, *args, **kwargs):
+    started = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return time.perf_counter() - started, result
+
+
+class Benchmark:
+    # `pool_size`, `slow_query_ms` and `slow_query_log` configure the DatabaseManager as
+    # in HatHive; `stats_path` receives its statement statistics at the end
+    def __init__(self, make_backend, scale, clerks, orders_per_clerk, samples, seed, pool_size=HatHive.POOL_SIZE,
+                 slow_query_ms=HatHive.SLOW_QUERY_MS, slow_query_log=None, stats_path=None):
+        self.make_backend = make_backend
+        self.pool_size = pool_size
+        self.slow_query_ms = slow_query_ms
+        self.slow_query_log = slow_query_log
+        self.stats_path = stats_path
+        self.scale = scale
+        self.clerks = clerks
+        self.orders_per_clerk = orders_per_clerk
+        self.samples = samples
+        self.rng = random.Random(seed)
+        self.customers = max(10, scale // 10)
+        self.hats = max(20, scale // 100)
+        self.results = {}
+
+    def database_manager(self):
+        return DatabaseManager(self.make_backend(), self.pool_size, self.slow_query_ms, self.slow_query_log)
+
+    def run(self):
+        self.bench_startup()
+        db_manager = self.database_manager()
+        db_manager.connect()
+        db_manager.migrate()
+        try:
+            db_manager.clear_all_data()
+            self.bench_bulk_load(db_manager)
+            self.bench_place_order(db_manager)
+            self.bench_views(db_manager)
+            self.bench_concurrent_clerks(db_manager)
+            self.results["counters"] = db_manager.counters()
+            self.results["statements"] = db_manager.stats.snapshot()
+            if self.stats_path:
+                HatHive.write_stats(db_manager, self.stats_path)
+        finally:
+            db_manager.close()
+        return self.results
+
+    # Importing the app (in a fresh interpreter, minus the interpreter's own startup),
+    # then connecting and migrating: first against an empty schema, then when up to date
+    def bench_startup(self):
+        def run_python(code):
+            started = time.perf_counter()
+            subprocess.run([sys.executable, "-c", code], check=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+            return time.perf_counter() - started
+
+        timings = {"import_ms": (run_python("import HatHive") - run_python("pass")) * 1000}
+        for phase in ("cold", "warm"):
+            db_manager = self.database_manager()
+            connect_time, _ = timed(db_manager.connect)
+            migrate_time, _ = timed(db_manager.migrate)
+            db_manager.close()
+            timings[phase] = {"connect_ms": connect_time * 1000, "migrate_ms": migrate_time * 1000}
+        self.results["startup"] = timings
+
+    def bench_bulk_load(self, db_manager):
+        stock = self.scale * 3 // self.hats + 1000
+        results = {}
+        for table, rows in (
+                ("customers", generate_customers(self.rng, self.customers)),
+                ("hats", generate_hats(self.rng, self.hats, stock))):
+            elapsed, (loaded, rejected) = timed(db_manager.import_rows, table, rows)
+            results[f"import_{table}"] = {
+                "rows": loaded, "rejected": len(rejected), "seconds": elapsed, "rows_per_s": loaded / elapsed}
+
+        orders = generate_orders(self.rng, self.scale, self.customers, self.hats)
+        elapsed, (placed, rejected) = timed(db_manager.place_orders, orders)
+        results["place_orders"] = {
+            "rows": len(placed), "rejected": len(rejected), "seconds": elapsed, "rows_per_s": len(placed) / elapsed}
+        self.results["bulk_load"] = results
+
+    # Single-order latency through the same path as the order dialog
+    def bench_place_order(self, db_manager):
+        latencies = []
+        for order in generate_orders(self.rng, self.samples, self.customers, self.hats):
+            elapsed, _ = timed(
+                db_manager.place_order, order["customer_id"], order["hat_id"], order["date"], order["quantity"])
+            latencies.append(elapsed)
+        self.results["place_order"] = summarize(latencies)
+
+    # Fetch + render of the first page, a page in the middle and the last page of each view
+    def bench_views(self, db_manager):
+        results = {}
+        for name, view in VIEWS.items():
+            fetch_times, render_times = [], []
+            table, _, column = view['key'].rpartition('.')
+            max_key = db_manager.fetch(f"SELECT MAX({column}) FROM {table or name}")[0][0] or 0
+            for position in ({}, {"at": max_key // 2}, {"before": max_key + 1}):
+                for _ in range(max(1, self.samples // 10)):
+                    elapsed, (rows, _) = timed(
+                        db_manager.fetch_page, view['query'], view['key'], HatHive.PAGE_SIZE, **position)
+                    fetch_times.append(elapsed)
+                    elapsed, _ = timed(format_table, view['headers'], rows)
+                    render_times.append(elapsed)
+            results[name] = {"fetch": summarize(fetch_times), "render": summarize(render_times)}
+        self.results["views"] = results
+
+    # N clerks placing orders at the same time on the shared pool
+    def bench_concurrent_clerks(self, db_manager):
+        latencies, failures = [], []
+        lock = threading.Lock()
+        orders = [list(generate_orders(self.rng, self.orders_per_clerk, self.customers, self.hats))
+                  for _ in range(self.clerks)]
+
+        def clerk(batch):
+            mine, errors = [], []
+            for order in batch:
+                try:
+                    elapsed, _ = timed(
+                        db_manager.place_order, order["customer_id"], order["hat_id"], order["date"], order["quantity"])
+                    mine.append(elapsed)
+                except Exception as e:
+                    errors.append(str(e))
+            with lock:
+                latencies.extend(mine)
+                failures.extend(errors)
+
+        threads = [threading.Thread(target=clerk, args=(batch,)) for batch in orders]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        oversold = db_manager.fetch("SELECT COUNT(*) FROM hats WHERE quantity < 0")[0][0]
+        self.results["concurrent_clerks"] = {
+            "clerks": self.clerks,
+            "orders": len(latencies),
+            "failures": len(failures),
+            "seconds": elapsed,
+            "orders_per_s": len(latencies) / elapsed if elapsed else 0,
+            "latency": summarize(latencies),
+            "oversold_hats": oversold,
+        }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark HatHive's hot paths and write the results as JSON")
+    parser.add_argument("--scale", type=int, default=10000, help="number of orders to generate")
+    parser.add_argument("--clerks", type=int, default=8, help="concurrent clerks placing orders")
+    parser.add_argument("--orders-per-clerk", type=int, default=50)
+    parser.add_argument("--samples", type=int, default=200, help="single-order latency samples")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="write the JSON results here instead of stdout")
+    parser.add_argument("--mysql", action="store_true",
+                        help="benchmark a MySQL server (ALL DATA in --database is deleted)")
+    parser.add_argument("--force", action="store_true",
+                        help="benchmark an existing --sqlite file (ALL DATA in it is deleted)")
+    HatHive.add_connection_arguments(parser)
+    parser.set_defaults(database="HatHive_bench", slow_query_log=None)
+    args = parser.parse_args(argv)
+    in_use = not args.mysql and args.sqlite and os.path.exists(args.sqlite) and os.path.getsize(args.sqlite)
+    if in_use and not args.force:
+        parser.error(f"{args.sqlite} is not empty and the benchmark deletes all data in it; pass --force to go ahead")
+
+    scratch = None
+    if args.mysql:
+        password = args.password if args.password is not None else os.environ.get("HATHIVE_PASSWORD", "")
+        engine = "mysql"
+
+        def make_backend():
+            return MySQLBackend(args.host, args.user, password, args.database)
+    else:
+        path = args.sqlite
+        if path is None:
+            scratch = tempfile.mkdtemp(prefix="hathive-bench-")
+            path = os.path.join(scratch, "bench.db")
+        engine = "sqlite"
+
+        def make_backend():
+            return SQLiteBackend(path)
+
+    try:
+        benchmark = Benchmark(make_backend, args.scale, args.clerks, args.orders_per_clerk, args.samples, args.seed,
+                              args.pool_size, args.slow_query_ms, args.slow_query_log, args.stats)
+        # Keep HatHive's progress messages out of the JSON on stdout
+        with contextlib.redirect_stdout(sys.stderr):
+            results = benchmark.run()
+    finally:
+        if scratch:
+            shutil.rmtree(scratch, ignore_errors=True)
+
+    report = {
+        "engine": engine,
+        "scale": {"orders": args.scale, "customers": benchmark.customers, "hats": benchmark.hats},
+        "seed": args.seed,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "results": results,
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
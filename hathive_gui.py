@@ -0,0 +1,1225 @@
+# The HatHive desktop app. Tk is slow to import, so it lives in this module and
+# HatHive.main() only imports it when it opens the window; the headless commands and
+# the HTTP service never load it.
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+from functools import partial
+from tkinter import filedialog, messagebox, scrolledtext, ttk, Entry, Button, Label, LabelFrame, Frame
+import queue
+import time
+import tkinter as tk
+import uuid
+
+from HatHive import (
+    ANALYTICS, ARCHIVE_AFTER_DAYS, DELIVERY_DAYS, DELIVERY_QUEUES, DIAGNOSTICS_REFRESH_MS,
+    DatabaseError, DatabaseManager, EXPORTS, EXPORT_FORMATS, HatHiveService, JOURNAL_PATH,
+    JOURNAL_STATUS_MS, MySQLBackend, OrderError, OrderJournal, PAGE_SIZE, POOL_SIZE, REPORTS,
+    SEARCH_HEADERS, SQLITE_PATH, SQLiteBackend, TYPEAHEAD_DELAY_MS, TYPEAHEAD_LIMIT, VIEWS,
+    VIEW_REFRESH_MS, format_table, make_payment_gateway, validate_date,
+)
+
+
+class BackgroundJob:
+    def __init__(self, future, on_success, on_error, cancellable):
+        self.future = future
+        self.on_success = on_success
+        self.on_error = on_error
+        self.cancellable = cancellable
+        self.cancelled = False
+
+    def cancel(self):
+        # Jobs that have not started yet are always dropped. Running jobs can only be
+        # abandoned when they are cancellable (reads); writes are left to finish so the
+        # user still learns their outcome.
+        if self.future.cancel() or self.cancellable:
+            self.cancelled = True
+        return self.cancelled
+
+
+class BackgroundExecutor:
+    # Runs database work on worker threads and hands the results back to the Tk thread.
+    # Tk is not thread-safe, so workers only push finished jobs onto a queue that the
+    # main loop drains with master.after.
+    def __init__(self, master, workers=POOL_SIZE, poll_interval=50, on_busy_change=None):
+        self.master = master
+        self.poll_interval = poll_interval
+        self.on_busy_change = on_busy_change
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="hathive-db")
+        self._done = queue.Queue()
+        self._pending = set()
+        self._poll_id = self.master.after(self.poll_interval, self._poll)
+
+    def submit(self, work, on_success=None, on_error=None, cancellable=True):
+        future = self._pool.submit(work)
+        job = BackgroundJob(future, on_success, on_error, cancellable)
+        self._pending.add(job)
+        future.add_done_callback(lambda _: self._done.put(job))
+        self._notify_busy()
+        return job
+
+    def cancel_all(self):
+        for job in list(self._pending):
+            if job.cancel():
+                self._pending.discard(job)
+        self._notify_busy()
+
+    @property
+    def busy(self):
+        return len(self._pending)
+
+    def _poll(self):
+        while True:
+            try:
+                job = self._done.get_nowait()
+            except queue.Empty:
+                break
+            self._pending.discard(job)
+            if not job.cancelled:
+                self._dispatch(job)
+            self._notify_busy()
+        self._poll_id = self.master.after(self.poll_interval, self._poll)
+
+    @staticmethod
+    def _dispatch(job):
+        try:
+            result = job.future.result()
+        except Exception as e:
+            if job.on_error:
+                job.on_error(e)
+            return
+        try:
+            if job.on_success:
+                job.on_success(result)
+        except Exception as e:
+            if job.on_error:
+                job.on_error(e)
+
+    def _notify_busy(self):
+        if self.on_busy_change:
+            self.on_busy_change(self.busy)
+
+    def shutdown(self):
+        self.master.after_cancel(self._poll_id)
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+
+class TypeAhead:
+    # Suggestions listed while typing into entries that take an ID. Typing anything
+    # other than a number looks up matches once typing pauses for TYPEAHEAD_DELAY_MS;
+    # each keystroke restarts the wait and drops the lookup still in flight. Picking
+    # a suggestion puts its ID (the first column) into the entry. Several entries can
+    # share one listbox.
+    def __init__(self, app, listbox):
+        self.app = app
+        self.listbox = listbox
+        self.entry = None  # entry the listed suggestions belong to
+        self.rows = []
+        self.on_pick = None
+        self._after_id = None
+        self._job = None
+        listbox.bind("<<ListboxSelect>>", self.pick)
+
+    # `lookup` runs in the background with the typed text and returns rows; `describe`
+    # turns a row into its suggestion text and `on_pick` is called with a picked row
+    def attach(self, entry, lookup, describe, on_pick=None):
+        entry.bind("<KeyRelease>", lambda event: self.schedule(event, entry, lookup, describe, on_pick), add="+")
+
+    def schedule(self, event, entry, lookup, describe, on_pick):
+        if event.keysym in ("Tab", "Return", "Escape"):
+            return
+        if self._after_id:
+            self.listbox.after_cancel(self._after_id)
+        self._after_id = self.listbox.after(
+            TYPEAHEAD_DELAY_MS, lambda: self.search(entry, lookup, describe, on_pick))
+
+    def search(self, entry, lookup, describe, on_pick):
+        self._after_id = None
+        if self._job:
+            self._job.cancel()
+            self._job = None
+        text = entry.get().strip()
+        if not text or text.isdigit() or not self.app.service:
+            return
+
+        def show(rows):
+            self._job = None
+            if not self.listbox.winfo_exists():
+                return
+            self.entry, self.rows, self.on_pick = entry, rows, on_pick
+            self.listbox.delete(0, tk.END)
+            self.listbox.insert(tk.END, *[describe(row) for row in rows] or ["No matches"])
+
+        self._job = self.app.run_in_background(lambda: lookup(text), show)
+
+    def pick(self, _):
+        selection = self.listbox.curselection()
+        if not selection or self.entry is None or selection[0] >= len(self.rows):
+            return
+        row = self.rows[selection[0]]
+        self.entry.delete(0, tk.END)
+        self.entry.insert(0, str(row[0]))
+        if self.on_pick:
+            self.on_pick(row)
+
+
+class HatHiveApp:
+    def __init__(self, master):
+        self.master = master
+        self.master.title("HatHive: Hat Sales Management System")
+        self.db_manager = None
+        self.service = None
+        self.current_view = None
+        self.page_keys = None  # (first key, last key) of the page on screen
+        self.page_rows = []  # rows of the page on screen, their versions by key, and
+        self.page_versions = {}  # whether it is the last page of the view
+        self.page_at_end = False
+        self.refreshing = None  # background job of the refresh in flight
+        self.diagnostics_window = None
+        # Orders are journaled locally when they cannot be placed at once, so they can
+        # be taken before connecting and while the database is down
+        try:
+            self.journal = OrderJournal(JOURNAL_PATH)
+        except (OSError, ValueError) as e:
+            print(f"Order journal unavailable, orders go straight to the database: {e}")
+            self.journal = None
+        self.journal_seen = (0, 0)  # applied and rejected counts already shown
+        self.setup_gui()
+        self.executor = BackgroundExecutor(self.master, on_busy_change=self.update_busy_indicator)
+        self.update_journal_status()
+
+    def setup_gui(self):
+        self.master.geometry('1024x768')
+
+        # Left panel for inputs and actions
+        input_frame = LabelFrame(self.master, text="Database Connection", padx=5, pady=5)
+        input_frame.pack(side="left", padx=10, pady=10, fill="both")
+
+        Label(input_frame, text="Engine:").grid(row=0, column=0, sticky="w")
+        self.engine_choice = ttk.Combobox(input_frame, values=["MySQL", "SQLite"], state="readonly")
+        self.engine_choice.current(0)
+        self.engine_choice.grid(row=0, column=1, sticky="ew")
+
+        Label(input_frame, text="Host:").grid(row=1, column=0, sticky="w")
+        self.host_entry = Entry(input_frame)
+        self.host_entry.grid(row=1, column=1, sticky="ew")
+
+        Label(input_frame, text="User:").grid(row=2, column=0, sticky="w")
+        self.user_entry = Entry(input_frame)
+        self.user_entry.grid(row=2, column=1, sticky="ew")
+
+        Label(input_frame, text="Password:").grid(row=3, column=0, sticky="w")
+        self.password_entry = Entry(input_frame, show="*")
+        self.password_entry.grid(row=3, column=1, sticky="ew")
+
+        Label(input_frame, text="SQLite file:").grid(row=4, column=0, sticky="w")
+        self.sqlite_entry = Entry(input_frame)
+        self.sqlite_entry.insert(0, SQLITE_PATH)
+        self.sqlite_entry.grid(row=4, column=1, sticky="ew")
+
+        connect_button = Button(input_frame, text="Connect", command=self.connect_to_database)
+        connect_button.grid(row=5, column=1, sticky="ew", pady=5)
+
+        # Right panel for displaying results
+        output_frame = Frame(self.master, padx=5, pady=5)
+        output_frame.pack(side="right", expand=True, fill="both")
+        self.query_result = scrolledtext.ScrolledText(output_frame, height=20)
+        self.query_result.pack(fill="both", expand=True)
+
+        # Page navigation for the table views
+        page_frame = Frame(output_frame, pady=5)
+        page_frame.pack(fill="x")
+        self.prev_button = Button(page_frame, text="< Prev", state="disabled", command=self.previous_page)
+        self.prev_button.pack(side="left")
+        self.next_button = Button(page_frame, text="Next >", state="disabled", command=self.next_page)
+        self.next_button.pack(side="left", padx=5)
+        self.page_label = Label(page_frame, text="")
+        self.page_label.pack(side="left", padx=5)
+        Button(page_frame, text="Go", command=self.jump_to_id).pack(side="right")
+        self.jump_entry = Entry(page_frame, width=8)
+        self.jump_entry.pack(side="right")
+        Label(page_frame, text="Jump to ID:").pack(side="right", padx=(10, 0))
+        self.page_size_entry = Entry(page_frame, width=6)
+        self.page_size_entry.insert(0, str(PAGE_SIZE))
+        self.page_size_entry.pack(side="right")
+        Label(page_frame, text="Page size:").pack(side="right")
+        self.auto_refresh = tk.BooleanVar()
+        ttk.Checkbutton(page_frame, text="Auto-refresh", variable=self.auto_refresh,
+                        command=self.schedule_view_refresh).pack(side="right", padx=5)
+        Button(page_frame, text="Refresh", command=self.refresh_view).pack(side="right")
+
+        # Status bar showing database work running in the background
+        status_frame = Frame(output_frame, pady=5)
+        status_frame.pack(fill="x")
+        self.status_label = Label(status_frame, text="Ready")
+        self.status_label.pack(side="left")
+        self.journal_label = Label(status_frame, text="")
+        self.journal_label.pack(side="left", padx=10)
+        self.cancel_button = Button(status_frame, text="Cancel", state="disabled", command=self.cancel_background_work)
+        self.cancel_button.pack(side="right")
+        self.busy_bar = ttk.Progressbar(status_frame, mode="indeterminate", length=150)
+        self.busy_bar.pack(side="right", padx=5)
+
+        # Customer related actions
+        customer_action_frame = Frame(input_frame, padx=5, pady=5)
+        customer_action_frame.grid(row=6, column=0, columnspan=2, sticky="ew")
+        Button(customer_action_frame, text="View Customers", command=self.view_customers).pack(side="left", padx=5)
+        Button(customer_action_frame, text="Add Customer", command=self.add_customer).pack(side="left", padx=5)
+        Button(customer_action_frame, text="Search", command=self.show_search).pack(side="left", padx=5)
+
+        # Hat related actions
+        hat_action_frame = Frame(input_frame, padx=5, pady=5)
+        hat_action_frame.grid(row=7, column=0, columnspan=2, sticky="ew")
+        Button(hat_action_frame, text="View Hats", command=self.view_hats).pack(side="left", padx=5)
+        Button(hat_action_frame, text="Add Hat", command=self.add_hat).pack(side="left", padx=5)
+
+        # Order related actions
+        order_action_frame = Frame(input_frame, padx=5, pady=5)
+        order_action_frame.grid(row=8, column=0, columnspan=2, sticky="ew")
+        Button(order_action_frame, text="Place Order", command=self.add_order).pack(side="left", padx=5)
+        Button(order_action_frame, text="View Orders", command=self.view_orders).pack(side="left", padx=5)
+        Button(order_action_frame, text="View Order Lines", command=lambda: self.show_view('order_lines')).pack(
+            side="left", padx=5)
+
+        # Delivery related actions
+        delivery_action_frame = Frame(input_frame, padx=5, pady=5)
+        delivery_action_frame.grid(row=10, column=0, columnspan=2, sticky="ew")
+        Button(delivery_action_frame, text="View Deliveries", command=self.view_deliveries).pack(side="left", padx=5)
+        Button(delivery_action_frame, text="Dispatch", command=self.show_dispatch).pack(side="left", padx=5)
+        Button(delivery_action_frame, text="Delivery Rules", command=self.show_delivery_rules).pack(side="left", padx=5)
+
+        # Billing actions
+        billing_action_frame = Frame(input_frame, padx=5, pady=5)
+        billing_action_frame.grid(row=11, column=0, columnspan=2, sticky="ew")
+        Button(billing_action_frame, text="View Bills", command=self.view_bills).pack(side="left", padx=5)
+        Button(billing_action_frame, text="Sales Reports", command=self.show_reports).pack(side="left", padx=5)
+        Button(billing_action_frame, text="Export", command=self.show_export).pack(side="left", padx=5)
+        Button(billing_action_frame, text="Analytics", command=self.show_analytics).pack(side="left", padx=5)
+
+        # Application-wide actions
+        app_action_frame = Frame(input_frame, padx=5, pady=5)
+        app_action_frame.grid(row=9, column=0, columnspan=2, sticky="ew")
+        Button(app_action_frame, text="Clear All Data", command=self.clear_all_data).pack(side="left", padx=5)
+        Button(app_action_frame, text="Archive", command=self.show_archive).pack(side="left", padx=5)
+        Button(app_action_frame, text="Diagnostics", command=self.show_diagnostics).pack(side="left", padx=5)
+        Button(app_action_frame, text="Exit", command=self.on_closing).pack(side="left", padx=5)
+
+    def update_busy_indicator(self, pending):
+        if pending:
+            self.status_label.config(text=f"Working... ({pending} pending)")
+            self.cancel_button.config(state="normal")
+            self.busy_bar.start(10)
+        else:
+            self.status_label.config(text="Ready")
+            self.cancel_button.config(state="disabled")
+            self.busy_bar.stop()
+
+    def cancel_background_work(self):
+        self.executor.cancel_all()
+
+    # Show how many journaled orders are still waiting for the database, refresh the
+    # view once some have been placed and report the ones that were rejected
+    def update_journal_status(self):
+        if self.journal:
+            backlog = self.journal.backlog()
+            self.journal_label.config(text=f"Orders waiting to be sent: {backlog}" if backlog else "")
+            applied, rejected = self.journal.applied, len(self.journal.rejected)
+            seen_applied, seen_rejected = self.journal_seen
+            self.journal_seen = (applied, rejected)
+            if applied > seen_applied and self.current_view:
+                self.refresh_view()
+            if rejected > seen_rejected:
+                messagebox.showwarning("Orders Rejected", "\n".join(
+                    f"Customer {entry['customer_id']}, {entry['date']}: {reason}"
+                    for entry, reason in self.journal.rejected[seen_rejected:rejected])
+                    + f"\n\nThe orders are kept in {self.journal.rejected_path}.")
+        self.master.after(JOURNAL_STATUS_MS, self.update_journal_status)
+
+    # Run `work` on a worker thread and call `on_success` with its result on the Tk thread
+    def run_in_background(self, work, on_success=None, error_title="Database Error", cancellable=True):
+        def on_error(e):
+            if isinstance(e, (OrderError, ValueError)):
+                messagebox.showerror("Error", str(e))
+            else:
+                messagebox.showerror(error_title, f"An error occurred: {e}")
+        return self.executor.submit(work, on_success, on_error, cancellable)
+
+    def connect_to_database(self):
+        if self.engine_choice.get() == "SQLite":
+            make_backend = partial(SQLiteBackend, self.sqlite_entry.get() or SQLITE_PATH)
+        else:
+            host = self.host_entry.get()
+            user = self.user_entry.get()
+            password = self.password_entry.get()
+            make_backend = partial(MySQLBackend, host, user, password, 'HatHive')
+
+        # Everything runs off the Tk thread, including the slow import of the MySQL
+        # driver, so the window stays responsive while connecting
+        def connect():
+            db_manager = DatabaseManager(make_backend())
+            db_manager.connect()
+            try:
+                db_manager.migrate()  # Only runs DDL when the schema is behind
+                db_manager.start_payments(make_payment_gateway())
+            except BaseException:
+                db_manager.close()
+                raise
+            return db_manager
+
+        def on_connected(db_manager):
+            if self.journal:
+                self.journal.stop()
+            if self.db_manager:
+                self.db_manager.close()
+            self.db_manager = db_manager
+            self.service = HatHiveService(db_manager)
+            if self.journal:
+                self.journal.start(db_manager)
+            messagebox.showinfo("Connection", "Connected to the database successfully.")
+
+        self.run_in_background(connect, on_connected, error_title="Database Connection", cancellable=False)
+
+    def get_page_size(self):
+        try:
+            return max(1, int(self.page_size_entry.get()))
+        except ValueError:
+            return PAGE_SIZE
+
+    # Fetch one page of a table view in the background and display it
+    def show_view(self, name, after=None, before=None, at=None):
+        view = VIEWS[name]
+        page_size = self.get_page_size()
+
+        def fetch():
+            rows, has_more = self.service.page(name, page_size, after, before, at)
+            versions = self.service.page_versions(name, rows[0][0], rows[-1][0]) if rows else {}
+            return rows, has_more, versions
+
+        def on_fetched(page):
+            rows, has_more, versions = page
+            if before is not None and not rows:
+                # Nothing before this page any more; show the first page instead
+                self.show_view(name)
+                return
+            if before is not None:
+                has_prev, has_next = has_more, True
+            else:
+                has_prev, has_next = after is not None or at is not None, has_more
+            self.display_page(name, rows, has_prev, has_next, versions)
+
+        self.run_in_background(fetch, on_fetched)
+
+    def next_page(self):
+        if self.current_view and self.page_keys:
+            self.show_view(self.current_view, after=self.page_keys[1])
+
+    def previous_page(self):
+        if self.current_view and self.page_keys:
+            self.show_view(self.current_view, before=self.page_keys[0])
+
+    def jump_to_id(self):
+        if not self.current_view:
+            return
+        try:
+            key = int(self.jump_entry.get())
+        except ValueError:
+            messagebox.showerror("Invalid ID", "Please enter a numeric ID to jump to.")
+            return
+        self.show_view(self.current_view, at=key)
+
+    def display_page(self, name, records, has_prev, has_next, versions=None):
+        view = VIEWS[name]
+        self.current_view = name
+        self.page_keys = (records[0][0], records[-1][0]) if records else None
+        self.page_rows = list(records)
+        self.page_versions = versions or {}
+        self.page_at_end = not has_next
+        self.prev_button.config(state="normal" if has_prev and records else "disabled")
+        self.next_button.config(state="normal" if has_next and records else "disabled")
+        self.page_label.config(text=f"{view['label'].capitalize()} IDs {records[0][0]}-{records[-1][0]}" if records else "")
+
+        self.query_result.delete('1.0', tk.END)  # Clear existing content
+        if not records:
+            self.query_result.insert(tk.END, f"No {view['label']} records found.\n")
+            return
+        self.query_result.insert(tk.END, format_table(view['headers'], records))
+
+    # Bring the page on screen up to date: rows changed since it was read are patched
+    # in place and, on the last page, rows added since are appended. Shows `name`
+    # instead when given and another view (or none) is on screen.
+    def refresh_view(self, name=None):
+        if name and name != self.current_view:
+            self.show_view(name)
+            return
+        if not self.current_view or (self.refreshing and not self.refreshing.cancelled):
+            return
+        if not self.page_versions:
+            self.show_view(self.current_view)
+            return
+        name, versions, at_end = self.current_view, self.page_versions, self.page_at_end
+        limit = max(len(versions), self.get_page_size())
+
+        def on_changes(changes):
+            self.refreshing = None
+            # Ignore the result if another page was shown meanwhile
+            if name != self.current_view or versions is not self.page_versions:
+                return
+            rows, removed, current, has_more = changes
+            if not rows and not removed and not (self.page_at_end and has_more):
+                self.page_versions = current
+                return
+            by_key = {row[0]: row for row in self.page_rows}
+            by_key.update((row[0], row) for row in rows)
+            records = [by_key[key] for key in current if key in by_key]
+            self.page_rows, self.page_versions = records, current
+            self.page_keys = (records[0][0], records[-1][0]) if records else None
+            if self.page_at_end:
+                self.page_at_end = not has_more
+                self.next_button.config(state="normal" if has_more and records else "disabled")
+            view = VIEWS[name]
+            self.page_label.config(
+                text=f"{view['label'].capitalize()} IDs {records[0][0]}-{records[-1][0]}" if records else "")
+            self.patch_results(format_table(view['headers'], records) if records
+                               else f"No {view['label']} records found.\n")
+
+        # Refreshes also run unattended, so a failure is logged rather than shown
+        def on_error(e):
+            self.refreshing = None
+            print(f"Could not refresh the {name} view: {e}")
+
+        self.refreshing = self.executor.submit(
+            lambda: self.service.page_changes(name, versions, limit, at_end), on_changes, on_error)
+
+    # Rewrite only the lines of the results pane that differ from `text`, so the scroll
+    # position and selection survive a refresh
+    def patch_results(self, text):
+        old_lines = self.query_result.get('1.0', 'end-1c').split('\n')
+        new_lines = text.split('\n')
+        for number, (old, new) in enumerate(zip(old_lines, new_lines), 1):
+            if old != new:
+                self.query_result.delete(f"{number}.0", f"{number}.end")
+                self.query_result.insert(f"{number}.0", new)
+        if len(new_lines) < len(old_lines):
+            self.query_result.delete(f"{len(new_lines)}.end", 'end-1c')
+        elif len(new_lines) > len(old_lines):
+            self.query_result.insert('end-1c', '\n' + '\n'.join(new_lines[len(old_lines):]))
+
+    # While auto-refresh is ticked, check the page on screen every VIEW_REFRESH_MS
+    def schedule_view_refresh(self):
+        if not self.auto_refresh.get():
+            return
+        if self.service and self.current_view:
+            self.refresh_view()
+        self.master.after(VIEW_REFRESH_MS, self.schedule_view_refresh)
+
+    # Function to fetch and display customers from the database
+    def view_customers(self):
+        self.show_view('customers')
+
+    # Function to add a new customer to the database
+    def add_customer(self):
+        # Open a new window to input new customer details
+        add_window = tk.Toplevel(self.master)
+        add_window.title("Add New Customer")
+
+        Label(add_window, text="Name:").grid(row=0, column=0)
+        name_entry = Entry(add_window)
+        name_entry.grid(row=0, column=1)
+
+        Label(add_window, text="Date of Birth (YYYY-MM-DD):").grid(row=1, column=0)
+        dob_entry = Entry(add_window)
+        dob_entry.grid(row=1, column=1)
+
+        Label(add_window, text="Email:").grid(row=2, column=0)
+        email_entry = Entry(add_window)
+        email_entry.grid(row=2, column=1)
+
+        Label(add_window, text="Contact Info:").grid(row=3, column=0)
+        contact_info_entry = Entry(add_window)
+        contact_info_entry.grid(row=3, column=1)
+
+        Label(add_window, text="Address:").grid(row=4, column=0)
+        address_entry = Entry(add_window)
+        address_entry.grid(row=4, column=1)
+
+        submit_button = Button(add_window, text="Submit", command=lambda: self.submit_new_customer(
+            name_entry.get(),
+            dob_entry.get(),
+            email_entry.get(),
+            contact_info_entry.get(),
+            address_entry.get(),
+            add_window
+        ))
+        submit_button.grid(row=5, column=1, pady=5)
+
+    def submit_new_customer(self, name, dob, email, contact_info, address, window):
+        if not all([name, dob, email, contact_info, address]):
+            messagebox.showwarning("Warning", "All fields are required to add a new customer.")
+            return
+
+        if not validate_date(dob):
+            messagebox.showerror("Invalid Date", "The Date of Birth is in an incorrect format. Please use YYYY-MM-DD.")
+            return
+
+        record = {'name': name, 'DOB': dob, 'email': email, 'contact_info': contact_info, 'address': address}
+
+        def on_added(_):
+            messagebox.showinfo("Success", "New customer added successfully.")
+            window.destroy()  # Close the add new customer window
+            self.refresh_view('customers')  # Only reads what changed when customers are on screen
+
+        self.run_in_background(
+            lambda: self.service.add_customer(record),
+            on_added, cancellable=False)
+
+    def view_hats(self):
+        self.show_view('hats')
+
+    def add_hat(self):
+        add_hat_window = tk.Toplevel(self.master)
+        add_hat_window.title("Add New Hat")
+
+        Label(add_hat_window, text="Brand ID:").grid(row=0, column=0)
+        brand_id_entry = Entry(add_hat_window)
+        brand_id_entry.grid(row=0, column=1)
+
+        Label(add_hat_window, text="Brand Name:").grid(row=1, column=0)
+        brand_name_entry = Entry(add_hat_window)
+        brand_name_entry.grid(row=1, column=1)
+
+        Label(add_hat_window, text="Style:").grid(row=2, column=0)
+        style_entry = Entry(add_hat_window)
+        style_entry.grid(row=2, column=1)
+
+        Label(add_hat_window, text="Size:").grid(row=3, column=0)
+        size_entry = Entry(add_hat_window)
+        size_entry.grid(row=3, column=1)
+
+        Label(add_hat_window, text="Quantity:").grid(row=4, column=0)
+        quantity_entry = Entry(add_hat_window)
+        quantity_entry.grid(row=4, column=1)
+
+        Label(add_hat_window, text="Price:").grid(row=5, column=0)
+        price_entry = Entry(add_hat_window)
+        price_entry.grid(row=5, column=1)
+
+        submit_button = Button(add_hat_window, text="Submit", command=lambda: self.submit_new_hat(
+            brand_id_entry.get(),
+            brand_name_entry.get(),
+            style_entry.get(),
+            size_entry.get(),
+            quantity_entry.get(),
+            price_entry.get(),
+            add_hat_window
+        ))
+        submit_button.grid(row=6, column=1, pady=5)
+
+    def submit_new_hat(self, brand_id, brand_name, style, size, quantity, price, window):
+        if not all([brand_id, brand_name, style, size, quantity, price]):
+            messagebox.showwarning("Warning", "All fields are required to add a new hat.")
+            return
+
+        record = {'brand_id': brand_id, 'brand_name': brand_name, 'style': style, 'size': size,
+                  'quantity': quantity, 'price': price}
+
+        def on_added(_):
+            messagebox.showinfo("Success", "New hat added successfully.")
+            window.destroy()
+            self.refresh_view('hats')
+
+        self.run_in_background(
+            lambda: self.service.add_hat(record),
+            on_added, cancellable=False)
+
+    # Order window with a cart: hats are added one at a time and the whole cart is
+    # placed as one order with one delivery and one bill
+    def add_order(self):
+        add_order_window = tk.Toplevel(self.master)
+        add_order_window.title("Place New Order")
+        cart = []  # (hat_id, quantity) in the order they were added
+
+        Label(add_order_window, text="Customer (ID, name or email):").grid(row=0, column=0)
+        customer_id_entry = Entry(add_order_window)
+        customer_id_entry.grid(row=0, column=1)
+
+        Label(add_order_window, text="Hat (ID or brand style size):").grid(row=1, column=0)
+        hat_id_entry = Entry(add_order_window)
+        hat_id_entry.grid(row=1, column=1)
+        hat_info_label = Label(add_order_window, text="")
+        hat_info_label.grid(row=1, column=2, sticky="w")
+        hat_id_entry.bind("<FocusOut>", lambda _: self.show_hat_info(hat_id_entry.get(), hat_info_label))
+
+        Label(add_order_window, text="Quantity:").grid(row=2, column=0)
+        quantity_entry = Entry(add_order_window)
+        quantity_entry.grid(row=2, column=1)
+
+        Label(add_order_window, text="Cart:").grid(row=4, column=0, sticky="nw")
+        cart_list = tk.Listbox(add_order_window, height=6, width=60)
+        cart_list.grid(row=4, column=1, columnspan=2, sticky="ew", pady=5)
+
+        Button(add_order_window, text="Add to Cart", command=lambda: self.add_to_cart(
+            hat_id_entry, quantity_entry, cart, cart_list
+        )).grid(row=3, column=1, pady=5, sticky="ew")
+
+        def remove_selected():
+            for index in reversed(cart_list.curselection()):
+                del cart[index]
+                cart_list.delete(index)
+
+        Button(add_order_window, text="Remove from Cart", command=remove_selected).grid(
+            row=5, column=1, pady=5, sticky="ew")
+
+        Label(add_order_window, text="Order Date (YYYY-MM-DD):").grid(row=6, column=0)
+        order_date_entry = Entry(add_order_window)
+        order_date_entry.grid(row=6, column=1)
+
+        # A filled-in hat that was not added to the cart is ordered on its own
+        submit_button = Button(add_order_window, text="Place Order", command=lambda: self.submit_new_order(
+            customer_id_entry.get(),
+            cart or [(hat_id_entry.get().strip(), quantity_entry.get().strip())],
+            order_date_entry.get(),
+            add_order_window
+        ))
+        submit_button.grid(row=7, column=1, pady=5)
+
+        # Typing a name, email or hat description lists matches; picking one fills in its ID
+        Label(add_order_window, text="Suggestions:").grid(row=8, column=0, sticky="nw")
+        suggestions = tk.Listbox(add_order_window, height=TYPEAHEAD_LIMIT, width=60)
+        suggestions.grid(row=8, column=1, columnspan=2, sticky="ew", pady=5)
+        type_ahead = TypeAhead(self, suggestions)
+        type_ahead.attach(
+            customer_id_entry,
+            lambda text: self.service.search_customers(text, TYPEAHEAD_LIMIT),
+            lambda row: f"#{row[0]} {row[1]} <{row[2]}>")
+        type_ahead.attach(
+            hat_id_entry,
+            lambda text: self.service.find_hats(text),
+            lambda row: f"#{row[0]} {row[1]} {row[2]}, size {row[3]}: {row[5]} ({row[4]} in stock)",
+            lambda row: self.show_hat_info(str(row[0]), hat_info_label))
+
+    # Look the hat up (usually in the hat cache) and add it to the cart. Before
+    # connecting the hat is added unchecked; the journal replay checks it.
+    def add_to_cart(self, hat_id_entry, quantity_entry, cart, cart_list):
+        hat_id, quantity = hat_id_entry.get().strip(), quantity_entry.get().strip()
+        if not hat_id.isdigit() or not quantity.isdigit() or int(quantity) <= 0:
+            messagebox.showwarning("Warning", "Enter a hat ID and a positive whole quantity to add to the cart.")
+            return
+        if not self.service:
+            cart.append((int(hat_id), int(quantity)))
+            cart_list.insert(tk.END, f"#{hat_id}: {quantity} x (not checked, offline)")
+            hat_id_entry.delete(0, tk.END)
+            quantity_entry.delete(0, tk.END)
+            return
+
+        def on_loaded(hat):
+            if not cart_list.winfo_exists():
+                return
+            if hat is None:
+                messagebox.showerror("Error", "Hat ID does not exist.")
+                return
+            cart.append((hat['hat_id'], int(quantity)))
+            cart_list.insert(tk.END, f"#{hat['hat_id']} {hat['brand_name']} {hat['style']}, size {hat['size']}:"
+                                     f" {quantity} x {hat['price']}")
+            hat_id_entry.delete(0, tk.END)
+            quantity_entry.delete(0, tk.END)
+
+        self.run_in_background(lambda: self.service.get_hat(hat_id), on_loaded)
+
+    # Show the price and stock of the hat being ordered, usually straight from the hat cache
+    def show_hat_info(self, hat_id, label):
+        if not self.service or not hat_id.strip().isdigit():
+            label.config(text="")
+            return
+
+        def on_loaded(hat):
+            if not label.winfo_exists():
+                return
+            if hat is None:
+                label.config(text="Unknown hat")
+            else:
+                label.config(text=f"{hat['brand_name']} {hat['style']}, size {hat['size']}: {hat['price']}"
+                                  f" ({hat['quantity']} in stock)")
+
+        self.run_in_background(lambda: self.service.get_hat(hat_id), on_loaded)
+
+    def submit_new_order(self, customer_id, lines, order_date, window):
+        if not all([customer_id, order_date]) or not all(hat_id and quantity for hat_id, quantity in lines):
+            messagebox.showwarning("Warning", "A customer, an order date and at least one hat are required.")
+            return
+
+        if not validate_date(order_date):
+            messagebox.showerror("Invalid Date", "The order date is in an incorrect format. Please use YYYY-MM-DD.")
+            return
+
+        def on_taken(order):
+            if order is None:
+                messagebox.showinfo("Success", "Order taken. It is sent to the database in the background.")
+                window.destroy()
+                return
+            messagebox.showinfo("Success", "Order placed and bill created. The payment is being processed.")
+            window.destroy()
+            self.refresh_view()  # Stock, orders and bills on screen may have changed
+
+        # While connected and nothing is waiting in the journal the order is placed at
+        # once, so stock and customer problems are reported at the counter. When the
+        # database cannot be reached the order is journaled under the same key, so a
+        # placement that went through before the connection dropped is not repeated.
+        service, journal = self.service, self.journal
+        if not service and not journal:
+            messagebox.showerror("Error", "Connect to a database first.")
+            return
+        key = uuid.uuid4().hex
+
+        def take_order():
+            if service and not (journal and journal.backlog()):
+                try:
+                    return service.place_cart(customer_id, lines, order_date, journal_key=key)
+                except (DatabaseError,) + service.db_manager.backend.disconnect_errors:
+                    if not journal:
+                        raise
+            journal.append(customer_id, lines, order_date, key=key)
+            return None
+
+        self.run_in_background(take_order, on_taken, cancellable=False)
+
+    def view_deliveries(self):
+        self.show_view('deliveries')
+
+    def view_orders(self):
+        self.show_view('orders')
+
+    # Dispatch work lists (DELIVERY_QUEUES) with status changes for the selected
+    # deliveries and rescheduling of everything due in a date range
+    def show_dispatch(self):
+        window = tk.Toplevel(self.master)
+        window.title("Dispatch")
+        queues = {queue['label']: name for name, queue in DELIVERY_QUEUES.items()}
+        shown = []  # delivery IDs in list order
+
+        Label(window, text="List:").grid(row=0, column=0, sticky="w")
+        queue_choice = ttk.Combobox(window, values=list(queues), state="readonly")
+        queue_choice.current(0)
+        queue_choice.grid(row=0, column=1, sticky="ew")
+        Label(window, text="Region (blank for all):").grid(row=1, column=0, sticky="w")
+        region_entry = Entry(window)
+        region_entry.grid(row=1, column=1, sticky="ew")
+
+        deliveries = tk.Listbox(window, height=15, width=110, selectmode="extended", font=("Courier", 10))
+        deliveries.grid(row=3, column=0, columnspan=4, padx=5, pady=5)
+
+        def load():
+            def on_loaded(rows):
+                if not deliveries.winfo_exists():
+                    return
+                deliveries.delete(0, tk.END)
+                shown[:] = [row[0] for row in rows]
+                for delivery_id, order_id, arrival_date, status, region, name, address in rows:
+                    deliveries.insert(tk.END, f"#{delivery_id:<8} order {order_id:<8} {arrival_date}  {status:<10}"
+                                              f" {region or '-':<15} {name}, {address}")
+                if not rows:
+                    deliveries.insert(tk.END, "Nothing to deliver.")
+
+            queue, region = queues[queue_choice.get()], region_entry.get()
+            self.run_in_background(lambda: self.service.due_deliveries(queue, region), on_loaded)
+
+        def mark(status):
+            delivery_ids = [shown[index] for index in deliveries.curselection() if index < len(shown)]
+            if not delivery_ids:
+                messagebox.showwarning("Warning", "Select the deliveries to mark first.")
+                return
+
+            def on_marked(_):
+                load()
+                self.refresh_view()
+
+            self.run_in_background(lambda: self.service.set_delivery_status(delivery_ids, status), on_marked)
+
+        Button(window, text="Show", command=load).grid(row=2, column=1, sticky="ew", pady=5)
+        Button(window, text="Mark Dispatched", command=lambda: mark("Dispatched")).grid(row=4, column=0, pady=5)
+        Button(window, text="Mark Delivered", command=lambda: mark("Delivered")).grid(row=4, column=1, pady=5)
+
+        reschedule_frame = LabelFrame(window, text="Reschedule open deliveries", padx=5, pady=5)
+        reschedule_frame.grid(row=5, column=0, columnspan=4, sticky="ew", padx=5, pady=5)
+        entries = {}
+        for row, (name, text) in enumerate((
+                ("days", "Move by (days):"), ("start", "Due from (YYYY-MM-DD):"), ("end", "Due to (YYYY-MM-DD):"),
+                ("region", "Region (blank for all):"), ("hat_id", "Hat ID (blank for all):"))):
+            Label(reschedule_frame, text=text).grid(row=row, column=0, sticky="w")
+            entries[name] = Entry(reschedule_frame)
+            entries[name].grid(row=row, column=1)
+        entries["start"].insert(0, date.today().isoformat())
+        entries["end"].insert(0, date.today().isoformat())
+        business_days = tk.BooleanVar()
+        ttk.Checkbutton(reschedule_frame, text="Count business days", variable=business_days).grid(
+            row=5, column=1, sticky="w")
+
+        def reschedule():
+            values = {name: entry.get().strip() for name, entry in entries.items()}
+            if not messagebox.askyesno("Reschedule", f"Move the open deliveries due from {values['start']} to"
+                                                     f" {values['end']} by {values['days']} days?"):
+                return
+
+            def on_moved(moved):
+                messagebox.showinfo("Reschedule", f"Moved {moved} deliveries.")
+                if deliveries.winfo_exists():
+                    load()
+                self.refresh_view()
+
+            self.run_in_background(lambda: self.service.reschedule_deliveries(
+                values['days'], values['start'], values['end'], values['region'], values['hat_id'],
+                business_days.get()), on_moved, cancellable=False)
+
+        Button(reschedule_frame, text="Reschedule", command=reschedule).grid(row=6, column=1, sticky="ew", pady=5)
+        load()
+
+    # Lead-time rules per hat and region, and the holidays business days skip
+    def show_delivery_rules(self):
+        window = tk.Toplevel(self.master)
+        window.title("Delivery Rules")
+        rules_text = scrolledtext.ScrolledText(window, height=15, width=80)
+        rules_text.grid(row=0, column=0, columnspan=4, padx=5, pady=5)
+
+        def load():
+            def on_loaded(result):
+                if not rules_text.winfo_exists():
+                    return
+                rules, holidays = result
+                rules_text.delete('1.0', tk.END)
+                rules_text.insert(tk.END, f"Without a rule deliveries take {DELIVERY_DAYS} days.\n\n")
+                rules_text.insert(tk.END, format_table(
+                    ["Rule ID", "Hat ID", "Region", "Lead Days", "Business Days"],
+                    [(rule_id, hat_id or "any", region or "any", lead_days, "yes" if business else "no")
+                     for rule_id, hat_id, region, lead_days, business in rules]) if rules else "No rules.\n")
+                rules_text.insert(tk.END, "\n" + (format_table(["Holiday", "Description"], holidays)
+                                                  if holidays else "No holidays.\n"))
+
+            self.run_in_background(
+                lambda: (self.service.delivery_rules(), self.service.delivery_holidays()), on_loaded)
+
+        def change(work):
+            self.run_in_background(work, lambda _: load())
+
+        entries = {}
+        for row, (name, text) in enumerate((
+                ("hat_id", "Hat ID (blank for all):"), ("region", "Region (blank for all):"),
+                ("lead_days", "Lead time (days):")), start=1):
+            Label(window, text=text).grid(row=row, column=0, sticky="w")
+            entries[name] = Entry(window)
+            entries[name].grid(row=row, column=1)
+        business_days = tk.BooleanVar()
+        ttk.Checkbutton(window, text="Count business days", variable=business_days).grid(row=4, column=1, sticky="w")
+        Button(window, text="Save Rule", command=lambda: change(lambda: self.service.set_delivery_rule(
+            entries["hat_id"].get().strip(), entries["region"].get(), entries["lead_days"].get().strip(),
+            business_days.get()))).grid(row=5, column=1, sticky="ew", pady=5)
+
+        Label(window, text="Rule ID:").grid(row=6, column=0, sticky="w")
+        rule_id_entry = Entry(window)
+        rule_id_entry.grid(row=6, column=1)
+        Button(window, text="Remove Rule", command=lambda: change(
+            lambda: self.service.delete_delivery_rule(rule_id_entry.get().strip()))).grid(row=6, column=2, padx=5)
+
+        Label(window, text="Holiday (YYYY-MM-DD):").grid(row=7, column=0, sticky="w")
+        holiday_entry = Entry(window)
+        holiday_entry.grid(row=7, column=1)
+        Label(window, text="Description:").grid(row=8, column=0, sticky="w")
+        description_entry = Entry(window)
+        description_entry.grid(row=8, column=1)
+        Button(window, text="Add Holiday", command=lambda: change(lambda: self.service.set_delivery_holiday(
+            holiday_entry.get().strip(), description_entry.get().strip()))).grid(row=7, column=2, padx=5)
+        Button(window, text="Remove Holiday", command=lambda: change(
+            lambda: self.service.delete_delivery_holiday(holiday_entry.get().strip()))).grid(row=8, column=2, padx=5)
+        load()
+
+    def clear_all_data(self):
+        confirm = messagebox.askyesno("Confirm", "Are you sure you want to delete all data?")
+        if confirm:
+            self.run_in_background(
+                self.service.clear_all_data,
+                lambda _: messagebox.showinfo("Success", "All data has been deleted."),
+                cancellable=False)
+
+    def view_bills(self):
+        self.show_view('bills')
+
+    def show_reports(self):
+        report_window = tk.Toplevel(self.master)
+        report_window.title("Sales Reports")
+
+        Label(report_window, text="Report:").grid(row=0, column=0)
+        names = list(REPORTS)
+        report_choice = ttk.Combobox(
+            report_window, values=[REPORTS[name]['label'] for name in names], state="readonly")
+        report_choice.current(0)
+        report_choice.grid(row=0, column=1)
+
+        Label(report_window, text="From (YYYY-MM-DD):").grid(row=1, column=0)
+        start_entry = Entry(report_window)
+        start_entry.grid(row=1, column=1)
+
+        Label(report_window, text="To (YYYY-MM-DD):").grid(row=2, column=0)
+        end_entry = Entry(report_window)
+        end_entry.grid(row=2, column=1)
+
+        Button(report_window, text="Run", command=lambda: self.run_report(
+            names[report_choice.current()], start_entry.get().strip(), end_entry.get().strip()
+        )).grid(row=3, column=1, pady=5, sticky="ew")
+        Button(report_window, text="Rebuild Summaries", command=self.rebuild_sales_summary).grid(
+            row=4, column=1, pady=5, sticky="ew")
+
+    def run_report(self, name, start, end):
+        report = REPORTS[name]
+        self.run_in_background(
+            lambda: self.service.sales_report(name, start or None, end or None),
+            lambda records: self.display_results(report['label'], report['headers'], records, "No sales in this period."))
+
+    # Show rows that are not part of a paged view (reports, search results)
+    def display_results(self, label, headers, records, empty_message):
+        self.current_view = None
+        self.page_keys = None
+        self.prev_button.config(state="disabled")
+        self.next_button.config(state="disabled")
+        self.page_label.config(text=label)
+        self.query_result.delete('1.0', tk.END)
+        if not records:
+            self.query_result.insert(tk.END, empty_message + "\n")
+            return
+        self.query_result.insert(tk.END, format_table(headers, records))
+
+    # Sell-through, stock-out forecast and customer cohorts from the analytics
+    # snapshot. Refresh reads only what was added since the last refresh.
+    def show_analytics(self):
+        window = tk.Toplevel(self.master)
+        window.title("Analytics")
+        window.geometry('900x500')
+        labels = {analysis['label']: name for name, analysis in ANALYTICS.items()}
+        results = {}
+
+        control_frame = Frame(window, pady=5)
+        control_frame.pack(fill="x")
+        analysis_choice = ttk.Combobox(control_frame, values=list(labels), state="readonly", width=40)
+        analysis_choice.current(0)
+        analysis_choice.pack(side="left", padx=5)
+        info_label = Label(control_frame, text="")
+        info_label.pack(side="left", padx=5)
+        analytics_text = scrolledtext.ScrolledText(window, wrap="none")
+        analytics_text.pack(fill="both", expand=True, padx=5, pady=5)
+
+        def show(_=None):
+            if 'report' not in results or not analytics_text.winfo_exists():
+                return
+            name = labels[analysis_choice.get()]
+            rows = results['report'][name]
+            analytics_text.delete('1.0', tk.END)
+            analytics_text.insert(tk.END, format_table(ANALYTICS[name]['headers'], rows) if rows else "No data yet.\n")
+
+        def refresh():
+            started = time.perf_counter()
+
+            def on_computed(result):
+                if not window.winfo_exists():
+                    return
+                results['report'], counters = result
+                info_label.config(text=f"{counters['analytics_lines']} order lines in memory,"
+                                       f" {counters['analytics_rows_read']} rows read,"
+                                       f" {time.perf_counter() - started:.2f}s")
+                show()
+
+            self.run_in_background(self.service.analytics, on_computed, error_title="Analytics")
+
+        analysis_choice.bind("<<ComboboxSelected>>", show)
+        Button(control_frame, text="Refresh", command=refresh).pack(side="right", padx=5)
+        refresh()
+
+    def show_archive(self):
+        archive_window = tk.Toplevel(self.master)
+        archive_window.title("Archive Old Orders")
+
+        Label(archive_window, text="Archive closed orders dated before (YYYY-MM-DD):").grid(row=0, column=0)
+        before_entry = Entry(archive_window)
+        before_entry.insert(0, (date.today() - timedelta(days=ARCHIVE_AFTER_DAYS)).isoformat())
+        before_entry.grid(row=0, column=1)
+
+        Button(archive_window, text="Archive", command=lambda: self.run_archive(
+            before_entry.get().strip(), archive_window
+        )).grid(row=1, column=1, pady=5, sticky="ew")
+
+    # Archived orders stay in reports, searches and exports; they leave the paged views
+    def run_archive(self, before, window):
+        if not messagebox.askyesno(
+                "Archive", f"Move orders dated before {before} that are paid and marked Delivered to the archive?"):
+            return
+
+        def on_archived(archived):
+            messagebox.showinfo("Archive", f"Archived {archived} orders.")
+            if window.winfo_exists():
+                window.destroy()
+
+        self.run_in_background(lambda: self.service.archive_orders(before), on_archived, cancellable=False)
+
+    def show_export(self):
+        export_window = tk.Toplevel(self.master)
+        export_window.title("Export")
+
+        Label(export_window, text="Data:").grid(row=0, column=0)
+        export_choice = ttk.Combobox(export_window, values=list(EXPORTS), state="readonly")
+        export_choice.current(0)
+        export_choice.grid(row=0, column=1)
+
+        Label(export_window, text="Format:").grid(row=1, column=0)
+        format_choice = ttk.Combobox(export_window, values=EXPORT_FORMATS, state="readonly")
+        format_choice.current(0)
+        format_choice.grid(row=1, column=1)
+
+        compress = tk.BooleanVar()
+        ttk.Checkbutton(export_window, text="Gzip (CSV/JSONL)", variable=compress).grid(row=2, column=1, sticky="w")
+
+        Label(export_window, text="From (YYYY-MM-DD):").grid(row=3, column=0)
+        start_entry = Entry(export_window)
+        start_entry.grid(row=3, column=1)
+
+        Label(export_window, text="To (YYYY-MM-DD):").grid(row=4, column=0)
+        end_entry = Entry(export_window)
+        end_entry.grid(row=4, column=1)
+
+        since_last = tk.BooleanVar()
+        ttk.Checkbutton(export_window, text="Only rows added since the last export", variable=since_last).grid(
+            row=5, column=1, sticky="w")
+
+        Button(export_window, text="Export...", command=lambda: self.run_export(
+            export_choice.get(), format_choice.get(), compress.get(),
+            start_entry.get().strip(), end_entry.get().strip(), since_last.get()
+        )).grid(row=6, column=1, pady=5, sticky="ew")
+
+    def run_export(self, name, fmt, compress, start, end, since_last):
+        if fmt == "parquet":
+            compress = False
+        extension = f".{fmt}.gz" if compress else f".{fmt}"
+        path = filedialog.asksaveasfilename(defaultextension=extension, initialfile=name + extension)
+        if not path:
+            return
+        self.run_in_background(
+            lambda: self.service.export(name, path, fmt, compress, start or None, end or None, since_last=since_last),
+            lambda result: messagebox.showinfo("Export", f"Exported {result[0]} rows to {path}."),
+            cancellable=False)
+
+    def show_search(self):
+        search_window = tk.Toplevel(self.master)
+        search_window.title("Search")
+
+        customer_frame = LabelFrame(search_window, text="Customers", padx=5, pady=5)
+        customer_frame.pack(fill="x", padx=5, pady=5)
+        Label(customer_frame, text="Name or email starts with:").grid(row=0, column=0, sticky="w")
+        customer_entry = Entry(customer_frame)
+        customer_entry.grid(row=0, column=1)
+        Button(customer_frame, text="Search", command=lambda: self.run_search(
+            'customers', "Customers", lambda: self.service.search_customers(customer_entry.get())
+        )).grid(row=0, column=2, padx=5)
+
+        hat_frame = LabelFrame(search_window, text="Hats", padx=5, pady=5)
+        hat_frame.pack(fill="x", padx=5, pady=5)
+        hat_entries = []
+        for row, text in enumerate(["Brand name starts with:", "Style starts with:", "Size:"]):
+            Label(hat_frame, text=text).grid(row=row, column=0, sticky="w")
+            entry = Entry(hat_frame)
+            entry.grid(row=row, column=1)
+            hat_entries.append(entry)
+        Button(hat_frame, text="Search", command=lambda: self.run_search(
+            'hats', "Hats", lambda: self.service.search_hats(*(entry.get().strip() for entry in hat_entries))
+        )).grid(row=2, column=2, padx=5)
+
+        order_frame = LabelFrame(search_window, text="Orders", padx=5, pady=5)
+        order_frame.pack(fill="x", padx=5, pady=5)
+        order_entries = []
+        for row, text in enumerate(["Customer ID:", "From (YYYY-MM-DD):", "To (YYYY-MM-DD):"]):
+            Label(order_frame, text=text).grid(row=row, column=0, sticky="w")
+            entry = Entry(order_frame)
+            entry.grid(row=row, column=1)
+            order_entries.append(entry)
+        Button(order_frame, text="Search", command=lambda: self.run_search(
+            'orders', "Orders", lambda: self.service.search_orders(*(entry.get().strip() for entry in order_entries))
+        )).grid(row=2, column=2, padx=5)
+
+    def run_search(self, kind, label, search):
+        self.run_in_background(
+            search, lambda records: self.display_results(label, SEARCH_HEADERS[kind], records, "No matches found."))
+
+    def rebuild_sales_summary(self):
+        self.run_in_background(
+            self.service.rebuild_sales_summary,
+            lambda _: messagebox.showinfo("Success", "Sales summaries rebuilt from the order history."),
+            cancellable=False)
+
+    # Window with live pool/cache counters and per-statement latencies, refreshed
+    # every DIAGNOSTICS_REFRESH_MS while it is open
+    def show_diagnostics(self):
+        if not self.db_manager:
+            messagebox.showerror("Diagnostics", "Connect to a database first.")
+            return
+        if self.diagnostics_window and self.diagnostics_window.winfo_exists():
+            self.diagnostics_window.lift()
+            return
+
+        window = self.diagnostics_window = tk.Toplevel(self.master)
+        window.title("Diagnostics")
+        window.geometry('1000x500')
+        counters_label = Label(window, justify="left", anchor="w", font=("Courier", 10))
+        counters_label.pack(fill="x", padx=5, pady=5)
+        statements_text = scrolledtext.ScrolledText(window, height=20, wrap="none")
+        statements_text.pack(fill="both", expand=True, padx=5)
+
+        button_frame = Frame(window, pady=5)
+        button_frame.pack(fill="x")
+        Button(button_frame, text="Export JSON", command=lambda: self.export_stats('json')).pack(side="left", padx=5)
+        Button(button_frame, text="Export Prometheus",
+               command=lambda: self.export_stats('prometheus')).pack(side="left", padx=5)
+        Button(button_frame, text="Reset", command=lambda: self.db_manager.stats.reset()).pack(side="left", padx=5)
+
+        headers = ["Calls", "Errors", "Rows", "Total ms", "p50 ms", "p95 ms", "p99 ms", "Max ms", "Statement"]
+
+        def refresh():
+            if not window.winfo_exists() or not self.db_manager:
+                return
+            counters = self.db_manager.counters()
+            if self.journal:
+                counters.update(self.journal.counters())
+            counters = list(counters.items())
+            counters_label.config(text="\n".join(
+                "   ".join(f"{name}: {value}" for name, value in counters[i:i + 4])
+                for i in range(0, len(counters), 4)))
+            records = [
+                (entry['calls'], entry['errors'], entry['rows'], f"{entry['total_ms']:.1f}", f"{entry['p50_ms']:.2f}",
+                 f"{entry['p95_ms']:.2f}", f"{entry['p99_ms']:.2f}", f"{entry['max_ms']:.2f}", entry['shape'])
+                for entry in self.db_manager.stats.snapshot()]
+            position = statements_text.yview()[0]
+            statements_text.delete('1.0', tk.END)
+            statements_text.insert(tk.END, format_table(headers, records) if records else "No statements yet.\n")
+            statements_text.yview_moveto(position)
+            window.after(DIAGNOSTICS_REFRESH_MS, refresh)
+
+        refresh()
+
+    def export_stats(self, fmt):
+        extension = ".prom" if fmt == 'prometheus' else ".json"
+        path = filedialog.asksaveasfilename(defaultextension=extension, initialfile=f"hathive-stats{extension}")
+        if not path:
+            return
+        try:
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(self.db_manager.export_stats(fmt))
+        except OSError as e:
+            messagebox.showerror("Export Failed", f"Could not write {path}: {e}")
+
+    def on_closing(self):
+        self.executor.shutdown()
+        if self.journal:
+            self.journal.close()
+        if self.db_manager:
+            self.db_manager.close()
+        self.master.destroy()
+
+
+def run():
+    root = tk.Tk()
+    app = HatHiveApp(root)
+    root.protocol("WM_DELETE_WINDOW", app.on_closing)
+    root.mainloop()
+    return 0
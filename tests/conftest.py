@@ -0,0 +1,43 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import HatHive  # noqa: E402
+
+
+def open_db(path):
+    db = HatHive.DatabaseManager(HatHive.SQLiteBackend(str(path)), slow_query_log=None)
+    db.connect()
+    db.migrate()
+    return db
+
+
+# A migrated, empty SQLite database in the test's temporary directory
+@pytest.fixture
+def db(tmp_path):
+    db = open_db(tmp_path / "hathive.db")
+    yield db
+    db.close()
+
+
+# Two customers, and two hats: #1 with plenty of stock and #2 with only 5
+@pytest.fixture
+def shop(db):
+    db.import_rows('customers', [
+        {'name': "Ada", 'DOB': "1990-01-01", 'email': "ada@example.com", 'contact_info': "1",
+         'address': "1 Main St, Springfield"},
+        {'name': "Bob", 'DOB': "1985-06-30", 'email': "bob@example.com", 'contact_info': "2",
+         'address': "2 High St, Shelbyville"},
+    ])
+    db.import_rows('hats', [
+        {'brand_id': 1, 'brand_name': "Acme", 'style': "Fedora", 'size': 7, 'quantity': 100, 'price': "19.99"},
+        {'brand_id': 2, 'brand_name': "Brim", 'style': "Cap", 'size': 6, 'quantity': 5, 'price': "9.50"},
+    ])
+    return db
+
+
+def stock(db, hat_id):
+    return db.fetch("SELECT quantity FROM hats WHERE hat_id = %s", (hat_id,))[0][0]
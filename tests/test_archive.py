@@ -0,0 +1,53 @@
+from HatHive import ARCHIVED_COLUMNS
+
+
+def close_order(db, order_id, payment_status="Paid", delivery_status="Delivered"):
+    db.execute("UPDATE bills SET payment_status = %s WHERE order_id = %s", (payment_status, order_id))
+    db.execute("UPDATE delivery SET status = %s, region = 'springfield' WHERE order_id = %s",
+               (delivery_status, order_id))
+
+
+def test_archive_moves_only_closed_orders(shop):
+    closed, _, _ = shop.place_order(1, 1, "2024-01-01", 1)
+    close_order(shop, closed)
+    unpaid, _, _ = shop.place_order(1, 1, "2024-01-01", 1)
+    close_order(shop, unpaid, payment_status="Pending")
+    charging, _, _ = shop.place_order(1, 1, "2024-01-01", 1)
+    close_order(shop, charging, payment_status="Processing")
+    overdue, _, _ = shop.place_order(1, 1, "2024-01-01", 1)
+    close_order(shop, overdue, delivery_status="Scheduled")
+    recent, _, _ = shop.place_order(1, 1, "2024-06-01", 1)
+    close_order(shop, recent)
+
+    assert shop.archive_orders("2024-03-01", batch_size=1) == 1
+    assert shop.fetch("SELECT order_id FROM orders_archive") == [(closed,)]
+    assert shop.fetch("SELECT order_id FROM orders ORDER BY order_id") == [
+        (unpaid,), (charging,), (overdue,), (recent,)]
+    assert shop.fetch("SELECT order_id FROM bills_archive") == [(closed,)]
+    assert shop.archive_orders("2024-03-01") == 0
+
+
+def test_all_views_cover_live_and_archived_rows(shop):
+    for day in ("2024-01-01", "2024-01-02", "2024-06-01"):
+        order_id, _, _ = shop.place_cart(1, [(1, 1)], day, journal_key=f"key-{day}")
+        close_order(shop, order_id)
+    shop.archive_orders("2024-03-01")
+
+    for table in ARCHIVED_COLUMNS:
+        live = shop.fetch(f"SELECT COUNT(*) FROM {table}")[0][0]
+        archived = shop.fetch(f"SELECT COUNT(*) FROM {table}_archive")[0][0]
+        assert shop.fetch(f"SELECT COUNT(*) FROM all_{table}") == [(live + archived,)]
+    assert shop.fetch("SELECT status, region, version FROM delivery_archive ORDER BY order_id") == [
+        ("Delivered", "springfield", 0), ("Delivered", "springfield", 0)]
+    assert shop.fetch("SELECT journal_key FROM all_orders ORDER BY order_id") == [
+        ("key-2024-01-01",), ("key-2024-01-02",), ("key-2024-06-01",)]
+
+
+def test_replay_does_not_repeat_archived_orders(shop):
+    order_id, _, _ = shop.place_cart(1, [(1, 1)], "2024-01-01", journal_key="old")
+    close_order(shop, order_id)
+    shop.archive_orders("2024-03-01")
+    results = shop.replay_orders([{'key': "old", 'customer_id': 1, 'lines': [[1, 1]], 'date': "2024-01-01",
+                                   'payment_method': "Credit Card"}])
+    assert results == [("old", order_id, None)]
+    assert shop.fetch("SELECT COUNT(*) FROM orders") == [(0,)]
@@ -0,0 +1,52 @@
+import csv
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+import HatHive
+from conftest import open_db
+
+
+def test_command_line_reports_bad_input_as_usage_error(shop, capsys):
+    with pytest.raises(SystemExit) as exit_info:
+        HatHive.main(["archive", "--before", "yesterday", "--sqlite", shop.backend.path])
+    assert exit_info.value.code == 2
+    assert "YYYY-MM-DD" in capsys.readouterr().err
+
+
+def read_csv(path):
+    with open(path, newline='', encoding='utf-8') as f:
+        return list(csv.DictReader(f))
+
+
+def test_export_since_last_continues_where_it_stopped(shop, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    database = shop.backend.path
+    for day in ("2024-01-01", "2024-01-02"):
+        shop.place_order(1, 1, day, 1)
+
+    def export(name):
+        path = str(tmp_path / name)
+        assert HatHive.main(["export", "orders", path, "--since-last", "--state", str(tmp_path / "state.json"),
+                             "--sqlite", database]) == 0
+        return read_csv(path)
+
+    assert [row['order_id'] for row in export("first.csv")] == ["1", "2"]
+    assert export("second.csv") == []
+    db = open_db(database)
+    try:
+        db.place_order(2, 2, "2024-01-03", 1)
+    finally:
+        db.close()
+    assert [row['order_id'] for row in export("third.csv")] == ["3"]
+    assert json.loads((tmp_path / "state.json").read_text()) == {'orders': 3}
+
+
+def test_headless_import_leaves_out_tk():
+    code = "import sys, HatHive; print('tkinter' in sys.modules, 'concurrent.futures' in sys.modules)"
+    result = subprocess.run([sys.executable, "-c", code], cwd=os.path.dirname(os.path.abspath(HatHive.__file__)),
+                            capture_output=True, text=True, check=True)
+    assert result.stdout.split() == ["False", "False"]
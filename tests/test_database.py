@@ -0,0 +1,91 @@
+from decimal import Decimal
+
+import pytest
+
+from HatHive import MIGRATIONS, DatabaseError, DatabaseManager, SQLiteBackend, money
+from conftest import open_db
+
+
+def test_checkout_returns_connection_after_error(db):
+    with pytest.raises(RuntimeError):
+        with db.checkout() as connection:
+            with db.checkout() as nested:
+                assert nested is connection  # nested checkouts share the connection
+            raise RuntimeError("boom")
+    assert db.pool.in_use == 0
+    with db.checkout() as again:
+        assert again is connection
+
+
+def test_transaction_rolls_back_on_exception(db):
+    with pytest.raises(RuntimeError):
+        with db.transaction() as tx:
+            tx.execute("INSERT INTO hats (brand_id, brand_name, style, size, quantity, price)"
+                       " VALUES (1, 'Acme', 'Fedora', 7, 3, 10)")
+            raise RuntimeError("boom")
+    assert db.fetch("SELECT COUNT(*) FROM hats") == [(0,)]
+
+
+def test_checkout_times_out_when_pool_is_exhausted(tmp_path):
+    db = DatabaseManager(SQLiteBackend(str(tmp_path / "pool.db")), pool_size=1, slow_query_log=None)
+    db.connect()
+    try:
+        db.pool.timeout = 0.05
+        with db.checkout():
+            with pytest.raises(DatabaseError):
+                db.pool.checkout()
+    finally:
+        db.close()
+
+
+def test_closed_pool_refuses_checkout(tmp_path):
+    db = open_db(tmp_path / "closed.db")
+    db.close()
+    with pytest.raises(DatabaseError):
+        db.fetch("SELECT 1")
+
+
+def test_failed_statements_are_counted_not_printed(db, capsys):
+    capsys.readouterr()
+    with pytest.raises(db.backend.Error):
+        db.fetch("SELECT * FROM no_such_table")
+    with pytest.raises(db.backend.Error):
+        db.executemany("INSERT INTO no_such_table VALUES (%s)", [(1,), (2,)])
+    assert capsys.readouterr().out == ""
+    assert db.stats.errors == 2
+
+
+def test_migrate_is_idempotent(tmp_path):
+    path = tmp_path / "twice.db"
+    db = open_db(path)
+    db.migrate()
+    versions = db.fetch("SELECT version FROM schema_version ORDER BY version")
+    db.close()
+    db = open_db(path)
+    try:
+        assert db.fetch("SELECT version FROM schema_version ORDER BY version") == versions
+        assert [version for version, in versions] == [migration[0] for migration in MIGRATIONS]
+    finally:
+        db.close()
+
+
+def test_write_statements_report_rowcount_and_lastrowid(db):
+    with db.transaction() as tx:
+        result = tx.execute("INSERT INTO hats (brand_id, brand_name, style, size, quantity, price)"
+                            " VALUES (1, 'Acme', 'Fedora', 7, 3, 10)")
+    assert (result.rowcount, result.lastrowid) == (1, 1)
+    assert db.execute("UPDATE hats SET quantity = 4") == 1
+
+
+def test_money_is_quantized_to_cents():
+    assert money(19.99) == Decimal("19.99")
+    assert money(3) == Decimal("3.00")
+    assert str(money(Decimal("2.5"))) == "2.50"
+
+
+def test_sqlite_returns_money_as_decimal(shop):
+    price, = shop.fetch("SELECT price FROM hats WHERE hat_id = 2")[0]
+    assert isinstance(price, Decimal) and str(price) == "9.50"
+    shop.place_order(1, 2, "2024-01-01", 2)
+    tax, total = shop.fetch("SELECT tax, price FROM bills")[0]
+    assert (str(tax), str(total)) == ("1.33", "19.00")
@@ -0,0 +1,120 @@
+import threading
+
+import pytest
+
+from HatHive import OrderError, OrderJournal
+from conftest import stock
+
+
+def test_place_order_writes_order_delivery_and_bill(shop):
+    order_id, total_price, tax = shop.place_order(1, 1, "2024-01-01", 2)
+    assert (str(total_price), str(tax)) == ("39.98", "2.80")
+    assert stock(shop, 1) == 98
+    assert shop.fetch("SELECT order_id, status FROM delivery") == [(order_id, "Scheduled")]
+    assert shop.fetch("SELECT order_id, payment_status FROM bills") == [(order_id, "Pending")]
+
+
+@pytest.mark.parametrize("customer_id, hat_id, quantity, reason", [
+    (9, 1, 1, "Customer ID does not exist."),
+    (1, 9, 1, "Hat ID does not exist."),
+    (1, 2, 6, "stock"),
+])
+def test_rejected_order_changes_nothing(shop, customer_id, hat_id, quantity, reason):
+    with pytest.raises(OrderError, match=reason):
+        shop.place_order(customer_id, hat_id, "2024-01-01", quantity)
+    assert shop.fetch("SELECT COUNT(*) FROM orders") == [(0,)]
+    assert (stock(shop, 1), stock(shop, 2)) == (100, 5)
+
+
+def test_concurrent_orders_never_oversell(shop):
+    sold, refused = [], []
+
+    def clerk():
+        for _ in range(5):
+            try:
+                sold.append(shop.place_order(1, 2, "2024-03-01", 1))
+            except OrderError:
+                refused.append(1)
+
+    clerks = [threading.Thread(target=clerk) for _ in range(4)]
+    for thread in clerks:
+        thread.start()
+    for thread in clerks:
+        thread.join()
+    assert (len(sold), len(refused)) == (5, 15)
+    assert stock(shop, 2) == 0
+    assert shop.fetch("SELECT SUM(quantity) FROM orders WHERE hat_id = 2") == [(5,)]
+
+
+def test_bulk_orders_reject_rows_individually(shop):
+    orders = [
+        {'customer_id': 1, 'hat_id': 1, 'date': "2024-02-01", 'quantity': 1},
+        {'customer_id': 9, 'hat_id': 1, 'date': "2024-02-01", 'quantity': 1},
+        {'customer_id': 2, 'hat_id': 2, 'date': "2024-02-01", 'quantity': 4},
+        {'customer_id': 2, 'hat_id': 2, 'date': "2024-02-01", 'quantity': 4},
+        {'customer_id': 1, 'hat_id': 1, 'date': "not a date", 'quantity': 1},
+        {'customer_id': 1, 'hat_id': 1, 'date': "2024-02-01", 'quantity': 2},
+    ]
+    placed, rejected = shop.place_orders(orders, chunk_size=4)
+    assert [index for index, _ in placed] == [0, 2, 5]
+    assert [index for index, _ in rejected] == [1, 3, 4]
+    assert (stock(shop, 1), stock(shop, 2)) == (97, 1)
+
+
+def test_bulk_order_ids_match_their_bills_across_id_gaps(shop):
+    # Leave gaps in the order IDs so they are no consecutive block after lastrowid
+    shop.place_order(1, 1, "2024-01-01", 1)
+    shop.execute("INSERT INTO orders (order_id, customer_id, hat_id, date, quantity)"
+                 " VALUES (10, 1, 1, '2024-01-01', 1)")
+    shop.execute("DELETE FROM orders WHERE order_id = 10")
+    placed, rejected = shop.place_orders(
+        [{'customer_id': 1 + i % 2, 'hat_id': 1, 'date': "2024-02-01", 'quantity': 1 + i} for i in range(6)],
+        chunk_size=4)
+    assert not rejected
+    for index, order_id in placed:
+        assert shop.fetch("SELECT quantity FROM orders WHERE order_id = %s", (order_id,)) == [(1 + index,)]
+        price, = shop.fetch("SELECT price FROM bills WHERE order_id = %s", (order_id,))[0]
+        assert str(price) == str((1 + index) * shop.get_hat_price(1))
+    assert shop.fetch("SELECT COUNT(*) FROM orders WHERE journal_key IS NOT NULL OR intake_tag IS NOT NULL") == [(0,)]
+
+
+def test_migration_clears_bulk_tags_from_journal_keys(shop):
+    shop.place_cart(1, [(1, 1)], "2024-01-01", journal_key="0" * 32)
+    shop.place_cart(1, [(1, 1)], "2024-01-01", journal_key="f" * 32 + "-3")
+    shop.execute("DELETE FROM schema_version WHERE version = 14")
+    shop.migrate()
+    assert shop.fetch("SELECT journal_key FROM orders ORDER BY order_id") == [("0" * 32,), (None,)]
+
+
+def test_cart_is_all_or_nothing(shop):
+    with pytest.raises(OrderError):
+        shop.place_cart(1, [(1, 3), (2, 6)], "2024-01-01")
+    assert (stock(shop, 1), stock(shop, 2)) == (100, 5)
+    assert shop.fetch("SELECT COUNT(*) FROM order_lines") == [(0,)]
+
+    order_id, total_price, _ = shop.place_cart(1, [(1, 3), (2, 5), (1, 1)], "2024-01-01")
+    assert (stock(shop, 1), stock(shop, 2)) == (96, 0)
+    assert shop.fetch("SELECT hat_id, quantity FROM order_lines WHERE order_id = %s ORDER BY hat_id",
+                      (order_id,)) == [(1, 4), (2, 5)]
+    assert str(total_price) == "127.46"
+
+
+def test_journal_replay_skips_duplicate_keys(shop, tmp_path):
+    journal = OrderJournal(str(tmp_path / "journal.jsonl"))
+    first = journal.append(1, [(1, 2)], "2024-01-01")
+    journal.append(2, [(2, 9)], "2024-01-01")  # more than in stock
+    # Placed directly under this key before the connection dropped, then journaled
+    shop.place_cart(1, [(1, 1)], "2024-01-01", journal_key="placed-already")
+    journal.append(1, [(1, 1)], "2024-01-01", key="placed-already")
+    journal.db_manager = shop
+    journal.drain()
+    journal.close()
+    assert journal.applied == 2 and len(journal.rejected) == 1
+    assert shop.fetch("SELECT COUNT(*) FROM orders") == [(2,)]
+    assert stock(shop, 1) == 97
+
+    results = shop.replay_orders([{'key': first, 'customer_id': 1, 'lines': [[1, 2]], 'date': "2024-01-01",
+                                   'payment_method': "Credit Card"}])
+    assert results[0][1] is not None and results[0][2] is None
+    assert shop.fetch("SELECT COUNT(*) FROM orders") == [(2,)]
+    assert OrderJournal(str(tmp_path / "journal.jsonl")).backlog() == 0
@@ -0,0 +1,103 @@
+import collections
+import threading
+import time
+
+import HatHive
+from HatHive import PaymentDeclined, PaymentQueue
+
+
+class CountingGateway:
+    def __init__(self, decline=(), fail=()):
+        self.decline = decline
+        self.fail = fail
+        self.calls = collections.Counter()
+        self._lock = threading.Lock()
+
+    def charge(self, bill_id, amount_due, payment_method):
+        with self._lock:
+            self.calls[bill_id] += 1
+        time.sleep(0.005)
+        if bill_id in self.decline:
+            raise PaymentDeclined()
+        if bill_id in self.fail:
+            raise RuntimeError("gateway unavailable")
+        return f"tx-{bill_id}"
+
+
+def statuses(db):
+    return dict(db.fetch("SELECT bill_id, payment_status FROM bills"))
+
+
+def test_payments_record_each_outcome(shop, monkeypatch):
+    monkeypatch.setattr(HatHive, "PAYMENT_ATTEMPTS", 1)
+    for _ in range(3):
+        shop.place_order(1, 1, "2024-01-01", 1)
+    gateway = CountingGateway(decline={2}, fail={3})
+    payments = shop.start_payments(gateway, workers=2)
+    payments.drain()
+    payments.stop()
+    assert statuses(shop) == {1: "Paid", 2: "Declined", 3: "Pending"}
+    assert (payments.paid, payments.declined, payments.failed) == (1, 1, 1)
+    assert shop.fetch("SELECT transaction_id, claimed_until FROM bills WHERE bill_id = 1") == [("tx-1", None)]
+
+
+def test_outcomes_are_written_in_batches(shop, monkeypatch):
+    for _ in range(10):
+        shop.place_order(1, 1, "2024-01-01", 1)
+    transactions = []
+    transaction = shop.transaction
+
+    def counting_transaction():
+        transactions.append(1)
+        return transaction()
+
+    monkeypatch.setattr(shop, "transaction", counting_transaction)
+    payments = shop.start_payments(CountingGateway(), workers=4)
+    payments.drain()
+    payments.stop()
+    assert payments.paid == 10
+    assert 1 <= len(transactions) <= 2
+
+
+def test_two_stations_never_charge_a_bill_twice(shop):
+    for _ in range(30):
+        shop.place_order(1, 1, "2024-01-01", 1)
+    # A station that crashed while charging bill 30 left an expired claim
+    shop.execute("UPDATE bills SET payment_status = 'Processing', claimed_until = 1 WHERE bill_id = 30")
+    # And one that is still charging bill 29
+    shop.execute("UPDATE bills SET payment_status = 'Processing', claimed_until = %s WHERE bill_id = 29",
+                 (int(time.time()) + 60,))
+    gateway = CountingGateway()
+    stations = [PaymentQueue(shop, gateway, workers=3) for _ in range(2)]
+    starting = [threading.Thread(target=station.start) for station in stations]
+    for thread in starting:
+        thread.start()
+    for thread in starting:
+        thread.join()
+    for station in stations:
+        station.drain()
+        station.stop()
+    assert max(gateway.calls.values()) == 1
+    assert set(gateway.calls) == set(range(1, 31)) - {29}
+    assert sum(station.paid for station in stations) == 29
+    assert statuses(shop)[29] == "Processing"
+
+
+def test_stop_leaves_queued_bills_pending(shop):
+    for _ in range(20):
+        shop.place_order(1, 1, "2024-01-01", 1)
+
+    class SlowGateway(CountingGateway):
+        def charge(self, bill_id, amount_due, payment_method):
+            time.sleep(0.05)
+            return super().charge(bill_id, amount_due, payment_method)
+
+    payments = shop.start_payments(SlowGateway(), workers=1)
+    payments.stop()
+    drained = threading.Thread(target=payments.drain, daemon=True)
+    drained.start()
+    drained.join(timeout=5)
+    assert not drained.is_alive()
+    assert payments.counters()['payments_queued'] == 0
+    assert payments.paid < 20
+    assert list(statuses(shop).values()).count("Pending") == 20 - payments.paid
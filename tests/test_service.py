@@ -0,0 +1,75 @@
+import http.client
+import json
+import threading
+import urllib.error
+import urllib.request
+
+import pytest
+
+from HatHive import HatHiveService, make_service_server
+
+
+@pytest.fixture
+def api(shop):
+    server = make_service_server(("127.0.0.1", 0), HatHiveService(shop))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    def call(path, body=None):
+        data = json.dumps(body).encode() if body is not None else None
+        request = urllib.request.Request(f"http://127.0.0.1:{server.server_port}{path}", data=data,
+                                         headers={'Content-Type': "application/json"})
+        try:
+            with urllib.request.urlopen(request) as response:
+                return response.status, json.loads(response.read())
+        except urllib.error.HTTPError as e:
+            return e.code, json.loads(e.read())
+
+    call.port = server.server_port
+    yield call
+    server.shutdown()
+    server.server_close()
+
+
+def test_health_and_pages(api):
+    assert api("/health") == (200, {'status': "ok"})
+    status, page = api("/hats?limit=1")
+    assert status == 200 and len(page['rows']) == 1 and page['has_more']
+
+
+def test_order_status_codes(api):
+    status, order = api("/orders", {'customer_id': 1, 'hat_id': 2, 'quantity': 2, 'date': "2024-01-01"})
+    assert status == 201 and order['total_price'] == "19.00" and order['payment_status'] == "Pending"
+    assert api("/orders", {'customer_id': 1, 'hat_id': 2, 'quantity': 4})[0] == 409
+    assert api("/orders", {'customer_id': "x", 'hat_id': 2, 'quantity': 1})[0] == 400
+    assert api("/orders/bulk", {'orders': "not a list"})[0] == 400
+
+
+@pytest.mark.parametrize("length", ["-1", "abc"])
+def test_bad_content_length_is_rejected_at_once(api, length):
+    connection = http.client.HTTPConnection("127.0.0.1", api.port, timeout=5)
+    try:
+        connection.putrequest("POST", "/orders")
+        connection.putheader("Content-Length", length)
+        connection.endheaders()
+        response = connection.getresponse()
+        assert response.status == 400
+        assert json.loads(response.read()) == {'error': "Content-Length must be a non-negative integer."}
+    finally:
+        connection.close()
+
+
+def test_not_found(api):
+    assert api("/nowhere")[0] == 404
+    assert api("/hats/99")[0] == 404
+
+
+@pytest.mark.parametrize("path", [
+    "/hats?limit=0",
+    "/search/customers?q=a&limit=-1",
+    "/deliveries/week?limit=-5",
+    "/reports/daily?limit=-1",
+])
+def test_non_positive_limits_are_rejected(api, path):
+    status, body = api(path)
+    assert status == 400 and body == {'error': "limit must be positive."}